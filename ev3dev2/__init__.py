@@ -25,12 +25,11 @@
 
 import sys
 import os
-import io
 import fnmatch
 import re
-import stat
 import errno
 from os.path import abspath
+from ev3dev2.backend import SysfsBackend, ATTRIBUTE_TYPES, _FastAttribute
 
 try:
     # if we are in a released build, there will be an auto-generated "version"
@@ -99,6 +98,139 @@ def get_current_platform():
 
 
 # -----------------------------------------------------------------------------
+# The backend doing all the attribute I/O, see ev3dev2.backend
+_backend = SysfsBackend()
+
+
+def get_backend():
+    """
+    Returns the backend used for the attribute I/O of the devices.
+    """
+    return _backend
+
+
+def set_backend(backend):
+    """
+    Makes the devices use ``backend`` (see :py:mod:`ev3dev2.backend`) for their
+    attribute I/O. Devices created before keep their open attributes, so this
+    should be called before creating any.
+    """
+    global _backend
+    _backend = backend
+    refresh_device_index()
+
+
+# Process-wide index of the /sys/class/<class> directories, shared by all the
+# Device constructors and list_device_names(). Maps a class path to a list of
+# [name, token, attribute values] entries, where token changes whenever the
+# device is replaced (see the backends' scan()) and the attribute values
+# cache the _INDEXED_ATTRIBUTES read so far.
+_device_index = {}
+
+# Attributes that never change for the lifetime of a device
+_INDEXED_ATTRIBUTES = ('address', 'driver_name')
+
+# The last values written to the shadowed setpoints of each device (see
+# Device.invalidate_shadow()), keyed by device path. All the objects of a
+# device share the same dict, so a write through one of them is seen by the
+# others.
+_shadows = {}
+
+
+def _shared_shadow(path):
+    # A new object starts from an empty shadow: the device may have been
+    # changed while no object was watching it
+    shadow = _shadows.setdefault(path, {})
+    shadow.clear()
+    return shadow
+
+
+def _scan_device_class(class_path):
+    """
+    Lists the devices of a class directory, reusing the attribute values
+    already indexed for the devices that did not change since the last scan.
+    """
+    old = dict((name, (token, values)) for name, token, values in _device_index.get(class_path, ()))
+    devices = []
+
+    for name, token in _backend.scan(class_path):
+        old_token, values = old.get(name, (None, None))
+
+        if old_token != token:
+            values = {}
+
+        devices.append([name, token, values])
+
+    _device_index[class_path] = devices
+    return devices
+
+
+def refresh_device_index(class_path=None):
+    """
+    Drops the cached device index used to look up devices, for a single class
+    path (e.g. ``/sys/class/tacho-motor``) or for all of them. Call this after
+    devices were plugged or unplugged if the change is not picked up
+    otherwise.
+    """
+    if class_path is None:
+        _device_index.clear()
+    else:
+        _device_index.pop(class_path, None)
+
+
+def _matching_devices(class_path, devices, name_pattern, kwargs):
+    def matches(path, values, attribute, pattern):
+        value = values.get(attribute)
+
+        if value is None:
+            try:
+                value = _backend.read_attribute(path + '/' + attribute)
+            except Exception:
+                return False
+
+            if attribute in _INDEXED_ATTRIBUTES:
+                values[attribute] = value
+
+        if isinstance(pattern, list):
+            return any([value.find(p) >= 0 for p in pattern])
+        else:
+            return value.find(pattern) >= 0
+
+    for name, token, values in devices:
+        if fnmatch.fnmatch(name, name_pattern):
+            path = class_path + '/' + name
+            if all([matches(path, values, k, kwargs[k]) for k in kwargs]):
+                yield name, token
+
+
+def _find_device_name(class_path, name_pattern, kwargs):
+    """
+    Returns the name of the first device matching the parameters, or None.
+
+    The index is trusted as long as the device it points to is still the
+    same; a stale entry or a miss (the device may have been plugged in since
+    the last scan) rescans the class directory once.
+    """
+    devices = _device_index.get(class_path)
+
+    if devices is not None:
+        for name, token in _matching_devices(class_path, devices, name_pattern, kwargs):
+            try:
+                if _backend.token(class_path + '/' + name) == token:
+                    return name
+            except OSError:
+                pass
+            break
+
+    if not _backend.is_device_class(class_path):
+        return None
+
+    for name, token in _matching_devices(class_path, _scan_device_class(class_path), name_pattern, kwargs):
+        return name
+
+    return None
+
+
 def list_device_names(class_path, name_pattern, **kwargs):
     """
     This is a generator function that lists names of all devices matching the
@@ -116,26 +248,14 @@ def list_device_names(class_path, name_pattern, **kwargs):
             enough.
     """
 
-    if not os.path.isdir(class_path):
+    if not _backend.is_device_class(class_path):
         return
 
-    def matches(attribute, pattern):
-        try:
-            with io.FileIO(attribute) as f:
-                value = f.read().strip().decode()
-        except Exception:
-            return False
-
-        if isinstance(pattern, list):
-            return any([value.find(p) >= 0 for p in pattern])
-        else:
-            return value.find(pattern) >= 0
-
-    for f in os.listdir(class_path):
-        if fnmatch.fnmatch(f, name_pattern):
-            path = class_path + '/' + f
-            if all([matches(path + '/' + k, kwargs[k]) for k in kwargs]):
-                yield f
+    # The directory itself is always rescanned so that the listing is
+    # complete, but address and driver_name of known devices come from the
+    # index instead of being read again.
+    for name, token in _matching_devices(class_path, _scan_device_class(class_path), name_pattern, kwargs):
+        yield name
 
 
 def library_load_warning_message(library_name, dependent_class):
@@ -165,6 +285,8 @@ class Device(object):
         '_path',
         '_device_index',
         '_attr_cache',
+        '_attr_handles',
+        '_shadow',
         'kwargs',
     ]
 
@@ -172,6 +294,25 @@ class Device(object):
 
     _DEVICE_INDEX = re.compile(r'^.*(\d+)$')
 
+    # Used by read_attrs() to decode attribute values. Attributes listed here
+    # are returned as an int or as a list of flags, everything else is
+    # returned as a string.
+    _INT_ATTRIBUTES = ()
+    _SET_ATTRIBUTES = ()
+
+    # read_attrs() plans, keyed by (class, attribute names)
+    _READ_PLANS = {}
+
+    # Write-only setpoints whose last written value is remembered, so that
+    # writing the same value again does not touch sysfs (see invalidate_shadow())
+    _SHADOWED_ATTRIBUTES = ()
+
+    #: Opt-in fast I/O path. When True, attribute files opened from then on
+    #: are read with ``os.preadv()`` into preallocated buffers and integer
+    #: values are parsed straight from the raw bytes. Ignored where
+    #: ``os.preadv()`` is not available (e.g. micropython).
+    FAST_IO = False
+
     def __init__(self, class_name, name_pattern='*', name_exact=False, **kwargs):
         """Spin through the Linux sysfs class for the device type and find
         a device that matches the provided name pattern and attributes (if any).
@@ -200,6 +341,8 @@ class Device(object):
         classpath = abspath(Device.DEVICE_ROOT_PATH + '/' + class_name)
         self.kwargs = kwargs
         self._attr_cache = {}
+        self._attr_handles = {}
+        self._shadow = {}
 
         def get_index(file):
             match = Device._DEVICE_INDEX.match(file)
@@ -211,12 +354,15 @@ class Device(object):
         if name_exact:
             self._path = classpath + '/' + name_pattern
             self._device_index = get_index(name_pattern)
+            self._shadow = _shared_shadow(self._path)
         else:
-            try:
-                name = next(list_device_names(classpath, name_pattern, **kwargs))
+            name = _find_device_name(classpath, name_pattern, kwargs)
+
+            if name is not None:
                 self._path = classpath + '/' + name
                 self._device_index = get_index(name)
-            except StopIteration:
+                self._shadow = _shared_shadow(self._path)
+            else:
                 self._path = None
                 self._device_index = None
 
@@ -235,20 +381,44 @@ class Device(object):
     def __lt__(self, other):
         return str(self) < str(other)
 
-    def _attribute_file_open(self, name):
-        path = os.path.join(self._path, name)
-        mode = stat.S_IMODE(os.stat(path)[stat.ST_MODE])
-        r_ok = mode & stat.S_IRGRP
-        w_ok = mode & stat.S_IWGRP
-
-        if r_ok and w_ok:
-            mode_str = 'r+'
-        elif w_ok:
-            mode_str = 'w'
-        else:
-            mode_str = 'r'
+    def _rebind(self, path):
+        """
+        Points this object at another sysfs device directory (e.g. the same
+        motor after it was unplugged and plugged back in) and drops the
+        attribute file handles and cached values that belonged to the old one.
+        """
+        def is_handle(value):
+            return isinstance(value, ATTRIBUTE_TYPES)
+
+        names = list(getattr(self, '__dict__', {}))
+        for cls in type(self).__mro__:
+            names.extend(getattr(cls, '__slots__', ()))
+
+        for name in names:
+            value = getattr(self, name, None)
+
+            if is_handle(value):
+                value.close()
+                setattr(self, name, None)
+            elif isinstance(value, list) and any([is_handle(v) for v in value]):
+                for v in value:
+                    if is_handle(v):
+                        v.close()
+                setattr(self, name, [None if is_handle(v) else v for v in value])
 
-        return io.FileIO(path, mode_str)
+        for handle in self._attr_handles.values():
+            handle.close()
+
+        self._attr_cache = {}
+        self._attr_handles = {}
+        self._shadow = _shared_shadow(path)
+        self._path = path
+
+        match = Device._DEVICE_INDEX.match(os.path.basename(path))
+        self._device_index = int(match.group(1)) if match else None
+
+    def _attribute_file_open(self, name):
+        return _backend.open_attribute(os.path.join(self._path, name), Device.FAST_IO)
 
     def _get_attribute(self, attribute, name):
         """Device attribute getter"""
@@ -302,7 +472,30 @@ class Device(object):
             chain_exception(DeviceNotFound("%s is no longer connected" % self), driver_error)
         raise driver_error
 
+    # The fast I/O path (see FAST_IO) skips _get_attribute()/_set_attribute()
+    # and goes through these instead
+    def _get_fast_int(self, attribute, name):
+        try:
+            return attribute.read_int()
+        except Exception as ex:
+            self._raise_friendly_access_error(ex, name, None)
+
+    def _get_fast_string(self, attribute, name):
+        try:
+            return attribute.read_str()
+        except Exception as ex:
+            self._raise_friendly_access_error(ex, name, None)
+
+    def _set_fast_int(self, attribute, name, value):
+        try:
+            attribute.write_int(value)
+        except Exception as ex:
+            self._raise_friendly_access_error(ex, name, value)
+
     def get_attr_int(self, attribute, name):
+        if attribute.__class__ is _FastAttribute:
+            return attribute, self._get_fast_int(attribute, name)
+
         attribute, value = self._get_attribute(attribute, name)
         return attribute, int(value)
 
@@ -315,13 +508,30 @@ class Device(object):
 
         return (filehandle, value)
 
-    def set_attr_int(self, attribute, name, value):
-        return self._set_attribute(attribute, name, str(int(value)))
+    def set_attr_int(self, attribute, name, value, force=False):
+        value = int(value)
+        shadowed = name in self._SHADOWED_ATTRIBUTES
+
+        if shadowed and not force and self._shadow.get(name) == value:
+            return attribute
+
+        if attribute.__class__ is _FastAttribute:
+            self._set_fast_int(attribute, name, value)
+        else:
+            attribute = self._set_attribute(attribute, name, str(value))
+
+        if shadowed:
+            self._shadow[name] = value
+
+        return attribute
 
     def set_attr_raw(self, attribute, name, value):
         return self._set_attribute(attribute, name, value)
 
     def get_attr_string(self, attribute, name):
+        if attribute.__class__ is _FastAttribute:
+            return attribute, self._get_fast_string(attribute, name)
+
         return self._get_attribute(attribute, name)
 
     def get_cached_attr_string(self, filehandle, keyword):
@@ -333,8 +543,38 @@ class Device(object):
 
         return (filehandle, value)
 
-    def set_attr_string(self, attribute, name, value):
-        return self._set_attribute(attribute, name, value)
+    def set_attr_string(self, attribute, name, value, force=False):
+        shadowed = name in self._SHADOWED_ATTRIBUTES
+
+        if shadowed and not force and self._shadow.get(name) == value:
+            return attribute
+
+        attribute = self._set_attribute(attribute, name, value)
+
+        if shadowed:
+            self._shadow[name] = value
+
+        return attribute
+
+    def invalidate_shadow(self, *names):
+        """
+        Forget the last written value of the given setpoint attributes (all of
+        them if no name is given), so that the next write goes to the device
+        even if the value did not change.
+
+        Setpoints such as ``speed_sp`` are only written when their value
+        differs from the one written last time. All the objects of a device
+        (e.g. a ``LargeMotor`` and the same motor in a ``MoveTank``) share
+        these values, so a write through one of them is seen by the others,
+        and this forgets them for all. Call this if something else (another
+        process, or a command like ``reset``) may have changed them behind our
+        back.
+        """
+        if names:
+            for name in names:
+                self._shadow.pop(name, None)
+        else:
+            self._shadow.clear()
 
     def get_attr_line(self, attribute, name):
         return self._get_attribute(attribute, name)
@@ -360,6 +600,117 @@ class Device(object):
                 return v
         return ""
 
+    def _read_plan(self, names):
+        key = (self.__class__, names)
+        plan = Device._READ_PLANS.get(key)
+
+        if plan is None:
+            plan = []
+            for name in names:
+                # Share the file handle with the matching property if there is one
+                slot = '_' + name
+                if not hasattr(self.__class__, slot):
+                    slot = None
+
+                if name in self._INT_ATTRIBUTES:
+                    decode = int
+                elif name in self._SET_ATTRIBUTES:
+                    decode = list
+                else:
+                    decode = str
+
+                plan.append((name, slot, decode))
+
+            plan = tuple(plan)
+            Device._READ_PLANS[key] = plan
+
+        return plan
+
+    def read_attrs(self, *names):
+        """
+        Reads several attributes in a single pass and returns their values as
+        a tuple, in the same order as ``names``. Names are sysfs attribute
+        names, e.g. ``position`` or ``state``.
+
+        This is much cheaper than reading each property in turn when sampling
+        the same attributes over and over, e.g. in a control loop. File handles
+        are shared with the corresponding properties.
+
+        Example::
+
+            position, speed, state = motor.read_attrs('position', 'speed', 'state')
+        """
+        values = []
+        name = None
+
+        try:
+            for (name, slot, decode) in self._read_plan(names):
+                if slot is None:
+                    attribute = self._attr_handles.get(name)
+                else:
+                    attribute = getattr(self, slot)
+
+                if attribute is None:
+                    attribute = self._attribute_file_open(name)
+
+                    if slot is None:
+                        self._attr_handles[name] = attribute
+                    else:
+                        setattr(self, slot, attribute)
+                else:
+                    attribute.seek(0)
+
+                if decode is int and attribute.__class__ is _FastAttribute:
+                    values.append(attribute.read_int())
+                    continue
+
+                value = attribute.read().strip().decode()
+
+                if decode is int:
+                    value = int(value)
+                elif decode is list:
+                    value = [v.strip('[]') for v in value.split()]
+
+                values.append(value)
+        except Exception as ex:
+            self._raise_friendly_access_error(ex, name, None)
+
+        return tuple(values)
+
+    def _read_attrs_each(self, *names):
+        # read_attrs() going through the per-attribute I/O methods, so that
+        # ev3dev2.stats records every read (it swaps it in while enabled)
+        values = []
+
+        for (name, slot, decode) in self._read_plan(names):
+            if slot is None:
+                attribute = self._attr_handles.get(name)
+            else:
+                attribute = getattr(self, slot)
+
+            if decode is int and attribute.__class__ is _FastAttribute:
+                values.append(self._get_fast_int(attribute, name))
+                continue
+
+            if attribute is None:
+                attribute, value = self._get_attribute(None, name)
+
+                if slot is None:
+                    self._attr_handles[name] = attribute
+                else:
+                    setattr(self, slot, attribute)
+            else:
+                attribute, value = self._get_attribute(attribute, name)
+
+            if decode is int:
+                value = int(value)
+            elif decode is list:
+                value = [v.strip('[]') for v in value.split()]
+
+            values.append(value)
+
+        return tuple(values)
+
     @property
     def device_index(self):
         return self._device_index
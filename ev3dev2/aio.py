@@ -0,0 +1,333 @@
+"""
+asyncio versions of the blocking waits and movements.
+
+The classes in this module wrap a regular device object and provide
+coroutines for the calls that would otherwise block. Everything else is
+passed through to the wrapped object, so one event loop can drive many
+motors, sensors and e.g. a web API without a thread per activity.
+
+Motor waits are woken up by the ``POLLPRI`` events of the ``state``
+attribute, the same events used by :py:meth:`ev3dev2.motor.Motor.wait`.
+
+Example::
+
+    import asyncio
+    from ev3dev2.aio import AsyncMoveTank, AsyncTouchSensor
+    from ev3dev2.motor import MoveTank, OUTPUT_A, OUTPUT_B
+    from ev3dev2.sensor.lego import TouchSensor
+
+    async def main():
+        tank = AsyncMoveTank(MoveTank(OUTPUT_A, OUTPUT_B))
+        touch = AsyncTouchSensor(TouchSensor())
+
+        await touch.wait_for_bump()
+        await tank.on_for_degrees(50, 50, 360)
+
+    asyncio.get_event_loop().run_until_complete(main())
+
+This module requires Python 3.5 or later and is not available on micropython.
+"""
+
+import asyncio
+import select
+from ev3dev2.motor import WAIT_RUNNING_TIMEOUT
+from ev3dev2.stopwatch import StopWatch
+
+# Conditions are checked at least this often (in seconds) even if no event is
+# reported. See https://github.com/ev3dev/ev3dev-lang-python/issues/583
+POLL_INTERVAL = 0.1
+
+
+class _AsyncWrapper(object):
+    def __init__(self, device):
+        self.device = device
+
+    def __getattr__(self, name):
+        return getattr(self.device, name)
+
+    def __str__(self):
+        return str(self.device)
+
+    def __repr__(self):
+        return self.__str__()
+
+
+async def _wait_for_event(event, timeout):
+    event.clear()
+
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+class AsyncMotor(_AsyncWrapper):
+    """
+    Wraps a :py:class:`ev3dev2.motor.Motor` and provides coroutines for its
+    waits.
+
+    Example::
+
+        motor = AsyncMotor(LargeMotor(OUTPUT_A))
+        motor.run_forever(speed_sp=500)
+        await motor.wait_until('stalled')
+    """
+    async def wait(self, cond, timeout=None, flags=False):
+        """
+        Waits until ``cond(self.state)`` is ``True``. Gives up when
+        ``timeout`` (in milliseconds) is reached. If ``flags`` is True,
+        ``cond`` is given ``self.state_flags`` instead.
+
+        Returns ``True`` if the condition is met, and ``False`` if the timeout
+        is reached.
+        """
+        motor = self.device
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout / 1000 if timeout is not None else None
+
+        if motor._state is None:
+            motor._state = motor._attribute_file_open('state')
+
+        # The event loop cannot wait for POLLPRI directly, but an epoll object
+        # becomes readable when one of the files it watches has an event.
+        epoll = select.epoll()
+        woken = asyncio.Event()
+
+        def on_state_event():
+            epoll.poll(0)
+            woken.set()
+
+        try:
+            epoll.register(motor._state.fileno(), select.EPOLLPRI)
+        except (OSError, AttributeError):
+            # Not a sysfs attribute (e.g. regular files or the memory backend), just poll
+            watching = False
+        else:
+            loop.add_reader(epoll.fileno(), on_state_event)
+            watching = True
+
+        try:
+            while True:
+                if cond(motor.state_flags if flags else motor.state):
+                    return True
+
+                delay = POLL_INTERVAL
+
+                if deadline is not None:
+                    remaining = deadline - loop.time()
+
+                    if remaining <= 0:
+                        # Final check when user timeout is reached
+                        return cond(motor.state_flags if flags else motor.state)
+
+                    delay = min(delay, remaining)
+
+                await _wait_for_event(woken, delay)
+        finally:
+            if watching:
+                loop.remove_reader(epoll.fileno())
+            epoll.close()
+
+    async def wait_until_not_moving(self, timeout=None):
+        """
+        Waits until ``running`` is not in ``self.state`` or ``stalled`` is in
+        ``self.state``.
+        """
+        motor = self.device
+        return await self.wait(
+            lambda flags: not (flags & motor.STATE_FLAG_RUNNING) or (flags & motor.STATE_FLAG_STALLED) != 0,
+            timeout,
+            flags=True)
+
+    async def wait_until(self, s, timeout=None):
+        """
+        Waits until ``s`` is in ``self.state``.
+        """
+        bit = self.device.STATE_FLAGS.get(s)
+
+        if bit is None:
+            return await self.wait(lambda state: s in state, timeout)
+
+        return await self.wait(lambda flags: (flags & bit) != 0, timeout, flags=True)
+
+    async def wait_while(self, s, timeout=None):
+        """
+        Waits until ``s`` is not in ``self.state``.
+        """
+        bit = self.device.STATE_FLAGS.get(s)
+
+        if bit is None:
+            return await self.wait(lambda state: s not in state, timeout)
+
+        return await self.wait(lambda flags: (flags & bit) == 0, timeout, flags=True)
+
+
+class AsyncMoveTank(_AsyncWrapper):
+    """
+    Wraps a :py:class:`ev3dev2.motor.MoveTank` (or any of its subclasses) and
+    provides coroutines for the movements that block. Both motors are waited
+    for concurrently.
+    """
+    def __init__(self, device):
+        super(AsyncMoveTank, self).__init__(device)
+        self.left_motor = AsyncMotor(device.left_motor)
+        self.right_motor = AsyncMotor(device.right_motor)
+
+    async def _block(self):
+        motors = (self.left_motor, self.right_motor)
+        await asyncio.gather(*[motor.wait_until('running', timeout=WAIT_RUNNING_TIMEOUT) for motor in motors])
+        await asyncio.gather(*[motor.wait_until_not_moving() for motor in motors])
+
+    async def on_for_degrees(self, left_speed, right_speed, degrees, brake=True, block=True):
+        """
+        Same as :py:meth:`ev3dev2.motor.MoveTank.on_for_degrees`.
+        """
+        self.device.on_for_degrees(left_speed, right_speed, degrees, brake, block=False)
+
+        if block:
+            await self._block()
+
+    async def on_for_rotations(self, left_speed, right_speed, rotations, brake=True, block=True):
+        """
+        Same as :py:meth:`ev3dev2.motor.MoveTank.on_for_rotations`.
+        """
+        await self.on_for_degrees(left_speed, right_speed, rotations * 360, brake, block)
+
+    async def on_for_seconds(self, left_speed, right_speed, seconds, brake=True, block=True):
+        """
+        Same as :py:meth:`ev3dev2.motor.MoveTank.on_for_seconds`.
+        """
+        self.device.on_for_seconds(left_speed, right_speed, seconds, brake, block=False)
+
+        if block:
+            await self._block()
+
+
+class AsyncTouchSensor(_AsyncWrapper):
+    """
+    Wraps a :py:class:`ev3dev2.sensor.lego.TouchSensor`. The kernel does not
+    report sensor value changes, so the waits poll every ``sleep_ms``
+    milliseconds, yielding to the event loop in between.
+    """
+    async def _wait(self, wait_for_press, timeout_ms, sleep_ms):
+        stopwatch = StopWatch()
+        stopwatch.start()
+
+        while True:
+            if self.device.is_pressed == wait_for_press:
+                return True
+
+            if timeout_ms is not None and stopwatch.value_ms >= timeout_ms:
+                return False
+
+            await asyncio.sleep(sleep_ms / 1000 if sleep_ms else 0)
+
+    async def wait_for_pressed(self, timeout_ms=None, sleep_ms=10):
+        """
+        Waits for the touch sensor to be pressed down.
+        """
+        return await self._wait(True, timeout_ms, sleep_ms)
+
+    async def wait_for_released(self, timeout_ms=None, sleep_ms=10):
+        """
+        Waits for the touch sensor to be released.
+        """
+        return await self._wait(False, timeout_ms, sleep_ms)
+
+    async def wait_for_bump(self, timeout_ms=None, sleep_ms=10):
+        """
+        Waits for the touch sensor to be pressed down and then released.
+        Both actions must happen within ``timeout_ms``.
+        """
+        stopwatch = StopWatch()
+        stopwatch.start()
+
+        if await self.wait_for_pressed(timeout_ms, sleep_ms):
+            if timeout_ms is not None:
+                timeout_ms -= stopwatch.value_ms
+            return await self.wait_for_released(timeout_ms, sleep_ms)
+
+        return False
+
+
+class AsyncButton(_AsyncWrapper):
+    """
+    Wraps a :py:class:`ev3dev2.button.Button`. The waits are woken up by the
+    key events of the buttons' input device.
+    """
+    def __init__(self, device):
+        super(AsyncButton, self).__init__(device)
+        self._evdev_device = None
+
+    async def _wait(self, wait_for_button_press, wait_for_button_release, timeout_ms):
+        if isinstance(wait_for_button_press, str):
+            wait_for_button_press = [wait_for_button_press]
+
+        if isinstance(wait_for_button_release, str):
+            wait_for_button_release = [wait_for_button_release]
+
+        if self._evdev_device is None:
+            self._evdev_device = self.device.evdev_device
+
+        evdev_device = self._evdev_device
+        loop = asyncio.get_event_loop()
+        stopwatch = StopWatch()
+        stopwatch.start()
+        woken = asyncio.Event()
+
+        def on_input_event():
+            try:
+                for event in evdev_device.read():
+                    pass
+            except BlockingIOError:
+                pass
+            woken.set()
+
+        loop.add_reader(evdev_device.fd, on_input_event)
+
+        try:
+            while True:
+                pressed = self.device.buttons_pressed
+
+                if all([button in pressed for button in wait_for_button_press]) and \
+                        not any([button in pressed for button in wait_for_button_release]):
+                    return True
+
+                if timeout_ms is None:
+                    timeout = None
+                else:
+                    timeout = (timeout_ms - stopwatch.value_ms) / 1000
+
+                    if timeout <= 0:
+                        return False
+
+                await _wait_for_event(woken, timeout)
+        finally:
+            loop.remove_reader(evdev_device.fd)
+
+    async def wait_for_pressed(self, buttons, timeout_ms=None):
+        """
+        Waits for ``buttons`` to be pressed down.
+        """
+        return await self._wait(buttons, [], timeout_ms)
+
+    async def wait_for_released(self, buttons, timeout_ms=None):
+        """
+        Waits for ``buttons`` to be released.
+        """
+        return await self._wait([], buttons, timeout_ms)
+
+    async def wait_for_bump(self, buttons, timeout_ms=None):
+        """
+        Waits for ``buttons`` to be pressed down and then released.
+        Both actions must happen within ``timeout_ms``.
+        """
+        stopwatch = StopWatch()
+        stopwatch.start()
+
+        if await self.wait_for_pressed(buttons, timeout_ms):
+            if timeout_ms is not None:
+                timeout_ms -= stopwatch.value_ms
+            return await self.wait_for_released(buttons, timeout_ms)
+
+        return False
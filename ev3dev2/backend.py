@@ -0,0 +1,441 @@
+"""
+Backends doing the attribute I/O of the ``Device`` objects.
+
+By default devices are read and written through the files of the sysfs
+(:py:class:`SysfsBackend`). :py:class:`MemoryBackend` keeps the devices and
+their attributes in memory instead, emulating the sysfs behavior the library
+relies on. It is meant to unit-test and benchmark code off-robot::
+
+    import ev3dev2
+    from ev3dev2.backend import MemoryBackend
+    from ev3dev2.motor import LargeMotor, OUTPUT_A
+
+    backend = MemoryBackend()
+    backend.add_device('tacho-motor', 'motor0', {
+        'address': 'outA', 'driver_name': 'lego-ev3-l-motor', 'speed_sp': '0', 'state': '', ...})
+    ev3dev2.set_backend(backend)
+
+    m = LargeMotor(OUTPUT_A)
+
+A backend provides the following methods:
+
+- ``open_attribute(path, fast)``: returns a file-like object for the attribute
+  file ``path``, with ``seek()``, ``read()``, ``write()`` and ``flush()``
+- ``read_attribute(path)``: returns the value of an attribute, as a string
+- ``is_device_class(class_path)``: True if ``class_path`` is a device class
+  directory, e.g. ``/sys/class/tacho-motor``
+- ``scan(class_path)``: returns the ``(name, token)`` pairs of the devices of a
+  class, where ``token`` changes if a device is replaced under the same name
+- ``token(path)``: returns the token of the device at ``path``, raises
+  ``OSError`` if there is none
+- ``poll()``: returns a ``select.poll``-like object that reports ``POLLPRI``
+  when the value of a registered attribute (e.g. a motor's ``state``) changed
+"""
+
+import os
+import io
+import stat
+import errno
+import select
+from os.path import abspath
+
+_lstat = getattr(os, 'lstat', os.stat)
+
+
+def _device_token(st):
+    try:
+        return (st.st_ino, st.st_ctime_ns)
+    except AttributeError:
+        # micropython returns a plain tuple
+        return (st[1], st[9])
+
+
+class _FastAttribute(object):
+    """
+    An attribute file used by the fast I/O path (see ``Device.FAST_IO``).
+
+    Keeps the raw file descriptor and reads with ``os.preadv()`` into a
+    preallocated buffer, so there is no ``seek()`` system call and no new
+    ``bytes`` object per read. It also implements the subset of the file
+    object interface used by ``Device`` so both paths can share the same code.
+    """
+
+    __slots__ = ['fd', 'buf', 'bufs', 'view', 'pos']
+
+    # Big enough for every numeric attribute, read() grows it when needed
+    BUFFER_SIZE = 128
+
+    def __init__(self, path, mode_str):
+        if mode_str == 'r+':
+            flags = os.O_RDWR
+        elif mode_str == 'w':
+            flags = os.O_WRONLY
+        else:
+            flags = os.O_RDONLY
+
+        self.fd = None
+        self.fd = os.open(path, flags)
+        self.buf = bytearray(self.BUFFER_SIZE)
+        self.bufs = [self.buf]
+        self.view = memoryview(self.buf)
+        self.pos = 0
+
+    def __del__(self):
+        self.close()
+
+    @staticmethod
+    def available():
+        return hasattr(os, 'preadv') and hasattr(os, 'pwrite')
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def seek(self, pos):
+        self.pos = pos
+
+    def flush(self):
+        pass
+
+    def _fill(self, offset):
+        n = os.preadv(self.fd, self.bufs, offset)
+
+        while n == len(self.buf):
+            # The value did not fit, grow the buffer and read it again
+            self.view.release()
+            self.buf.extend(bytearray(len(self.buf)))
+            self.view = memoryview(self.buf)
+            n = os.preadv(self.fd, self.bufs, offset)
+
+        return n
+
+    def read(self, size=-1):
+        n = self._fill(self.pos)
+
+        if 0 <= size < n:
+            n = size
+
+        self.pos += n
+        return self.view[:n].tobytes()
+
+    def read_int(self):
+        # int() accepts the ASCII digits directly (surrounding whitespace
+        # included), which skips the decode()/strip() of the regular path
+        return int(self.buf[:self._fill(0)])
+
+    def read_str(self):
+        return str(self.view[:self._fill(0)], 'ascii').strip()
+
+    def write_int(self, value):
+        os.pwrite(self.fd, b'%d' % value, 0)
+
+    def write(self, value):
+        n = os.pwrite(self.fd, value, self.pos)
+        self.pos += n
+        return n
+
+
+class SysfsBackend(object):
+    """
+    The regular backend, reading and writing the sysfs attribute files.
+    """
+    def open_attribute(self, path, fast=False):
+        mode = stat.S_IMODE(os.stat(path)[stat.ST_MODE])
+        r_ok = mode & stat.S_IRGRP
+        w_ok = mode & stat.S_IWGRP
+
+        if r_ok and w_ok:
+            mode_str = 'r+'
+        elif w_ok:
+            mode_str = 'w'
+        else:
+            mode_str = 'r'
+
+        if fast and _FastAttribute.available():
+            return _FastAttribute(path, mode_str)
+
+        return io.FileIO(path, mode_str)
+
+    def read_attribute(self, path):
+        with io.FileIO(path) as f:
+            return f.read().strip().decode()
+
+    def is_device_class(self, class_path):
+        return os.path.isdir(class_path)
+
+    def scan(self, class_path):
+        if hasattr(os, 'scandir'):
+            it = os.scandir(class_path)
+            try:
+                return [(entry.name, _device_token(entry.stat(follow_symlinks=False))) for entry in it]
+            finally:
+                if hasattr(it, 'close'):
+                    it.close()
+
+        return [(name, self.token(class_path + '/' + name)) for name in os.listdir(class_path)]
+
+    def token(self, path):
+        # The device directories are symlinks that are recreated, with a new
+        # inode, whenever a device is registered
+        return _device_token(_lstat(path))
+
+    def poll(self):
+        return select.poll()
+
+
+class MemoryDevice(object):
+    """
+    A device of a :py:class:`MemoryBackend`. ``attributes`` maps attribute
+    names to their values, as strings.
+
+    Reads and writes of the library go through :py:meth:`show` and
+    :py:meth:`store`, which can be overridden to simulate a driver. Tests and
+    simulations change values with :py:meth:`set`.
+    """
+
+    #: Attributes whose changes are reported by the backend's pollers, like
+    #: the ``state`` attribute of the motors in sysfs
+    NOTIFY_ATTRIBUTES = ('state', )
+
+    def __init__(self, attributes=None):
+        self.attributes = dict(attributes or {})
+        self.events = {}
+        self.path = None
+        self.token = None
+        self.removed = False
+
+    def _check(self, name):
+        if self.removed:
+            raise OSError(errno.ENODEV, 'No such device')
+
+        if name not in self.attributes:
+            raise OSError(errno.ENOENT, 'No such file or directory')
+
+    def show(self, name):
+        """
+        Returns the value read from attribute ``name``.
+        """
+        self._check(name)
+        return self.attributes[name]
+
+    def store(self, name, value):
+        """
+        Called when ``value`` (a string without the trailing newline) is
+        written to attribute ``name``.
+        """
+        self._check(name)
+        self.set(name, value)
+
+    def set(self, name, value):
+        """
+        Sets the value of attribute ``name``, notifying the pollers if it
+        changed and is one of the ``NOTIFY_ATTRIBUTES``.
+        """
+        value = str(value)
+        changed = self.attributes.get(name) != value
+        self.attributes[name] = value
+
+        if changed and name in self.NOTIFY_ATTRIBUTES:
+            self.notify(name)
+
+    def notify(self, name):
+        self.events[name] = self.events.get(name, 0) + 1
+
+
+class MemoryAttribute(object):
+    """
+    An open attribute of a :py:class:`MemoryDevice`. Like a sysfs attribute,
+    every write replaces the value, and every read returns the whole value
+    followed by a newline.
+    """
+
+    __slots__ = ['device', 'name', 'pos', 'seen']
+
+    def __init__(self, device, name):
+        self.device = device
+        self.name = name
+        self.pos = 0
+        self.seen = device.events.get(name, 0)
+
+    def seek(self, pos):
+        self.pos = pos
+
+    def read(self, size=-1):
+        # Reading acknowledges the pending notification, as in sysfs
+        self.seen = self.device.events.get(self.name, 0)
+        data = (self.device.show(self.name) + '\n').encode()
+
+        if size < 0:
+            data = data[self.pos:]
+        else:
+            data = data[self.pos:self.pos + size]
+
+        self.pos += len(data)
+        return data
+
+    def write(self, data):
+        if isinstance(data, bytes):
+            data = data.decode()
+
+        value = data.strip()
+
+        if not value:
+            raise OSError(errno.EINVAL, 'Invalid argument')
+
+        self.device.store(self.name, value)
+        self.pos += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def pending(self):
+        return self.device.events.get(self.name, 0) != self.seen
+
+
+class MemoryPoller(object):
+    """
+    The ``select.poll`` counterpart of :py:class:`MemoryBackend`. Like
+    micropython's, ``poll()`` returns the registered objects rather than file
+    descriptors.
+    """
+    def __init__(self, backend):
+        self.backend = backend
+        self._handles = []
+
+    def register(self, handle, eventmask=select.POLLPRI):
+        if handle not in self._handles:
+            self._handles.append(handle)
+
+    def unregister(self, handle):
+        self._handles.remove(handle)
+
+    def poll(self, timeout=-1):
+        # ev3dev2.clock cannot be imported before ev3dev2 itself is
+        from ev3dev2.clock import get_clock
+
+        clock = get_clock()
+        deadline = clock.deadline(timeout if timeout is not None and timeout >= 0 else None)
+
+        while True:
+            self.backend.tick()
+            ready = [(handle, select.POLLPRI) for handle in self._handles if handle.pending()]
+
+            if ready or clock.expired(deadline):
+                return ready
+
+            clock.sleep(self.backend.poll_interval)
+
+
+class MemoryBackend(object):
+    """
+    Keeps devices and their attributes in memory. Devices are added with
+    :py:meth:`add_device` under ``root`` (the ``Device.DEVICE_ROOT_PATH`` the
+    devices are looked up in).
+    """
+    def __init__(self, root='/sys/class'):
+        self.root = abspath(root)
+        self._devices = {}
+        self._classes = {}
+        self._last_token = 0
+
+        #: How often (in seconds) pollers check the attributes they watch
+        self.poll_interval = 0.001
+
+    def add_device(self, class_name, name, attributes=None, device=None):
+        """
+        Adds device ``name`` (e.g. ``motor0``) to class ``class_name`` (e.g.
+        ``tacho-motor``) and returns it. ``device`` is a
+        :py:class:`MemoryDevice`; by default one is created with the given
+        ``attributes``.
+        """
+        if device is None:
+            device = MemoryDevice(attributes)
+
+        class_path = self.root + '/' + class_name
+        path = class_path + '/' + name
+
+        if path in self._devices:
+            raise ValueError("%s already exists" % path)
+
+        self._last_token += 1
+        device.path = path
+        device.token = self._last_token
+        device.removed = False
+
+        self._devices[path] = device
+        self._classes.setdefault(class_path, []).append(name)
+        return device
+
+    def remove_device(self, class_name, name):
+        """
+        Removes a device, as if it was unplugged.
+        """
+        class_path = self.root + '/' + class_name
+        device = self._devices.pop(class_path + '/' + name)
+        self._classes[class_path].remove(name)
+        device.removed = True
+
+    def device(self, class_name, name):
+        """
+        Returns the :py:class:`MemoryDevice` ``name`` of class ``class_name``.
+        """
+        return self._devices[self.root + '/' + class_name + '/' + name]
+
+    def _lookup(self, path):
+        # <root>/<class>/<device>/<attribute>, where attribute may contain
+        # slashes (e.g. hold_pid/Kp)
+        if path.startswith(self.root + '/'):
+            parts = path[len(self.root) + 1:].split('/', 2)
+
+            if len(parts) == 3:
+                device = self._devices.get(self.root + '/' + parts[0] + '/' + parts[1])
+
+                if device is not None:
+                    return device, parts[2]
+
+        raise OSError(errno.ENOENT, 'No such file or directory')
+
+    def open_attribute(self, path, fast=False):
+        device, name = self._lookup(path)
+        device._check(name)
+        return MemoryAttribute(device, name)
+
+    def read_attribute(self, path):
+        device, name = self._lookup(path)
+        return device.show(name)
+
+    def is_device_class(self, class_path):
+        return class_path in self._classes
+
+    def scan(self, class_path):
+        return [(name, self._devices[class_path + '/' + name].token) for name in self._classes.get(class_path, ())]
+
+    def token(self, path):
+        device = self._devices.get(path)
+
+        if device is None:
+            raise OSError(errno.ENOENT, 'No such file or directory')
+
+        return device.token
+
+    def poll(self):
+        return MemoryPoller(self)
+
+    def tick(self):
+        """
+        Called by the pollers while they wait. Does nothing here, simulations
+        override it to advance their devices.
+        """
+        pass
+
+
+# The attribute objects returned by the backends above
+ATTRIBUTE_TYPES = (io.FileIO, _FastAttribute, MemoryAttribute)
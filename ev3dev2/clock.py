@@ -0,0 +1,139 @@
+"""
+The clock used by the library for its sleeps, timeouts and stopwatches.
+
+By default the library follows the monotonic system clock (:py:class:`Clock`).
+Replacing it with a :py:class:`SimulatedClock` makes every sleep and timeout
+of the library advance a virtual time instead of waiting, so that together
+with :py:class:`ev3dev2.simulation.SimulatedBackend` long programs run in a
+fraction of their real duration, and always the same way::
+
+    from ev3dev2.clock import SimulatedClock, set_clock
+
+    clock = set_clock(SimulatedClock())
+    tank.follow_line(..., follow_for=follow_for_ms, ms=600000)
+    print(clock.now())
+"""
+
+import _thread
+from ev3dev2 import is_micropython
+
+if is_micropython():
+    import utime
+else:
+    import time
+
+
+class Clock(object):
+    """
+    The system clock. Times are in seconds, from an arbitrary origin.
+    """
+    if is_micropython():
+
+        def __init__(self):
+            self._start = utime.ticks_ms()
+
+        def now(self):
+            return utime.ticks_diff(utime.ticks_ms(), self._start) / 1000
+
+        def ticks_ms(self):
+            return utime.ticks_ms()
+
+        def sleep(self, seconds):
+            utime.sleep(seconds)
+    else:
+
+        def now(self):
+            return time.monotonic()
+
+        def ticks_ms(self):
+            return int(time.monotonic() * 1000)
+
+        def sleep(self, seconds):
+            time.sleep(seconds)
+
+    def deadline(self, timeout_ms):
+        """
+        Returns the time at which a timeout of ``timeout_ms`` milliseconds
+        starting now expires, None if ``timeout_ms`` is None.
+        """
+        if timeout_ms is None:
+            return None
+
+        return self.now() + timeout_ms / 1000
+
+    def expired(self, deadline):
+        """
+        True if ``deadline`` (as returned by ``deadline()``) is reached.
+        """
+        return deadline is not None and self.now() >= deadline
+
+    def poll(self, poller, timeout_ms):
+        """
+        Waits for the events of ``poller`` (a ``select.poll`` like object) for
+        up to ``timeout_ms`` milliseconds and returns them.
+        """
+        return poller.poll(timeout_ms)
+
+
+class SimulatedClock(Clock):
+    """
+    A virtual clock: sleeping advances the time at once, and waiting for
+    events advances it by ``step`` seconds until an event is reported or the
+    timeout is reached. The time only moves when the program sleeps or waits,
+    so runs are reproducible.
+
+    When several threads use the clock, every one of them moves the time
+    forward.
+    """
+    def __init__(self, start=0.0, step=0.001):
+        self._now = start
+        self.step = step
+        self._lock = _thread.allocate_lock()
+
+    def now(self):
+        return self._now
+
+    def ticks_ms(self):
+        return int(self._now * 1000)
+
+    def advance(self, seconds):
+        """
+        Moves the time forward by ``seconds``.
+        """
+        with self._lock:
+            self._now += seconds
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.advance(seconds)
+
+    def poll(self, poller, timeout_ms):
+        deadline = self.deadline(timeout_ms if timeout_ms is not None and timeout_ms >= 0 else None)
+
+        while True:
+            events = poller.poll(0)
+
+            if events or self.expired(deadline):
+                return events
+
+            self.advance(self.step)
+
+
+_clock = Clock()
+
+
+def get_clock():
+    """
+    Returns the clock used by the library.
+    """
+    return _clock
+
+
+def set_clock(clock):
+    """
+    Makes the library use ``clock`` (e.g. a :py:class:`SimulatedClock`) and
+    returns it.
+    """
+    global _clock
+    _clock = clock
+    return clock
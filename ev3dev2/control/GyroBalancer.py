@@ -28,13 +28,15 @@ https://github.com/laurensvalk/segway.
 # SOFTWARE.
 
 import logging
-import time
 import json
 import queue
 import threading
 import math
 import signal
 from collections import deque
+from ev3dev2.clock import get_clock
+from ev3dev2.control.loop import ControlLoop
+from ev3dev2.control.pid import PID
 from ev3dev2.power import PowerSupply
 from ev3dev2.motor import LargeMotor, OUTPUT_A, OUTPUT_D
 from ev3dev2.sensor.lego import GyroSensor, TouchSensor
@@ -134,13 +136,14 @@ class GyroBalancer(object):
         # Sound setup
         self.sound = Sound()
 
-        # Open sensor and motor files
-        self.gyro_file = open(self.gyro._path + "/value0", "rb")
-        self.touch_file = open(self.touch._path + "/value0", "rb")
-        self.encoder_left_file = open(self.motor_left._path + "/position", "rb")
-        self.encoder_right_file = open(self.motor_right._path + "/position", "rb")
-        self.dc_left_file = open(self.motor_left._path + "/duty_cycle_sp", "w")
-        self.dc_right_file = open(self.motor_right._path + "/duty_cycle_sp", "w")
+        # Open sensor and motor files (through the I/O backend, so the balancer
+        # also runs in a simulation)
+        self.gyro_file = self.gyro._attribute_file_open("value0")
+        self.touch_file = self.touch._attribute_file_open("value0")
+        self.encoder_left_file = self.motor_left._attribute_file_open("position")
+        self.encoder_right_file = self.motor_right._attribute_file_open("position")
+        self.dc_left_file = self.motor_left._attribute_file_open("duty_cycle_sp")
+        self.dc_right_file = self.motor_right._attribute_file_open("duty_cycle_sp")
 
         # Drive queue
         self.drive_queue = queue.Queue()
@@ -174,8 +177,8 @@ class GyroBalancer(object):
 
     def _fast_write(self, outfile, value):
         """Function for fast writing to motor files."""
-        outfile.truncate(0)
-        outfile.write(str(int(value)))
+        outfile.seek(0)
+        outfile.write(str(int(value)).encode())
         outfile.flush()
 
     def _set_duty(self, motor_duty_file, duty, friction_offset, voltage_comp):
@@ -211,6 +214,8 @@ class GyroBalancer(object):
 
     def _balance(self):
         """Make the robot balance."""
+        clock = get_clock()
+
         while True and not self.stop_balance.is_set():
 
             # Reset the motors
@@ -243,10 +248,11 @@ class GyroBalancer(object):
             # toward the reference.
             motor_angle_error = 0
 
-            # We add up all of the motor angle error in time. If this value
-            # gets out of hand, we can use it to drive the robot back to
-            # the reference position a bit quicker.
-            motor_angle_error_acc = 0
+            # The motor angle error drives the robot back to the reference
+            # proportionally, and through the accumulated error in time: if it
+            # gets out of hand, we can use it to drive the robot back to the
+            # reference position a bit quicker.
+            motor_angle_pid = PID(self.gain_motor_angle, self.gain_motor_angle_error_accumulated)
 
             # The motor speed, estimated by how far the motor has turned in
             # a given amount of time.
@@ -321,7 +327,7 @@ class GyroBalancer(object):
             gyro_calibrate_count = 100
             for i in range(gyro_calibrate_count):
                 gyro_offset = gyro_offset + self._fast_read(self.gyro_file)
-                time.sleep(0.01)
+                clock.sleep(0.01)
             gyro_offset = gyro_offset / gyro_calibrate_count
 
             # Print the result
@@ -334,7 +340,7 @@ class GyroBalancer(object):
             self.sound.beep()
 
             # Remember start time
-            prog_start_time = time.time()
+            prog_start_time = clock.now()
 
             if self.debug:
                 # Data logging
@@ -350,8 +356,9 @@ class GyroBalancer(object):
             # Driving and Steering
             speed, steering = (0, 0)
 
-            # Record start time of loop
-            loop_start_time = time.time()
+            # Start timing the loop, which runs every loop_time_target seconds
+            control_loop = ControlLoop(period=loop_time_target)
+            control_loop.start()
 
             # Balancing Loop
             while not touch_pressed and not self.stop_balance.is_set():
@@ -376,21 +383,12 @@ class GyroBalancer(object):
                 # Read the Gyro
                 gyro_rate_raw = self._fast_read(self.gyro_file)
 
-                # Busy wait for the loop to reach target time length
-                loop_time = 0
-                while (loop_time < loop_time_target):
-                    loop_time = time.time() - loop_start_time
-                    time.sleep(0.001)
-
-                # Calculate most recent loop time
-                loop_time = time.time() - loop_start_time
-
-                # Set start time of next loop
-                loop_start_time = time.time()
+                # Wait for the next period, and get the most recent loop time
+                loop_time = control_loop.wait_next()
 
                 if self.debug:
                     # Log gyro data and loop time
-                    time_of_sample = time.time() - prog_start_time
+                    time_of_sample = clock.now() - prog_start_time
                     gyro_readings[time_of_sample] = gyro_rate_raw
                     loop_times[time_of_sample] = loop_time * 1000.0
 
@@ -416,11 +414,9 @@ class GyroBalancer(object):
                 motor_duty_cycle =\
                     (self.gain_gyro_angle * gyro_est_angle +
                      self.gain_gyro_rate * gyro_rate +
-                     self.gain_motor_angle * motor_angle_error +
+                     motor_angle_pid.update(motor_angle_error, loop_time_target) +
                      self.gain_motor_angular_speed *
-                     motor_angular_speed_error +
-                     self.gain_motor_angle_error_accumulated *
-                     motor_angle_error_acc)
+                     motor_angular_speed_error)
 
                 # Apply the signal to the motor, and add steering
                 self._set_duty(self.dc_right_file, motor_duty_cycle + steering, friction_offset, voltage_comp)
@@ -432,14 +428,11 @@ class GyroBalancer(object):
                 gyro_offset = (1 - gyro_drift_comp_rate) *\
                     gyro_offset + gyro_drift_comp_rate * gyro_rate_raw
 
-                # Update Accumulated Motor Error
-                motor_angle_error_acc = motor_angle_error_acc +\
-                    motor_angle_error * loop_time_target
-
             # Closing down & Cleaning up
 
             # Loop end time, for stats
-            prog_end_time = time.time()
+            prog_end_time = clock.now()
+            control_loop.close()
 
             # Turn off the motors
             self._fast_write(self.dc_left_file, 0)
@@ -447,11 +440,12 @@ class GyroBalancer(object):
 
             # Wait for the Touch Sensor to be released
             while self.touch.is_pressed:
-                time.sleep(0.01)
+                clock.sleep(0.01)
 
             # Calculate loop time
             avg_loop_time = (prog_end_time - prog_start_time) / loop_count
             log.info("Loop time:" + str(avg_loop_time * 1000) + "ms")
+            log.info("Loop timing: " + str(control_loop.stats))
 
             # Print a stop message
             log.info("-----------------------------------")
@@ -467,7 +461,7 @@ class GyroBalancer(object):
         """Move robot."""
         self.drive_queue.put((speed, steering))
         if seconds is not None:
-            time.sleep(seconds)
+            get_clock().sleep(seconds)
             self.drive_queue.put((0, 0))
         self.drive_queue.join()
 
@@ -0,0 +1,354 @@
+"""
+Electronic gearing and camming: motors following the position of another one.
+
+Starting motors together (e.g. with a :py:class:`ev3dev2.motor.MotorSet`)
+does not keep them together: a load on one of them, or a different ramp, and
+they drift apart. :py:class:`ElectronicGearing` instead locks one or more
+slave motors to a master motor, as if they were geared together. Every
+period, it reads the position of the master and makes each slave follow its
+own target position, either the master position times a gear ratio or a
+:py:class:`Cam` (a table of master to slave positions).
+
+The master is driven as usual (or even by hand), the slaves only follow.
+Positions are in degrees. Example::
+
+    from ev3dev2.control.gearing import Cam, ElectronicGearing
+    from ev3dev2.motor import OUTPUT_A, OUTPUT_B, OUTPUT_C, LargeMotor, MediumMotor
+
+    conveyor = LargeMotor(OUTPUT_A)
+    belt = LargeMotor(OUTPUT_B)
+    lift = MediumMotor(OUTPUT_C)
+
+    # The lift goes up 90 degrees and back down for every turn of the conveyor
+    cam = Cam([(0, 0), (90, 0), (180, 90), (270, 90), (360, 0)], cyclic=True)
+
+    with ElectronicGearing(conveyor, [(belt, 0.5), (lift, cam)]) as gearing:
+        conveyor.on_for_rotations(30, 5)
+
+    print(gearing.stats)
+"""
+
+import _thread
+import math
+from ev3dev2.clock import get_clock
+from ev3dev2.control.loop import ControlLoop
+from ev3dev2.control.pid import PID
+
+
+class Cam(object):
+    """
+    A cam profile: the slave position (in degrees) as a function of the
+    master position, linearly interpolated between ``points``, a list of
+    ``(master, slave)`` pairs in increasing master positions.
+
+    Beyond its ends, the cam holds the slave at the first or last position,
+    unless it is ``cyclic``: then it repeats every ``master`` span of the
+    table, adding the ``slave`` span of the table (0 if the table ends where
+    it starts) to the slave position at every cycle.
+    """
+
+    __slots__ = ['masters', 'slaves', 'cyclic']
+
+    def __init__(self, points, cyclic=False):
+        if len(points) < 2:
+            raise ValueError("a cam needs at least two points")
+
+        self.masters = [float(master) for (master, slave) in points]
+        self.slaves = [float(slave) for (master, slave) in points]
+        self.cyclic = cyclic
+
+        for i in range(1, len(self.masters)):
+            if self.masters[i] <= self.masters[i - 1]:
+                raise ValueError("the master positions of a cam must increase")
+
+    def __str__(self):
+        return "Cam(%d points%s)" % (len(self.masters), ', cyclic' if self.cyclic else '')
+
+    def _locate(self, master):
+        # Returns (index of the segment, master position folded into the
+        # table, slave offset of the cycle); index is -1 or len - 1 outside
+        # of a non-cyclic table
+        masters = self.masters
+        offset = 0.0
+
+        if self.cyclic:
+            span = masters[-1] - masters[0]
+            cycles = math.floor((master - masters[0]) / span)
+            master -= cycles * span
+            offset = cycles * (self.slaves[-1] - self.slaves[0])
+        elif master < masters[0]:
+            return (-1, master, offset)
+        elif master >= masters[-1]:
+            return (len(masters) - 1, master, offset)
+
+        low = 0
+        high = len(masters) - 1
+
+        while high - low > 1:
+            middle = (low + high) // 2
+
+            if masters[middle] <= master:
+                low = middle
+            else:
+                high = middle
+
+        return (low, master, offset)
+
+    def position(self, master):
+        """
+        The slave position for the ``master`` position.
+        """
+        (i, master, offset) = self._locate(master)
+
+        if i < 0:
+            return self.slaves[0]
+
+        if i >= len(self.masters) - 1:
+            return self.slaves[-1]
+
+        (m0, m1) = (self.masters[i], self.masters[i + 1])
+        (s0, s1) = (self.slaves[i], self.slaves[i + 1])
+        return offset + s0 + (s1 - s0) * (master - m0) / (m1 - m0)
+
+    def slope(self, master):
+        """
+        The slave degrees per master degree at the ``master`` position, e.g.
+        to turn the master speed into the slave speed.
+        """
+        (i, master, offset) = self._locate(master)
+
+        if i < 0 or i >= len(self.masters) - 1:
+            return 0.0
+
+        return (self.slaves[i + 1] - self.slaves[i]) / (self.masters[i + 1] - self.masters[i])
+
+
+class _Ratio(object):
+    # A fixed gear ratio, with the interface of Cam
+
+    __slots__ = ['ratio']
+
+    def __init__(self, ratio):
+        self.ratio = float(ratio)
+
+    def __str__(self):
+        return "ratio %s" % self.ratio
+
+    def position(self, master):
+        return self.ratio * master
+
+    def slope(self, master):
+        return self.ratio
+
+
+class ElectronicGearing(object):
+    """
+    Makes the ``slaves`` follow the position of the ``master`` motor.
+    ``slaves`` is a list of ``(motor, law)`` pairs, where ``law`` is either a
+    gear ratio (slave degrees per master degree, negative to turn the other
+    way) or a :py:class:`Cam`. The positions are relative to those of the
+    motors when the gearing starts.
+
+    Every ``period`` seconds, each slave runs at the master speed converted
+    by its law (feed-forward), corrected by a :py:class:`ev3dev2.control.pid.PID`
+    controller on its position error. ``kp``, ``ki`` and ``kd`` are its gains,
+    in tacho counts per second per count (of error), per count second and
+    per count per second.
+
+    Either call :py:meth:`run` to follow in the calling thread, or
+    :py:meth:`start` a thread (use the gearing as a context manager to start
+    and stop it). When it stops, the slaves stop with the ``hold`` stop action
+    if ``brake`` is True, ``coast`` otherwise.
+
+    The tracking errors of the slaves are in :py:attr:`stats`, the timing of
+    the loop in ``control_loop.stats``.
+    """
+
+    def __init__(self, master, slaves, period=0.01, kp=2.0, ki=0.0, kd=0.0, brake=True, clock=None):
+        self.master = master
+        self.slaves = [motor for (motor, law) in slaves]
+        self.laws = [law if isinstance(law, Cam) else _Ratio(law) for (motor, law) in slaves]
+        self.period = period
+        self.brake = brake
+        self.clock = clock
+
+        #: The :py:class:`ev3dev2.control.loop.ControlLoop` of the last run
+        self.control_loop = None
+
+        self._pids = [PID(kp, ki, kd, kf=1.0, output_min=-motor.max_speed, output_max=motor.max_speed)
+                      for motor in self.slaves]
+        self._running = False
+        self._thread = False
+        self._error = None
+        self._thread_lock = _thread.allocate_lock()
+        self.reset_stats()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def reset_stats(self):
+        """
+        Forgets the tracking errors recorded so far.
+        """
+        count = len(self.slaves)
+        self._samples = 0
+        self._last = [0.0] * count
+        self._max = [0.0] * count
+        self._total = [0.0] * count
+        self._squares = [0.0] * count
+
+    @property
+    def stats(self):
+        """
+        The tracking errors (target minus actual position, in degrees) of the
+        slaves, as a dictionary of ``samples``, and per slave address a
+        dictionary of the ``last`` error and of the ``mean`` and ``max``
+        absolute errors and the ``rms`` error.
+        """
+        samples = self._samples
+        stats = {'samples': samples}
+
+        for (i, motor) in enumerate(self.slaves):
+            stats[motor.address] = {
+                'last': self._last[i],
+                'mean': self._total[i] / samples if samples else None,
+                'max': self._max[i],
+                'rms': math.sqrt(self._squares[i] / samples) if samples else None,
+            }
+
+        return stats
+
+    def run(self, seconds=None):
+        """
+        Makes the slaves follow the master until :py:meth:`stop` is called or
+        (if given) ``seconds`` have elapsed.
+        """
+        self._running = True
+        self._follow(seconds)
+
+    def _follow(self, seconds):
+        clock = self.clock if self.clock is not None else get_clock()
+        master = self.master
+        slaves = self.slaves
+        laws = self.laws
+        pids = self._pids
+        count = len(slaves)
+        master_counts = master.count_per_rot / 360
+        slave_counts = [motor.count_per_rot / 360 for motor in slaves]
+        master_start = master.position / master_counts
+        starts = [motor.position for motor in slaves]
+        last = [None] * count
+        stop_action = master.STOP_ACTION_HOLD if self.brake else master.STOP_ACTION_COAST
+        end = clock.now() + seconds if seconds is not None else None
+
+        for pid in pids:
+            pid.reset()
+
+        for motor in slaves:
+            motor.stop_action = stop_action
+
+        loop = ControlLoop(period=self.period, clock=clock)
+        self.control_loop = loop
+
+        def step():
+            if not self._running or (end is not None and clock.now() >= end):
+                return False
+
+            (position, speed) = master.read_attrs('position', 'speed')
+            position = position / master_counts - master_start
+            speed = speed / master_counts
+            dt = loop.last_period
+
+            for i in range(count):
+                motor = slaves[i]
+                law = laws[i]
+                target = starts[i] + law.position(position) * slave_counts[i]
+                error = target - motor.position
+                speed_sp = int(round(pids[i].update(error, dt, law.slope(position) * speed * slave_counts[i])))
+
+                if speed_sp != last[i]:
+                    motor.speed_sp = speed_sp
+                    motor.command = motor.COMMAND_RUN_FOREVER
+                    last[i] = speed_sp
+
+                error /= slave_counts[i]
+                self._last[i] = error
+                self._total[i] += abs(error)
+                self._squares[i] += error * error
+
+                if abs(error) > self._max[i]:
+                    self._max[i] = abs(error)
+
+            self._samples += 1
+
+        try:
+            loop.step = step
+            loop.run()
+        finally:
+            self._running = False
+            error = self._stop_slaves()
+
+        if error is not None:
+            raise error
+
+    def _stop_slaves(self):
+        # Stops every slave, even if stopping one fails, and returns the
+        # first exception raised
+        error = None
+
+        for motor in self.slaves:
+            try:
+                motor.stop()
+            except Exception as e:
+                if error is None:
+                    error = e
+
+        return error
+
+    def _run(self):
+        try:
+            self._follow(None)
+        except Exception as e:
+            self._error = e
+        finally:
+            self._thread_lock.release()
+
+    def start(self):
+        """
+        Starts following the master in a thread.
+        """
+        if self._thread:
+            return
+
+        self._running = True
+        self._thread = True
+        self._error = None
+        self._thread_lock.acquire()
+        _thread.start_new_thread(self._run, ())
+
+    def stop(self):
+        """
+        Stops following the master, from another thread than the one in
+        :py:meth:`run`, or the thread of :py:meth:`start` (waiting for it to
+        end). The slaves stop with it. An exception raised in the thread
+        (e.g. because a motor was unplugged) stopped it too, and is raised
+        here.
+        """
+        self._running = False
+
+        if not self._thread:
+            return
+
+        with self._thread_lock:
+            pass
+
+        self._thread = False
+        error = self._error
+        self._error = None
+
+        if error is not None:
+            raise error
@@ -0,0 +1,242 @@
+"""
+A fixed-rate scheduler for control loops.
+
+A loop that sleeps for a fixed time after doing its work runs slower than
+intended, by however long the work took, and its period varies with it.
+:py:class:`ControlLoop` instead wakes up at absolute deadlines, one ``period``
+apart, so the rate does not drift, and records how regular the loop actually
+was.
+
+Example::
+
+    from ev3dev2.control.loop import ControlLoop
+
+    def step():
+        error = target - gyro.angle
+        tank.on(speed - kp * error, speed + kp * error)
+
+    loop = ControlLoop(step, period=0.01)
+    loop.run(iterations=1000)
+    print(loop.stats)
+"""
+
+import os
+import time
+from ev3dev2.clock import Clock, get_clock
+
+
+class ControlLoop(object):
+    """
+    Calls ``step()`` every ``period`` seconds until it returns False, or
+    :py:meth:`stop` is called.
+
+    When a step takes longer than the period, the loop is overrun. With
+    ``overrun`` set to ``ControlLoop.SKIP`` (the default) the missed deadlines
+    are dropped and the loop resumes at the next deadline; with
+    ``ControlLoop.CATCH_UP`` the next steps run without sleeping until the
+    loop is back on schedule, so that the number of steps matches the time
+    elapsed.
+
+    Loops written inline can call :py:meth:`wait_next` at the end of every
+    iteration instead of passing a ``step`` function.
+
+    The loop follows the library clock (see :py:mod:`ev3dev2.clock`) unless a
+    ``clock`` is given. With the system clock and Python 3.13 or later, the
+    deadlines are waited for with a ``timerfd``.
+    """
+
+    SKIP = 'skip'
+    CATCH_UP = 'catch-up'
+
+    #: Number of recent iterations the ``p99`` statistics are computed from
+    HISTORY = 1000
+
+    def __init__(self, step=None, period=0.01, overrun=SKIP, clock=None):
+        if overrun not in (self.SKIP, self.CATCH_UP):
+            raise ValueError("overrun must be '%s' or '%s', not '%s'" % (self.SKIP, self.CATCH_UP, overrun))
+
+        self.step = step
+        self.period = period
+        self.overrun = overrun
+        self.clock = clock
+        self._clock = None
+        self._timerfd = None
+        self._running = False
+        self._next = None
+        self._last = None
+
+        #: The measured duration of the last period, in seconds; ``period``
+        #: until one was measured. Steps can use it as their time step.
+        self.last_period = period
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets the statistics recorded so far.
+        """
+        self.iterations = 0
+        self.overruns = 0
+        self.skipped = 0
+        self._periods = []
+        self._index = 0
+        self._min = None
+        self._max = None
+        self._total = 0.0
+        self._jitter_min = None
+        self._jitter_max = None
+        self._jitter_total = 0.0
+
+    def start(self):
+        """
+        Starts the timing: the first deadline is one period from now. Called
+        by :py:meth:`run`, and by the first :py:meth:`wait_next`.
+        """
+        self._clock = self.clock if self.clock is not None else get_clock()
+        self._last = self._clock.now()
+        self._next = self._last + self.period
+        self._running = True
+
+        if self._timerfd is None and self._clock.__class__ is Clock and hasattr(os, 'timerfd_create'):
+            # time.monotonic() is CLOCK_MONOTONIC
+            self._timerfd = os.timerfd_create(time.CLOCK_MONOTONIC, flags=os.TFD_CLOEXEC)
+
+    def close(self):
+        """
+        Releases the timer. Called at the end of :py:meth:`run`.
+        """
+        self._running = False
+        self._next = None
+
+        if self._timerfd is not None:
+            os.close(self._timerfd)
+            self._timerfd = None
+
+    def stop(self):
+        """
+        Makes :py:meth:`run` return after the current step.
+        """
+        self._running = False
+
+    def _sleep_until(self, deadline):
+        if self._timerfd is not None:
+            os.timerfd_settime(self._timerfd, flags=os.TFD_TIMER_ABSTIME, initial=deadline)
+            os.read(self._timerfd, 8)
+        else:
+            self._clock.sleep(deadline - self._clock.now())
+
+    def _record(self, period):
+        self.iterations += 1
+        self._total += period
+
+        if self._min is None or period < self._min:
+            self._min = period
+
+        if self._max is None or period > self._max:
+            self._max = period
+
+        jitter = abs(period - self.period)
+        self._jitter_total += jitter
+
+        if self._jitter_min is None or jitter < self._jitter_min:
+            self._jitter_min = jitter
+
+        if self._jitter_max is None or jitter > self._jitter_max:
+            self._jitter_max = jitter
+
+        if len(self._periods) < self.HISTORY:
+            self._periods.append(period)
+        else:
+            self._periods[self._index] = period
+            self._index = (self._index + 1) % self.HISTORY
+
+    def wait_next(self):
+        """
+        Sleeps until the next deadline and returns the time (in seconds)
+        since the previous call.
+        """
+        if self._next is None:
+            self.start()
+
+        clock = self._clock
+
+        if self.period > 0:
+            now = clock.now()
+
+            if now > self._next:
+                self.overruns += 1
+
+                if self.overrun == self.SKIP:
+                    missed = int((now - self._next) / self.period) + 1
+                    self.skipped += missed
+                    self._next += missed * self.period
+
+            if self._next > now:
+                self._sleep_until(self._next)
+
+            self._next += self.period
+
+        now = clock.now()
+        period = now - self._last
+        self._last = now
+        self.last_period = period
+        self._record(period)
+        return period
+
+    def run(self, iterations=None):
+        """
+        Runs the loop until ``step()`` returns False, :py:meth:`stop` is
+        called or (if given) ``iterations`` steps were done. Exceptions raised
+        by ``step()`` end the loop and are passed on.
+        """
+        self.start()
+        count = 0
+
+        try:
+            while self._running:
+                if self.step() is False:
+                    break
+
+                count += 1
+                if iterations is not None and count >= iterations:
+                    break
+
+                self.wait_next()
+        finally:
+            self.close()
+
+    @property
+    def stats(self):
+        """
+        The timing of the loop as a dictionary:
+
+        - ``iterations``: number of periods measured
+        - ``overruns``: number of steps that ended after their deadline
+        - ``skipped``: number of deadlines dropped (with ``SKIP``)
+        - ``period`` and ``jitter``: ``min``, ``mean``, ``max`` and ``p99``
+          of the measured periods and of their difference to ``period``, in
+          seconds. ``p99`` covers the last ``HISTORY`` iterations.
+        """
+        count = self.iterations
+        periods = sorted(self._periods)
+        jitters = sorted([abs(period - self.period) for period in self._periods])
+
+        def p99(values):
+            return values[int(0.99 * (len(values) - 1))] if values else None
+
+        return {
+            'iterations': count,
+            'overruns': self.overruns,
+            'skipped': self.skipped,
+            'period': {
+                'min': self._min,
+                'mean': self._total / count if count else None,
+                'max': self._max,
+                'p99': p99(periods),
+            },
+            'jitter': {
+                'min': self._jitter_min,
+                'mean': self._jitter_total / count if count else None,
+                'max': self._jitter_max,
+                'p99': p99(jitters),
+            },
+        }
@@ -0,0 +1,119 @@
+"""
+A PID controller for the control loops of the library and of user programs.
+"""
+
+
+class PID(object):
+    """
+    A PID controller with output limits, integral anti-windup, a low-pass
+    filtered derivative and feed-forward.
+
+    ``kp``, ``ki`` and ``kd`` are the gains; the integral and derivative are
+    computed with the time step ``dt`` given to :py:meth:`update`, in the
+    units of your choice (e.g. seconds). ``kf`` is the gain of the
+    feed-forward input.
+
+    The output is clamped to ``output_min``/``output_max`` (None for no
+    limit). While it is clamped, the integral stops growing in the direction
+    of the saturation, so the controller recovers as soon as the error
+    changes sign. ``integral_limit`` additionally bounds the absolute value of
+    the integral.
+
+    ``derivative_filter`` is the time constant (in the units of ``dt``) of
+    the low-pass filter on the derivative; 0 disables it. The derivative is
+    0 on the first update after a reset, unless the reset gives the error
+    before it.
+
+    An update only does arithmetic on the attributes of the object (which
+    uses ``__slots__``), it does not build any list, tuple or dictionary, so
+    it is cheap enough for loops running at 200 Hz and more on the EV3.
+
+    Example::
+
+        pid = PID(kp=2.0, ki=0.5, kd=0.1, output_min=-100, output_max=100, derivative_filter=0.02)
+
+        while True:
+            duty = pid.update(target - motor.position, 0.005)
+    """
+
+    __slots__ = [
+        'kp', 'ki', 'kd', 'kf', 'output_min', 'output_max', 'integral_limit', 'derivative_filter', 'integral',
+        'derivative', 'output', '_last_error'
+    ]
+
+    def __init__(self,
+                 kp,
+                 ki=0.0,
+                 kd=0.0,
+                 kf=0.0,
+                 output_min=None,
+                 output_max=None,
+                 integral_limit=None,
+                 derivative_filter=0.0):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.kf = kf
+        self.output_min = output_min
+        self.output_max = output_max
+        self.integral_limit = integral_limit
+        self.derivative_filter = derivative_filter
+        self.reset()
+
+    def __str__(self):
+        return "PID(kp=%s, ki=%s, kd=%s, kf=%s)" % (self.kp, self.ki, self.kd, self.kf)
+
+    def reset(self, last_error=None):
+        """
+        Clears the integral and the derivative, e.g. before reusing the
+        controller for a new move. If ``last_error`` is given, the first
+        update computes the derivative from it, as if it were the error of a
+        previous update.
+        """
+        self.integral = 0.0
+        self.derivative = 0.0
+        self.output = 0.0
+        self._last_error = last_error
+
+    def update(self, error, dt, feed_forward=0.0):
+        """
+        Returns the output for ``error`` (set point minus measurement), ``dt``
+        after the previous update. ``feed_forward`` is added to the output
+        multiplied by ``kf``.
+        """
+        previous_integral = self.integral
+        integral = previous_integral + error * dt
+        limit = self.integral_limit
+
+        if limit is not None:
+            if integral > limit:
+                integral = limit
+            elif integral < -limit:
+                integral = -limit
+
+        if self._last_error is not None and dt > 0:
+            raw = (error - self._last_error) / dt
+
+            if self.derivative_filter > 0:
+                self.derivative += (raw - self.derivative) * dt / (self.derivative_filter + dt)
+            else:
+                self.derivative = raw
+
+        output = self.kp * error + self.ki * integral + self.kd * self.derivative + self.kf * feed_forward
+
+        if self.output_max is not None and output > self.output_max:
+            output = self.output_max
+
+            # Do not wind up further while saturated
+            if self.ki * error > 0:
+                integral = previous_integral
+        elif self.output_min is not None and output < self.output_min:
+            output = self.output_min
+
+            if self.ki * error < 0:
+                integral = previous_integral
+
+        self.integral = integral
+        self._last_error = error
+        self.output = output
+        return output
@@ -0,0 +1,445 @@
+"""
+Motion profiles, and an executor streaming them to motors.
+
+The ``ramp_up_sp`` and ``ramp_down_sp`` attributes of the motors only ramp
+linearly toward a fixed speed, and every ``on_for_degrees()`` ends with a full
+stop. A motion profile plans the whole move instead: how the position and the
+speed of the motor change over time, with a limited acceleration
+(:py:class:`TrapezoidalProfile`) and optionally a limited jerk
+(:py:class:`SCurveProfile`, smoother and gentler on the mechanics). Profiles
+can start and end at a non-zero speed, so that consecutive moves blend
+without stopping (see :py:func:`blend_moves`).
+
+:py:class:`ProfileExecutor` samples the profiles once, then streams the
+setpoints to the motors from a :py:class:`ev3dev2.control.loop.ControlLoop`.
+
+Distances are in degrees, times in seconds, so velocities are in degrees per
+second, accelerations in degrees per second squared and jerks in degrees per
+second cubed. Example::
+
+    from ev3dev2.control.profile import SCurveProfile, blend_moves, synchronize
+    from ev3dev2.motor import OUTPUT_A, OUTPUT_B, MoveTank
+
+    tank = MoveTank(OUTPUT_A, OUTPUT_B)
+
+    # Two moves of the arm, back to back without stopping in between
+    arm = blend_moves([90, 270], max_velocity=600, acceleration=2000, jerk=20000)
+    base = SCurveProfile(-120, max_velocity=300, acceleration=1000, jerk=10000)
+
+    # Both motors start and finish together
+    arm, base = synchronize(arm, base)
+    tank.run_profiles({OUTPUT_A: arm, OUTPUT_B: base})
+"""
+
+import math
+from array import array
+from ev3dev2.clock import get_clock
+from ev3dev2.control.loop import ControlLoop
+
+
+def _ramp_time(dv, acceleration, jerk):
+    # Duration of a change of speed of dv, ramping the acceleration up and
+    # down with ``jerk`` (None for an instant change of acceleration)
+    if jerk is None:
+        return dv / acceleration
+
+    if dv >= acceleration * acceleration / jerk:
+        return dv / acceleration + acceleration / jerk
+
+    return 2 * math.sqrt(dv / jerk)
+
+
+def _ramp_distance(va, vb, acceleration, jerk):
+    # The speed changes symmetrically, the mean speed is the mean of va and vb
+    return (va + vb) / 2 * _ramp_time(abs(vb - va), acceleration, jerk)
+
+
+def _reachable_velocity(velocity, distance, max_velocity, acceleration, jerk):
+    # The highest speed (up to max_velocity) that can be reached from (or
+    # slowed down from to) ``velocity`` within ``distance``
+    if _ramp_distance(velocity, max_velocity, acceleration, jerk) <= distance:
+        return max_velocity
+
+    low = velocity
+    high = max_velocity
+
+    for _ in range(50):
+        middle = (low + high) / 2
+
+        if _ramp_distance(velocity, middle, acceleration, jerk) <= distance:
+            low = middle
+        else:
+            high = middle
+
+    return low
+
+
+class MotionProfile(object):
+    """
+    A move made of segments of constant jerk. Use :py:class:`TrapezoidalProfile`,
+    :py:class:`SCurveProfile` or :py:class:`ProfileSequence` to build one.
+
+    ``duration`` is the duration of the move in seconds, and ``distance`` the
+    (signed) distance it covers.
+    """
+
+    __slots__ = ['duration', 'distance', '_segments']
+
+    def __init__(self):
+        self.duration = 0.0
+        self.distance = 0.0
+
+        # (start time, position, velocity, acceleration, jerk) of each segment
+        self._segments = []
+
+    def __str__(self):
+        return "%s(%.1f deg in %.3f s)" % (self.__class__.__name__, self.distance, self.duration)
+
+    def _add_segment(self, duration, velocity, acceleration, jerk):
+        if duration <= 0:
+            return
+
+        self._segments.append((self.duration, self.distance, velocity, acceleration, jerk))
+        self.duration += duration
+        self.distance += (velocity * duration + acceleration * duration * duration / 2 +
+                          jerk * duration * duration * duration / 6)
+
+    def _add_ramp(self, va, vb, sign, acceleration, jerk):
+        # Change the speed from va to vb (both >= 0) moving toward ``sign``
+        dv = vb - va
+        direction = sign if dv > 0 else -sign
+        dv = abs(dv)
+
+        if dv == 0:
+            return
+
+        if jerk is None:
+            self._add_segment(dv / acceleration, sign * va, direction * acceleration, 0)
+        elif dv >= acceleration * acceleration / jerk:
+            ramp = acceleration / jerk
+            v = sign * va
+            self._add_segment(ramp, v, 0, direction * jerk)
+            v += direction * acceleration * ramp / 2
+            self._add_segment(dv / acceleration - ramp, v, direction * acceleration, 0)
+            v += direction * (dv - acceleration * ramp)
+            self._add_segment(ramp, v, direction * acceleration, -direction * jerk)
+        else:
+            ramp = math.sqrt(dv / jerk)
+            v = sign * va
+            self._add_segment(ramp, v, 0, direction * jerk)
+            self._add_segment(ramp, v + direction * dv / 2, direction * jerk * ramp, -direction * jerk)
+
+    def _plan(self, distance, max_velocity, acceleration, jerk, start_velocity, end_velocity):
+        if max_velocity <= 0 or acceleration <= 0 or (jerk is not None and jerk <= 0):
+            raise ValueError("max_velocity, acceleration and jerk must be positive")
+
+        if not (0 <= start_velocity <= max_velocity and 0 <= end_velocity <= max_velocity):
+            raise ValueError("start_velocity and end_velocity must be between 0 and max_velocity")
+
+        sign = 1 if distance >= 0 else -1
+        distance = abs(distance)
+
+        def ramps_distance(peak):
+            return (_ramp_distance(start_velocity, peak, acceleration, jerk) +
+                    _ramp_distance(peak, end_velocity, acceleration, jerk))
+
+        low = max(start_velocity, end_velocity)
+
+        if ramps_distance(low) > distance * (1 + 1e-9) + 1e-9:
+            raise ValueError("%s degrees are too short to go from %s to %s degrees per second" %
+                             (distance, start_velocity, end_velocity))
+
+        if ramps_distance(max_velocity) <= distance:
+            peak = max_velocity
+        else:
+            high = max_velocity
+
+            for _ in range(50):
+                middle = (low + high) / 2
+
+                if ramps_distance(middle) <= distance:
+                    low = middle
+                else:
+                    high = middle
+
+            peak = low
+
+        self._add_ramp(start_velocity, peak, sign, acceleration, jerk)
+
+        if peak > 0:
+            self._add_segment((distance - ramps_distance(peak)) / peak, sign * peak, 0, 0)
+
+        self._add_ramp(peak, end_velocity, sign, acceleration, jerk)
+
+        # Cancel the rounding errors, the move ends exactly at ``distance``
+        self.distance = sign * distance
+
+    def sample(self, t):
+        """
+        Returns the position (relative to the start of the move) and the
+        velocity ``t`` seconds after the start of the move. Before the start
+        and after the end, the move is at rest at its start or end position.
+        """
+        segments = self._segments
+
+        if not segments or t < 0:
+            return (0.0, 0.0)
+
+        if t >= self.duration:
+            return (self.distance, 0.0)
+
+        index = len(segments) - 1
+
+        while segments[index][0] > t:
+            index -= 1
+
+        (start, position, velocity, acceleration, jerk) = segments[index]
+        t -= start
+
+        return (position + velocity * t + acceleration * t * t / 2 + jerk * t * t * t / 6,
+                velocity + acceleration * t + jerk * t * t / 2)
+
+    def scaled(self, duration):
+        """
+        Returns a copy of this move slowed down to take ``duration`` seconds
+        (at least ``self.duration``); velocities, accelerations and jerks are
+        scaled down accordingly.
+        """
+        if duration < self.duration:
+            raise ValueError("a %s s move cannot be made to take %s s" % (self.duration, duration))
+
+        profile = MotionProfile()
+        profile.distance = self.distance
+
+        if self.duration == 0:
+            profile.duration = duration
+            return profile
+
+        k = duration / self.duration
+        profile.duration = duration
+        profile._segments = [(start * k, position, velocity / k, acceleration / (k * k), jerk / (k * k * k))
+                             for (start, position, velocity, acceleration, jerk) in self._segments]
+        return profile
+
+
+class TrapezoidalProfile(MotionProfile):
+    """
+    A move of ``distance`` degrees (negative to go backward): accelerate at
+    ``acceleration`` up to ``max_velocity``, cruise, then slow down at
+    ``acceleration``. Short moves do not reach ``max_velocity``.
+
+    The move starts at ``start_velocity`` and ends at ``end_velocity``
+    (speeds in the direction of the move), 0 by default; ``ValueError`` is
+    raised if the distance is too short to slow down to ``end_velocity``.
+    """
+
+    __slots__ = []
+
+    def __init__(self, distance, max_velocity, acceleration, start_velocity=0, end_velocity=0):
+        MotionProfile.__init__(self)
+        self._plan(distance, max_velocity, acceleration, None, start_velocity, end_velocity)
+
+
+class SCurveProfile(MotionProfile):
+    """
+    Like :py:class:`TrapezoidalProfile`, but the acceleration itself ramps
+    up and down at ``jerk``, so the speed follows an S-shaped curve instead of
+    changing slope abruptly. This takes a little longer, but excites the
+    mechanics much less, avoiding vibrations and overshoot.
+    """
+
+    __slots__ = []
+
+    def __init__(self, distance, max_velocity, acceleration, jerk, start_velocity=0, end_velocity=0):
+        MotionProfile.__init__(self)
+        self._plan(distance, max_velocity, acceleration, jerk, start_velocity, end_velocity)
+
+
+class ProfileSequence(MotionProfile):
+    """
+    The moves of ``profiles``, one after the other. For the motor not to jerk
+    between two moves, the end velocity of each move should be the start
+    velocity of the next one, as in :py:func:`blend_moves`.
+    """
+
+    __slots__ = []
+
+    def __init__(self, profiles):
+        MotionProfile.__init__(self)
+
+        for profile in profiles:
+            for (start, position, velocity, acceleration, jerk) in profile._segments:
+                self._segments.append(
+                    (self.duration + start, self.distance + position, velocity, acceleration, jerk))
+
+            self.duration += profile.duration
+            self.distance += profile.distance
+
+
+def blend_moves(distances, max_velocity, acceleration, jerk=None):
+    """
+    Returns a :py:class:`ProfileSequence` going through the moves of
+    ``distances`` (in degrees) one after the other, without stopping between
+    consecutive moves in the same direction: each move hands over to the next
+    at the highest speed that both can handle. The moves are S-curves if
+    ``jerk`` is given, trapezoidal otherwise.
+    """
+    count = len(distances)
+
+    # Velocities at the start of each move, and at the end of the last one
+    velocities = [0.0] * (count + 1)
+
+    for i in range(1, count):
+        if distances[i - 1] * distances[i] > 0:
+            velocities[i] = max_velocity
+
+    # Lower the junction velocities so that every move can reach its end
+    # velocity (forward pass) and slow down to it (backward pass)
+    for i in range(count):
+        velocities[i + 1] = min(
+            velocities[i + 1],
+            _reachable_velocity(velocities[i], abs(distances[i]), max_velocity, acceleration, jerk))
+
+    for i in range(count - 1, -1, -1):
+        velocities[i] = min(
+            velocities[i],
+            _reachable_velocity(velocities[i + 1], abs(distances[i]), max_velocity, acceleration, jerk))
+
+    profiles = []
+
+    for (i, distance) in enumerate(distances):
+        if jerk is None:
+            profiles.append(
+                TrapezoidalProfile(distance, max_velocity, acceleration, velocities[i], velocities[i + 1]))
+        else:
+            profiles.append(
+                SCurveProfile(distance, max_velocity, acceleration, jerk, velocities[i], velocities[i + 1]))
+
+    return ProfileSequence(profiles)
+
+
+def synchronize(*profiles):
+    """
+    Returns ``profiles`` slowed down to all take as long as the longest one,
+    so that the motors following them start and finish together.
+    """
+    duration = max([profile.duration for profile in profiles])
+    return [profile.scaled(duration) for profile in profiles]
+
+
+class ProfileExecutor(object):
+    """
+    Makes motors follow motion profiles. ``profiles`` is a list of
+    ``(motor, profile)`` pairs; the positions of the profiles are relative to
+    the position of the motors when :py:meth:`run` is called.
+
+    The profiles are sampled every ``period`` seconds when the executor is
+    created. :py:meth:`run` then only looks up the setpoints of each period
+    and writes them. With ``mode`` set to:
+
+    - ``ProfileExecutor.SPEED`` (the default), the speed of the profile is
+      written to ``speed_sp`` and the motors run forever. If
+      ``position_gain`` is not 0, the motor positions are read every period
+      and the speed is corrected by ``position_gain`` times the position
+      error (in counts per second per count), which removes the drift.
+      At the end of the move the motors stop with the ``hold`` stop action if
+      ``brake`` is True, ``coast`` otherwise.
+    - ``ProfileExecutor.POSITION``, the position of the profile is written to
+      ``position_sp`` and the motors run to it at up to ``max_speed``, so the
+      motor controller regulates the position.
+    """
+
+    SPEED = 'speed'
+    POSITION = 'position'
+
+    def __init__(self, profiles, period=0.01, mode=SPEED, position_gain=0.0, brake=True, clock=None):
+        if mode not in (self.SPEED, self.POSITION):
+            raise ValueError("mode must be '%s' or '%s', not '%s'" % (self.SPEED, self.POSITION, mode))
+
+        self.motors = [motor for (motor, profile) in profiles]
+        self.period = period
+        self.mode = mode
+        self.position_gain = position_gain
+        self.brake = brake
+        self.clock = clock
+
+        #: The :py:class:`ev3dev2.control.loop.ControlLoop` of the last run
+        self.control_loop = None
+
+        duration = max([profile.duration for (motor, profile) in profiles])
+        self.samples = int(math.ceil(duration / period - 1e-9))
+
+        # Per motor, in tacho counts: the position at the end of each period,
+        # and the speed in the middle of it
+        self._positions = []
+        self._speeds = []
+
+        for (motor, profile) in profiles:
+            counts = motor.count_per_rot / 360
+            positions = array('l')
+            speeds = array('l')
+
+            for i in range(self.samples):
+                positions.append(int(round(profile.sample((i + 1) * period)[0] * counts)))
+                speeds.append(int(round(profile.sample((i + 0.5) * period)[1] * counts)))
+
+            self._positions.append(positions)
+            self._speeds.append(speeds)
+
+    def run(self):
+        """
+        Follows the profiles, and returns when they are over.
+        """
+        clock = self.clock if self.clock is not None else get_clock()
+        motors = self.motors
+        count = len(motors)
+        starts = [motor.position for motor in motors]
+        last = [None] * count
+        stop_action = motors[0].STOP_ACTION_HOLD if self.brake else motors[0].STOP_ACTION_COAST
+
+        for motor in motors:
+            motor.stop_action = stop_action
+
+            if self.mode == self.POSITION:
+                motor.speed_sp = motor.max_speed
+
+        start_time = clock.now()
+
+        def step():
+            i = int((clock.now() - start_time) / self.period)
+
+            if i >= self.samples:
+                return False
+
+            for index in range(count):
+                motor = motors[index]
+
+                if self.mode == self.POSITION:
+                    position_sp = starts[index] + self._positions[index][i]
+
+                    if position_sp != last[index]:
+                        motor.position_sp = position_sp
+                        motor.command = motor.COMMAND_RUN_TO_ABS_POS
+                        last[index] = position_sp
+                else:
+                    speed = self._speeds[index][i]
+
+                    if self.position_gain:
+                        # Where the profile is now, at the start of period i
+                        # (the positions are those at the end of each period)
+                        position = self._positions[index][i - 1] if i else 0
+                        error = starts[index] + position - motor.position
+                        speed = int(round(speed + self.position_gain * error))
+                        speed = max(-motor.max_speed, min(motor.max_speed, speed))
+
+                    if speed != last[index]:
+                        motor.speed_sp = speed
+                        motor.command = motor.COMMAND_RUN_FOREVER
+                        last[index] = speed
+
+        self.control_loop = ControlLoop(step, self.period, clock=clock)
+        self.control_loop.run()
+
+        if self.mode == self.SPEED:
+            for motor in motors:
+                motor.stop()
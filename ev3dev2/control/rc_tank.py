@@ -1,7 +1,7 @@
 import logging
 from ev3dev2.motor import MoveTank
+from ev3dev2.clock import get_clock
 from ev3dev2.sensor.lego import InfraredSensor
-from time import sleep
 
 log = logging.getLogger(__name__)
 
@@ -38,7 +38,7 @@ class RemoteControlledTank(MoveTank):
         try:
             while True:
                 self.remote.process()
-                sleep(0.01)
+                get_clock().sleep(0.01)
 
         # Exit cleanly so that all motors are stopped
         except (KeyboardInterrupt, Exception) as e:
@@ -0,0 +1,284 @@
+"""
+A registry that follows devices being plugged in and unplugged.
+
+The kernel announces every device it adds or removes with a uevent. The
+:py:class:`DeviceRegistry` listens to those events and keeps the ``Device``
+objects it tracks bound to the right sysfs directory, so a motor that gets
+unplugged and plugged back in keeps working without creating a new object.
+
+This module is not available on micropython, which has neither netlink
+sockets for :py:class:`UeventSource` nor ``os.pipe()`` for
+:py:class:`SimulatedEventSource`.
+
+Example::
+
+    from ev3dev2.hotplug import DeviceRegistry
+    from ev3dev2.motor import LargeMotor, OUTPUT_A
+
+    def on_change(event):
+        print(event.action, event.subsystem, event.name, event.device)
+
+    registry = DeviceRegistry()
+    motor = registry.track(LargeMotor(OUTPUT_A))
+    registry.add_callback(on_change)
+    registry.start()
+"""
+
+import os
+import select
+import socket
+import _thread
+from collections import namedtuple
+from os.path import abspath
+from ev3dev2 import Device, refresh_device_index, _matching_devices
+
+NETLINK_KOBJECT_UEVENT = 15
+
+# Netlink multicast group of the uevents sent by the kernel
+UEVENT_KERNEL_GROUP = 1
+
+DEFAULT_SUBSYSTEMS = ('tacho-motor', 'lego-sensor', 'lego-port')
+
+#: Passed to the callbacks of :py:class:`DeviceRegistry`. ``action`` is the
+#: uevent action (``add``, ``remove``, ...), ``subsystem`` the device class
+#: (e.g. ``tacho-motor``), ``name`` the device name (e.g. ``motor0``) and
+#: ``device`` the tracked ``Device`` the event applied to, or None.
+DeviceEvent = namedtuple('DeviceEvent', ['action', 'subsystem', 'name', 'device'])
+
+
+def parse_uevent(data):
+    """
+    Returns the ``KEY=value`` fields (``ACTION``, ``DEVPATH``, ``SUBSYSTEM``...)
+    of a raw kernel uevent message as a dict.
+    """
+    fields = {}
+
+    # The first line is the "action@devpath" summary
+    for line in data.split(b'\0')[1:]:
+        key, sep, value = line.partition(b'=')
+        if sep:
+            fields[key.decode()] = value.decode()
+
+    return fields
+
+
+class UeventSource(object):
+    """
+    Reads the kernel uevents from a ``NETLINK_KOBJECT_UEVENT`` socket.
+    """
+    def __init__(self):
+        self._socket = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        self._socket.bind((0, UEVENT_KERNEL_GROUP))
+        self._socket.setblocking(False)
+
+    def fileno(self):
+        return self._socket.fileno()
+
+    def read(self):
+        """
+        Returns the pending events as a list of (action, subsystem, name)
+        tuples, without blocking.
+        """
+        events = []
+
+        while True:
+            try:
+                data = self._socket.recv(8192)
+            except BlockingIOError:
+                break
+
+            fields = parse_uevent(data)
+            if 'ACTION' in fields and 'SUBSYSTEM' in fields and 'DEVPATH' in fields:
+                events.append((fields['ACTION'], fields['SUBSYSTEM'], os.path.basename(fields['DEVPATH'])))
+
+        return events
+
+    def close(self):
+        self._socket.close()
+
+
+class SimulatedEventSource(object):
+    """
+    An event source for tests and simulations: events are injected by hand,
+    typically after adding or removing a device in a fake sysfs tree.
+    """
+    def __init__(self):
+        self._events = []
+        self._lock = _thread.allocate_lock()
+
+        # One byte per pending event, so the source can be polled like the real one
+        self._read_fd, self._write_fd = os.pipe()
+
+    def fileno(self):
+        return self._read_fd
+
+    def inject(self, action, subsystem, name):
+        with self._lock:
+            self._events.append((action, subsystem, name))
+            os.write(self._write_fd, b'\0')
+
+    def read(self):
+        with self._lock:
+            events = self._events
+            self._events = []
+
+            if events:
+                os.read(self._read_fd, len(events))
+
+        return events
+
+    def close(self):
+        os.close(self._read_fd)
+        os.close(self._write_fd)
+
+
+class DeviceRegistry(object):
+    """
+    Keeps track of devices being plugged in and unplugged.
+
+    Devices passed to :py:meth:`track` stay bound to the sysfs device matching
+    the arguments they were created with (or their address, for devices
+    created with an exact name): when it is unplugged, the device's open
+    attribute files are dropped, and when a matching device shows up again the
+    object is pointed at it. Registered callbacks receive a
+    :py:data:`DeviceEvent` for every event of the watched ``subsystems``.
+
+    Events are handled either by calling :py:meth:`process_events` (e.g. when
+    :py:meth:`fileno` is readable in your own ``select`` loop) or by a
+    background thread started with :py:meth:`start`.
+
+    ``source`` defaults to a :py:class:`UeventSource`; pass a
+    :py:class:`SimulatedEventSource` to drive the registry by hand.
+    """
+    def __init__(self, source=None, subsystems=DEFAULT_SUBSYSTEMS):
+        self.source = source if source is not None else UeventSource()
+        self.subsystems = subsystems
+        self._tracked = []
+        self._callbacks = []
+        self._lock = _thread.allocate_lock()
+        self._running = False
+
+    def fileno(self):
+        return self.source.fileno()
+
+    def track(self, device):
+        """
+        Starts following ``device`` and returns it.
+        """
+        criteria = dict(device.kwargs) if device.kwargs else {'address': device.address}
+
+        with self._lock:
+            self._tracked.append([device, criteria, True])
+
+        return device
+
+    def untrack(self, device):
+        with self._lock:
+            self._tracked = [entry for entry in self._tracked if entry[0] is not device]
+
+    def is_connected(self, device):
+        """
+        Returns False if ``device`` was unplugged and no matching device came
+        back since.
+        """
+        for tracked, criteria, connected in self._tracked:
+            if tracked is device:
+                return connected
+
+        raise ValueError("%s is not tracked" % device)
+
+    def add_callback(self, callback):
+        """
+        Calls ``callback(event)`` for every event, ``event`` being a
+        :py:data:`DeviceEvent`. Callbacks run in the thread that handles the
+        events.
+        """
+        self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        self._callbacks.remove(callback)
+
+    def _bind(self, class_path, name):
+        bound = []
+
+        for entry in self._tracked:
+            device, criteria, connected = entry
+
+            if connected or os.path.dirname(device._path) != class_path:
+                continue
+
+            name_pattern = getattr(device, 'SYSTEM_DEVICE_NAME_CONVENTION', '*')
+            for match, token in _matching_devices(class_path, [[name, None, {}]], name_pattern, criteria):
+                device._rebind(class_path + '/' + name)
+                entry[2] = True
+                bound.append(device)
+
+        return bound
+
+    def _unbind(self, class_path, name):
+        unbound = []
+
+        for entry in self._tracked:
+            device, criteria, connected = entry
+
+            if connected and device._path == class_path + '/' + name:
+                # Keep the path, so that using the device raises DeviceNotFound
+                device._rebind(device._path)
+                entry[2] = False
+                unbound.append(device)
+
+        return unbound
+
+    def process_events(self):
+        """
+        Handles the pending events without blocking and returns them as a list
+        of :py:data:`DeviceEvent`.
+        """
+        events = []
+
+        with self._lock:
+            for action, subsystem, name in self.source.read():
+                if subsystem not in self.subsystems:
+                    continue
+
+                class_path = abspath(Device.DEVICE_ROOT_PATH + '/' + subsystem)
+                refresh_device_index(class_path)
+
+                if action == 'add':
+                    devices = self._bind(class_path, name)
+                elif action == 'remove':
+                    devices = self._unbind(class_path, name)
+                else:
+                    devices = []
+
+                for device in devices or [None]:
+                    events.append(DeviceEvent(action, subsystem, name, device))
+
+        for event in events:
+            for callback in self._callbacks:
+                callback(event)
+
+        return events
+
+    def start(self):
+        """
+        Handles the events in a background thread until :py:meth:`stop` is
+        called.
+        """
+        if self._running:
+            return
+
+        def _monitor():
+            poll = select.poll()
+            poll.register(self.source.fileno(), select.POLLIN)
+
+            while self._running:
+                # Wake up regularly to notice stop()
+                if poll.poll(100):
+                    self.process_events()
+
+        self._running = True
+        _thread.start_new_thread(_monitor, ())
+
+    def stop(self):
+        self._running = False
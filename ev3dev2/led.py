@@ -30,8 +30,8 @@ import time
 import _thread
 from collections import OrderedDict
 from ev3dev2 import get_current_platform, Device
+from ev3dev2.clock import get_clock
 from ev3dev2.stopwatch import StopWatch
-from time import sleep
 
 if sys.version_info < (3, 4):
     raise SystemError('Must be using Python 3.4 or higher')
@@ -79,6 +79,9 @@ class Led(Device):
         '_delay_off',
         'desc',
     ]
+    _INT_ATTRIBUTES = ('max_brightness', 'brightness', 'delay_on', 'delay_off')
+    _SET_ATTRIBUTES = ('trigger', )
+    _SHADOWED_ATTRIBUTES = ('brightness', )
 
     def __init__(self, name_pattern=SYSTEM_DEVICE_NAME_CONVENTION, name_exact=False, desc=None, **kwargs):
         self.desc = desc
@@ -149,6 +152,9 @@ class Led(Device):
     def trigger(self, value):
         self._trigger = self.set_attr_string(self._trigger, 'trigger', value)
 
+        # Triggers drive the brightness on their own
+        self.invalidate_shadow('brightness')
+
         # Workaround for ev3dev/ev3dev#225.
         # When trigger is set to 'timer', we need to wait for 'delay_on' and
         # 'delay_off' attributes to appear with correct permissions.
@@ -423,7 +429,7 @@ class Leds(object):
                     break
 
                 even = not even
-                sleep(sleeptime)
+                get_clock().sleep(sleeptime)
 
             self.animate_thread_stop = False
             self.animate_thread_id = None
@@ -466,7 +472,7 @@ class Leds(object):
                     break
 
                 even = not even
-                sleep(sleeptime)
+                get_clock().sleep(sleeptime)
 
             self.animate_thread_stop = False
             self.animate_thread_id = None
@@ -512,7 +518,7 @@ class Leds(object):
                 if self.animate_thread_stop or stopwatch.is_elapsed_ms(duration_ms):
                     break
 
-                sleep(sleeptime)
+                get_clock().sleep(sleeptime)
 
             self.animate_thread_stop = False
             self.animate_thread_id = None
@@ -587,7 +593,7 @@ class Leds(object):
                 if self.animate_thread_stop or stopwatch.is_elapsed_ms(duration_ms):
                     break
 
-                sleep(sleeptime)
+                get_clock().sleep(sleeptime)
 
             self.animate_thread_stop = False
             self.animate_thread_id = None
@@ -0,0 +1,369 @@
+"""
+Occupancy grid mapping from range sensors and odometry.
+
+:py:class:`OccupancyGrid` divides the floor into square cells and keeps, for
+each, the log-odds that it is occupied. Every range reading (e.g. from an
+:py:class:`ev3dev2.sensor.lego.UltrasonicSensor`) is cast as a ray from the
+pose of the robot when it was taken: the cells the ray crosses become more
+likely free, the cell where it ends more likely occupied. The log-odds are
+stored as one signed byte per cell, so a 4 m by 4 m map with 25 mm cells
+takes 25 kB. The grid uses NumPy when it is installed (the rays are then
+cast as array operations), and the ``array`` module otherwise.
+
+:py:meth:`OccupancyGrid.plan` searches the grid for a path (A*), as a list of
+waypoints for :py:meth:`ev3dev2.motor.MoveDifferential.follow_path`::
+
+    from ev3dev2.clock import get_clock
+    from ev3dev2.mapping import OccupancyGrid
+    from ev3dev2.motor import OUTPUT_A, OUTPUT_B, MoveDifferential, SpeedRPM
+    from ev3dev2.sensor.lego import UltrasonicSensor
+    from ev3dev2.wheel import EV3Tire
+
+    mdiff = MoveDifferential(OUTPUT_A, OUTPUT_B, EV3Tire, 16 * 8)
+    ultrasonic = UltrasonicSensor()
+    grid = OccupancyGrid(4000, 4000, origin=(-2000, -2000))
+    mdiff.odometry_start()
+
+    samples = []
+
+    for i in range(100):
+        samples.append((get_clock().now(), ultrasonic.distance_centimeters * 10))
+
+    grid.update_from(mdiff.odometry, samples)
+    waypoints = grid.plan((mdiff.x_pos_mm, mdiff.y_pos_mm), (1500, 0), clearance_mm=100)
+
+    if waypoints is not None:
+        mdiff.follow_path(SpeedRPM(40), waypoints)
+"""
+
+import heapq
+import math
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#: The log-odds stored in the grid are in units of 1 / ``LOG_ODDS_SCALE``
+LOG_ODDS_SCALE = 16
+
+# The moves of the A* search: (dx, dy, cost), the diagonal cost being 14 / 10
+# of the straight one
+_MOVES = ((1, 0, 10), (0, 1, 10), (-1, 0, 10), (0, -1, 10), (1, 1, 14), (-1, 1, 14), (-1, -1, 14), (1, -1, 14))
+
+
+class OccupancyGrid(object):
+    """
+    A map of ``width_mm`` by ``height_mm``, whose lower left corner is at
+    ``origin`` (``(x_mm, y_mm)``, in the coordinates of
+    :py:class:`ev3dev2.odometry.Odometry`), made of square cells of
+    ``resolution_mm``.
+
+    Each reading adds ``hit`` to the log-odds of the cell where it ends and
+    ``miss`` to those of the cells before it, and the log-odds are kept
+    between ``-limit`` and ``limit`` (so that the map can still change), all
+    in units of 1 / :py:data:`LOG_ODDS_SCALE`. The defaults are a probability
+    of 0.85 of a reading ending in an occupied cell, and 0.4 of it crossing
+    one. Readings of ``max_range_mm`` or more (the ultrasonic sensor reports
+    2550 mm when nothing echoes) mark the cells up to ``max_range_mm`` free
+    and nothing occupied.
+
+    The log-odds are in ``log_odds``: a NumPy ``int8`` array of ``height``
+    rows and ``width`` columns if NumPy is installed and ``use_numpy`` is
+    True, an ``array('b')`` of the rows one after the other otherwise.
+    """
+
+    def __init__(self,
+                 width_mm,
+                 height_mm,
+                 resolution_mm=50,
+                 origin=(0, 0),
+                 hit=28,
+                 miss=-6,
+                 limit=100,
+                 max_range_mm=2550,
+                 use_numpy=True):
+        if not 0 < limit <= 127:
+            raise ValueError("limit must be between 1 and 127, not %s" % limit)
+
+        self.resolution_mm = resolution_mm
+        self.origin = (float(origin[0]), float(origin[1]))
+        self.width = int(math.ceil(width_mm / resolution_mm))
+        self.height = int(math.ceil(height_mm / resolution_mm))
+        self.hit = hit
+        self.miss = miss
+        self.limit = limit
+        self.max_range_mm = max_range_mm
+        self.numpy = numpy if use_numpy else None
+
+        if self.numpy is not None:
+            self.log_odds = self.numpy.zeros((self.height, self.width), dtype=self.numpy.int8)
+        else:
+            self.log_odds = array('b', bytes(self.width * self.height))
+
+    def __str__(self):
+        return "OccupancyGrid(%dx%d cells of %s mm)" % (self.width, self.height, self.resolution_mm)
+
+    @property
+    def nbytes(self):
+        """
+        The memory used by the log-odds, in bytes.
+        """
+        return self.width * self.height
+
+    def clear(self):
+        """
+        Forgets all the readings: every cell is unknown again.
+        """
+        if self.numpy is not None:
+            self.log_odds.fill(0)
+        else:
+            self.log_odds = array('b', bytes(self.width * self.height))
+
+    def cell(self, x_mm, y_mm):
+        """
+        Returns the ``(column, row)`` of the cell containing the point, which
+        may be outside of the grid.
+        """
+        return (int(math.floor((x_mm - self.origin[0]) / self.resolution_mm)),
+                int(math.floor((y_mm - self.origin[1]) / self.resolution_mm)))
+
+    def center(self, column, row):
+        """
+        Returns the ``(x_mm, y_mm)`` of the center of a cell.
+        """
+        return (self.origin[0] + (column + 0.5) * self.resolution_mm, self.origin[1] + (row + 0.5) * self.resolution_mm)
+
+    def _inside(self, column, row):
+        return 0 <= column < self.width and 0 <= row < self.height
+
+    def get(self, column, row):
+        """
+        Returns the log-odds of a cell (in units of 1 / :py:data:`LOG_ODDS_SCALE`),
+        0 (unknown) outside of the grid.
+        """
+        if not self._inside(column, row):
+            return 0
+
+        if self.numpy is not None:
+            return int(self.log_odds[row, column])
+
+        return self.log_odds[row * self.width + column]
+
+    def probability(self, x_mm, y_mm):
+        """
+        Returns the probability that the point is occupied, 0.5 if unknown.
+        """
+        return 1 / (1 + math.exp(-self.get(*self.cell(x_mm, y_mm)) / LOG_ODDS_SCALE))
+
+    def update(self, pose, distance_mm, sensor_pose=(0, 0, 0)):
+        """
+        Adds a reading of ``distance_mm`` taken at ``pose`` (``(x_mm, y_mm,
+        theta)`` as returned by :py:meth:`ev3dev2.odometry.Odometry.pose_at`)
+        by a sensor at ``sensor_pose`` (``(x_mm, y_mm, angle_degrees)``
+        relative to the robot, x forward and angles counter-clockwise).
+        """
+        (x, y, theta) = pose
+        (sensor_x, sensor_y, sensor_angle) = sensor_pose
+        (cos, sin) = (math.cos(theta), math.sin(theta))
+        x += sensor_x * cos - sensor_y * sin
+        y += sensor_x * sin + sensor_y * cos
+        theta += math.radians(sensor_angle)
+
+        hit = distance_mm < self.max_range_mm
+        distance_mm = min(distance_mm, self.max_range_mm)
+        (column0, row0) = self.cell(x, y)
+        (column1, row1) = self.cell(x + distance_mm * math.cos(theta), y + distance_mm * math.sin(theta))
+
+        # The cells of the ray, one per column or row along its longest axis
+        steps = max(abs(column1 - column0), abs(row1 - row0))
+
+        if self.numpy is not None:
+            self._cast_numpy(column0, row0, column1, row1, steps, hit)
+        else:
+            self._cast(column0, row0, column1, row1, steps, hit)
+
+    def _cast_numpy(self, column0, row0, column1, row1, steps, hit):
+        np = self.numpy
+        i = np.arange(steps + 1)
+        scale = 1.0 / steps if steps else 0.0
+        columns = column0 + np.floor(i * ((column1 - column0) * scale) + 0.5).astype(np.int32)
+        rows = row0 + np.floor(i * ((row1 - row0) * scale) + 0.5).astype(np.int32)
+        changes = np.full(steps + 1, self.miss, dtype=np.int16)
+
+        if hit:
+            changes[-1] = self.hit
+
+        inside = (columns >= 0) & (columns < self.width) & (rows >= 0) & (rows < self.height)
+        (columns, rows, changes) = (columns[inside], rows[inside], changes[inside])
+
+        values = self.log_odds[rows, columns].astype(np.int16) + changes
+        self.log_odds[rows, columns] = np.clip(values, -self.limit, self.limit).astype(np.int8)
+
+    def _cast(self, column0, row0, column1, row1, steps, hit):
+        log_odds = self.log_odds
+        width = self.width
+        limit = self.limit
+        scale = 1.0 / steps if steps else 0.0
+        column_step = (column1 - column0) * scale
+        row_step = (row1 - row0) * scale
+
+        for i in range(steps + 1):
+            column = column0 + int(math.floor(i * column_step + 0.5))
+            row = row0 + int(math.floor(i * row_step + 0.5))
+
+            if not self._inside(column, row):
+                continue
+
+            index = row * width + column
+            value = log_odds[index] + (self.hit if hit and i == steps else self.miss)
+            log_odds[index] = max(-limit, min(limit, value))
+
+    def update_from(self, odometry, samples, sensor_pose=(0, 0, 0)):
+        """
+        Adds the readings of ``samples``, a list of ``(time, distance_mm)``
+        pairs, each at the pose ``odometry`` (an
+        :py:class:`ev3dev2.odometry.Odometry`) recorded at its time. Returns
+        the number of readings added: those older than the recorded poses are
+        skipped.
+        """
+        count = 0
+
+        for (t, distance_mm) in samples:
+            pose = odometry.pose_at(t)
+
+            if pose is not None:
+                self.update(pose, distance_mm, sensor_pose)
+                count += 1
+
+        return count
+
+    def _blocked(self, threshold, clearance):
+        # One byte per cell, 1 for the cells within clearance cells of an
+        # occupied one
+        if self.numpy is not None:
+            np = self.numpy
+            occupied = self.log_odds > threshold
+            blocked = occupied.copy()
+
+            for dy in range(-clearance, clearance + 1):
+                for dx in range(-clearance, clearance + 1):
+                    if (dx or dy) and dx * dx + dy * dy <= clearance * clearance:
+                        blocked[max(dy, 0):self.height + min(dy, 0), max(dx, 0):self.width + min(dx, 0)] |= \
+                            occupied[max(-dy, 0):self.height + min(-dy, 0), max(-dx, 0):self.width + min(-dx, 0)]
+
+            return bytearray(blocked.astype(np.uint8).tobytes())
+
+        width = self.width
+        height = self.height
+        blocked = bytearray(width * height)
+        offsets = [(dx, dy) for dy in range(-clearance, clearance + 1) for dx in range(-clearance, clearance + 1)
+                   if dx * dx + dy * dy <= clearance * clearance]
+
+        for (index, value) in enumerate(self.log_odds):
+            if value > threshold:
+                (row, column) = divmod(index, width)
+
+                for (dx, dy) in offsets:
+                    if 0 <= column + dx < width and 0 <= row + dy < height:
+                        blocked[(row + dy) * width + column + dx] = 1
+
+        return blocked
+
+    def plan(self, start, goal, clearance_mm=0, threshold=0):
+        """
+        Returns the shortest path from ``start`` to ``goal`` (both ``(x_mm,
+        y_mm)``) avoiding the cells whose log-odds are above ``threshold``
+        (the unknown cells are 0, and can be crossed by default) by at least
+        ``clearance_mm``, e.g. half the width of the robot. The path is a list
+        of the ``(x_mm, y_mm)`` centers of the cells where it turns, ending at
+        ``goal``, for :py:meth:`ev3dev2.motor.MoveDifferential.follow_path`.
+        Returns None if there is no such path.
+
+        The search (A*) moves between neighbouring cells, diagonals included,
+        and keeps 5 bytes per cell while it runs.
+        """
+        width = self.width
+        height = self.height
+        blocked = self._blocked(threshold, int(math.ceil(clearance_mm / self.resolution_mm)))
+        (start_column, start_row) = self.cell(*start)
+        (goal_column, goal_row) = self.cell(*goal)
+
+        if not self._inside(start_column, start_row) or not self._inside(goal_column, goal_row):
+            raise ValueError("%s: %s and %s must be in the grid" % (self, start, goal))
+
+        start_index = start_row * width + start_column
+        goal_index = goal_row * width + goal_column
+
+        # The robot may already be too close to an obstacle, it can leave
+        blocked[start_index] = 0
+
+        if blocked[goal_index]:
+            return None
+
+        # The cost from the start of each cell, and the move that reached it
+        # (its index in _MOVES plus 1)
+        costs = array('i', [-1]) * (width * height)
+        moves = bytearray(width * height)
+        costs[start_index] = 0
+        queue = [(0, 0, start_index)]
+
+        while queue:
+            (estimate, cost, index) = heapq.heappop(queue)
+
+            if index == goal_index:
+                break
+
+            # Stale entry, the cell was reached at a lower cost since
+            if cost != costs[index]:
+                continue
+
+            (row, column) = divmod(index, width)
+
+            for (move, (dx, dy, step)) in enumerate(_MOVES):
+                (next_column, next_row) = (column + dx, row + dy)
+
+                if not (0 <= next_column < width and 0 <= next_row < height):
+                    continue
+
+                next_index = next_row * width + next_column
+
+                # Diagonal moves may not cut the corner of a blocked cell
+                if blocked[next_index] or (dx and dy and (blocked[row * width + next_column] or
+                                                          blocked[next_row * width + column])):
+                    continue
+
+                next_cost = cost + step
+
+                if costs[next_index] < 0 or next_cost < costs[next_index]:
+                    costs[next_index] = next_cost
+                    moves[next_index] = move + 1
+                    estimate = next_cost + self._heuristic(next_column, next_row, goal_column, goal_row)
+                    heapq.heappush(queue, (estimate, next_cost, next_index))
+        else:
+            return None
+
+        # Back from the goal, keeping the cells where the direction changes
+        waypoints = [(float(goal[0]), float(goal[1]))]
+        index = goal_index
+        direction = None
+
+        while index != start_index:
+            (dx, dy, step) = _MOVES[moves[index] - 1]
+
+            if direction is not None and (dx, dy) != direction:
+                waypoints.append(self.center(index % width, index // width))
+
+            direction = (dx, dy)
+            index -= dy * width + dx
+
+        waypoints.reverse()
+        return waypoints
+
+    @staticmethod
+    def _heuristic(column, row, goal_column, goal_row):
+        # The cost of the path without obstacles (octile distance)
+        dx = abs(goal_column - column)
+        dy = abs(goal_row - row)
+        return 10 * max(dx, dy) + 4 * min(dx, dy)
@@ -23,7 +23,6 @@
 import sys
 import math
 import select
-import time
 import _thread
 
 # python3 uses collections
@@ -35,7 +34,13 @@ except ImportError:
 
 from logging import getLogger
 from os.path import abspath
-from ev3dev2 import get_current_platform, Device, list_device_names, DeviceNotDefined, ThreadNotRunning
+from ev3dev2 import get_current_platform, get_backend, Device, list_device_names, DeviceNotDefined, ThreadNotRunning
+from ev3dev2.clock import get_clock
+from ev3dev2.control.loop import ControlLoop
+from ev3dev2.control.pid import PID
+from ev3dev2.control.profile import ProfileExecutor
+from ev3dev2.odometry import Odometry
+from ev3dev2.planner import RoutePlan
 from ev3dev2.stopwatch import StopWatch
 
 # OUTPUT ports have platform specific values that we must import
@@ -73,6 +78,11 @@ log = getLogger(__name__)
 # update to 'running' in the "on_for_XYZ" methods of the Motor class
 WAIT_RUNNING_TIMEOUT = 100
 
+# When the end of a move is predicted, the waits check the state every
+# WAIT_FINISH_POLL milliseconds from WAIT_FINISH_MARGIN milliseconds before it
+WAIT_FINISH_MARGIN = 50
+WAIT_FINISH_POLL = 5
+
 
 class SpeedInvalid(ValueError):
     pass
@@ -266,6 +276,36 @@ def speed_to_speedvalue(speed, desc=None):
         return SpeedPercent(speed, desc)
 
 
+def _state_flags_table(names):
+    # The state_flags value of every combination of the flags ``names``, keyed
+    # by the ``state`` line the driver writes for it (flags in that order)
+    table = {}
+
+    for flags in range(1 << len(names)):
+        table[' '.join([name for (bit, name) in enumerate(names) if flags & (1 << bit)])] = flags
+
+    return table
+
+
+def _poll_timeout(clock, poll_tm, expected):
+    # The poll timeout of the waits: poll_tm until shortly before the
+    # expected end of the wait, WAIT_FINISH_POLL from then on
+    if expected is None:
+        return poll_tm
+
+    remaining = int((expected - clock.now()) * 1000) - WAIT_FINISH_MARGIN
+
+    if remaining <= 0:
+        return WAIT_FINISH_POLL
+
+    return min(poll_tm, remaining)
+
+
+def _not_moving(flags):
+    # The condition of wait_until_not_moving(), on state_flags
+    return not (flags & Motor.STATE_FLAG_RUNNING) or (flags & Motor.STATE_FLAG_STALLED) != 0
+
+
 class Motor(Device):
     """
     The motor class provides a uniform interface for using motors with
@@ -312,6 +352,30 @@ class Motor(Device):
         'max_dpm',
     ]
 
+    _INT_ATTRIBUTES = (
+        'count_per_rot',
+        'count_per_m',
+        'duty_cycle',
+        'duty_cycle_sp',
+        'full_travel_count',
+        'position',
+        'position_sp',
+        'max_speed',
+        'speed',
+        'speed_sp',
+        'ramp_up_sp',
+        'ramp_down_sp',
+        'time_sp',
+        'hold_pid/Kp',
+        'hold_pid/Ki',
+        'hold_pid/Kd',
+        'speed_pid/Kp',
+        'speed_pid/Ki',
+        'speed_pid/Kd',
+    )
+    _SET_ATTRIBUTES = ('commands', 'state', 'stop_actions')
+    _SHADOWED_ATTRIBUTES = ('speed_sp', 'position_sp', 'duty_cycle_sp', 'stop_action', 'time_sp')
+
     #: Run the motor until another command is sent.
     COMMAND_RUN_FOREVER = 'run-forever'
 
@@ -371,6 +435,32 @@ class Motor(Device):
     #: The motor is not turning when it should be.
     STATE_STALLED = 'stalled'
 
+    #: ``state_flags`` bit of ``running``
+    STATE_FLAG_RUNNING = 1
+
+    #: ``state_flags`` bit of ``ramping``
+    STATE_FLAG_RAMPING = 2
+
+    #: ``state_flags`` bit of ``holding``
+    STATE_FLAG_HOLDING = 4
+
+    #: ``state_flags`` bit of ``overloaded``
+    STATE_FLAG_OVERLOADED = 8
+
+    #: ``state_flags`` bit of ``stalled``
+    STATE_FLAG_STALLED = 16
+
+    #: The ``state_flags`` bit of each flag of ``state``
+    STATE_FLAGS = {
+        STATE_RUNNING: STATE_FLAG_RUNNING,
+        STATE_RAMPING: STATE_FLAG_RAMPING,
+        STATE_HOLDING: STATE_FLAG_HOLDING,
+        STATE_OVERLOADED: STATE_FLAG_OVERLOADED,
+        STATE_STALLED: STATE_FLAG_STALLED,
+    }
+
+    _STATE_FLAGS_TABLE = _state_flags_table(('running', 'ramping', 'holding', 'overloaded', 'stalled'))
+
     #: Power will be removed from the motor and it will freely coast to a stop.
     STOP_ACTION_COAST = 'coast'
 
@@ -427,6 +517,16 @@ class Motor(Device):
         self.max_dps = self.max_rps * 360
         self.max_dpm = self.max_rpm * 360
 
+    def _rebind(self, path):
+        super(Motor, self)._rebind(path)
+
+        # The poll objects watch the state file of the old device, wait()
+        # and the move handles register the new one
+        self._poll = None
+
+        with _move_waiter.lock:
+            _move_waiter._changed = True
+
     @property
     def address(self):
         """
@@ -447,6 +547,14 @@ class Motor(Device):
     def command(self, value):
         self._command = self.set_attr_string(self._command, 'command', value)
 
+        if value == self.COMMAND_RESET:
+            # reset puts all the setpoints back to their defaults
+            self.invalidate_shadow()
+        else:
+            # remembered for MoveTank.set_speeds_native(), which leaves alone
+            # a motor that is already running forever at the right speed
+            self._shadow['command'] = value
+
     @property
     def commands(self):
         """
@@ -729,6 +837,49 @@ class Motor(Device):
         self._state, value = self.get_attr_set(self._state, 'state')
         return value
 
+    @property
+    def state_flags(self):
+        """
+        The ``state`` as an integer, combining the ``STATE_FLAG_*`` bits of
+        its flags (see ``STATE_FLAGS``). The line read from the driver is
+        looked up in a precomputed table, without building a list of strings,
+        so this is the cheap way to check the state in a loop, and to check
+        several flags with a single read::
+
+            flags = m.state_flags
+
+            if flags & (m.STATE_FLAG_STALLED | m.STATE_FLAG_OVERLOADED):
+                ...
+        """
+        self._state, flags = self._read_state_flags(self._state)
+        return flags
+
+    def _read_state_flags(self, attribute):
+        # state_flags read from the given handle of the state file, which is
+        # returned with the flags as for get_attr_string()
+        attribute, value = self.get_attr_string(attribute, 'state')
+        flags = self._STATE_FLAGS_TABLE.get(value)
+
+        if flags is None:
+            # Not in the order of the driver
+            flags = 0
+
+            for name in value.split():
+                flags |= self.STATE_FLAGS.get(name, 0)
+
+        return attribute, flags
+
+    def has_state_flags(self, set_flags=0, clear_flags=0):
+        """
+        Reads the state once, and returns True if all the ``STATE_FLAG_*``
+        bits of ``set_flags`` are set and all those of ``clear_flags`` are
+        clear. For instance, running at speed::
+
+            m.has_state_flags(m.STATE_FLAG_RUNNING, m.STATE_FLAG_RAMPING | m.STATE_FLAG_STALLED)
+        """
+        flags = self.state_flags
+        return (flags & set_flags) == set_flags and not (flags & clear_flags)
+
     @property
     def stop_action(self):
         """
@@ -845,52 +996,63 @@ class Motor(Device):
         """
         Power is being sent to the motor.
         """
-        return self.STATE_RUNNING in self.state
+        return bool(self.state_flags & self.STATE_FLAG_RUNNING)
 
     @property
     def is_ramping(self):
         """
         The motor is ramping up or down and has not yet reached a constant output level.
         """
-        return self.STATE_RAMPING in self.state
+        return bool(self.state_flags & self.STATE_FLAG_RAMPING)
 
     @property
     def is_holding(self):
         """
         The motor is not turning, but rather attempting to hold a fixed position.
         """
-        return self.STATE_HOLDING in self.state
+        return bool(self.state_flags & self.STATE_FLAG_HOLDING)
 
     @property
     def is_overloaded(self):
         """
         The motor is turning, but cannot reach its ``speed_sp``.
         """
-        return self.STATE_OVERLOADED in self.state
+        return bool(self.state_flags & self.STATE_FLAG_OVERLOADED)
 
     @property
     def is_stalled(self):
         """
         The motor is not turning when it should be.
         """
-        return self.STATE_STALLED in self.state
+        return bool(self.state_flags & self.STATE_FLAG_STALLED)
 
-    def wait(self, cond, timeout=None):
+    def wait(self, cond, timeout=None, flags=False, expected=None):
         """
         Blocks until ``cond(self.state)`` is ``True``.  The condition is
         checked when there is an I/O event related to the ``state`` attribute.
         Exits early when ``timeout`` (in milliseconds) is reached.
 
+        If ``flags`` is True, ``cond`` is given ``self.state_flags`` instead,
+        which is cheaper to read.
+
+        ``expected`` is the time (of the library clock, see
+        :py:mod:`ev3dev2.clock`) at which the condition is expected to be
+        met, e.g. from :py:meth:`predict_stop_time`. From shortly before it,
+        the condition is checked every few milliseconds instead of every 100
+        milliseconds, so the wait ends right away even if the I/O event is
+        missed.
+
         Returns ``True`` if the condition is met, and ``False`` if the timeout
         is reached.
         """
 
-        tic = time.time()
+        clock = get_clock()
+        deadline = clock.deadline(timeout)
 
         if self._poll is None:
             if self._state is None:
                 self._state = self._attribute_file_open('state')
-            self._poll = select.poll()
+            self._poll = get_backend().poll()
             self._poll.register(self._state, select.POLLPRI)
 
         # Set poll timeout to something small. For more details, see
@@ -902,21 +1064,22 @@ class Motor(Device):
 
         while True:
             # This check is now done every poll_tm even if poll has nothing to report:
-            if cond(self.state):
+            if cond(self.state_flags if flags else self.state):
                 return True
 
-            self._poll.poll(poll_tm)
+            clock.poll(self._poll, _poll_timeout(clock, poll_tm, expected))
 
-            if timeout is not None and time.time() >= tic + timeout / 1000:
+            if clock.expired(deadline):
                 # Final check when user timeout is reached
-                return cond(self.state)
+                return cond(self.state_flags if flags else self.state)
 
-    def wait_until_not_moving(self, timeout=None):
+    def wait_until_not_moving(self, timeout=None, expected=None):
         """
         Blocks until ``running`` is not in ``self.state`` or ``stalled`` is in
         ``self.state``.  The condition is checked when there is an I/O event
         related to the ``state`` attribute.  Exits early when ``timeout``
-        (in milliseconds) is reached.
+        (in milliseconds) is reached. ``expected`` is the predicted stop
+        time, see ``wait()``.
 
         Returns ``True`` if the condition is met, and ``False`` if the timeout
         is reached.
@@ -925,7 +1088,7 @@ class Motor(Device):
 
             m.wait_until_not_moving()
         """
-        return self.wait(lambda state: self.STATE_RUNNING not in state or self.STATE_STALLED in state, timeout)
+        return self.wait(_not_moving, timeout, flags=True, expected=expected)
 
     def wait_until(self, s, timeout=None):
         """
@@ -940,7 +1103,12 @@ class Motor(Device):
 
             m.wait_until('stalled')
         """
-        return self.wait(lambda state: s in state, timeout)
+        bit = self.STATE_FLAGS.get(s)
+
+        if bit is None:
+            return self.wait(lambda state: s in state, timeout)
+
+        return self.wait(lambda flags: (flags & bit) != 0, timeout, flags=True)
 
     def wait_while(self, s, timeout=None):
         """
@@ -955,7 +1123,56 @@ class Motor(Device):
 
             m.wait_while('running')
         """
-        return self.wait(lambda state: s not in state, timeout)
+        bit = self.STATE_FLAGS.get(s)
+
+        if bit is None:
+            return self.wait(lambda state: s not in state, timeout)
+
+        return self.wait(lambda flags: (flags & bit) == 0, timeout, flags=True)
+
+    def predict_stop_time(self, distance=None, seconds=None):
+        """
+        Predicts when a move started just now will end, from ``speed_sp``,
+        ``ramp_up_sp``, ``ramp_down_sp`` and the current ``speed``. The move
+        covers ``distance`` tacho counts (``run-to-*-pos``), or runs for
+        ``seconds`` (``run-timed``), then slows down to a stop.
+
+        Returns a time of the library clock (see :py:mod:`ev3dev2.clock`),
+        for the ``expected`` argument of the waits, or None when ``speed_sp``
+        is 0. The position regulation of the driver takes a little longer to
+        settle at the end of the move, so the prediction is slightly early.
+        """
+        now = get_clock().now()
+        speed_sp = self._shadow.get('speed_sp')
+
+        if speed_sp is None:
+            speed_sp = self.speed_sp
+
+        speed_sp = abs(speed_sp)
+
+        if not speed_sp:
+            return None
+
+        (speed, ramp_up_sp, ramp_down_sp) = self.read_attrs('speed', 'ramp_up_sp', 'ramp_down_sp')
+        speed = min(abs(speed), speed_sp)
+
+        # Seconds per count/s of change of speed
+        up = ramp_up_sp / 1000 / self.max_speed
+        down = ramp_down_sp / 1000 / self.max_speed
+
+        if seconds is not None:
+            return now + seconds + speed_sp * down
+
+        ramp_up_time = (speed_sp - speed) * up
+        ramp_down_time = speed_sp * down
+        ramps_distance = (speed_sp + speed) / 2 * ramp_up_time + speed_sp / 2 * ramp_down_time
+
+        if ramps_distance <= distance:
+            return now + ramp_up_time + (distance - ramps_distance) / speed_sp + ramp_down_time
+
+        # Too short to reach speed_sp
+        peak = max(speed, math.sqrt((distance + speed * speed * up / 2) / ((up + down) / 2)))
+        return now + (peak - speed) * up + peak * down
 
     def _speed_native_units(self, speed, label=None):
         speed = speed_to_speedvalue(speed, label)
@@ -983,6 +1200,9 @@ class Motor(Device):
 
         ``speed`` can be a percentage or a :class:`ev3dev2.motor.SpeedValue`
         object, enabling use of other units.
+
+        With ``block=False``, returns a :class:`ev3dev2.motor.MoveHandle` of
+        the move.
         """
         speed_sp = self._speed_native_units(speed)
         self._set_rel_position_degrees_and_speed_sp(rotations * 360, speed_sp)
@@ -990,8 +1210,9 @@ class Motor(Device):
         self.run_to_rel_pos()
 
         if block:
-            self.wait_until('running', timeout=WAIT_RUNNING_TIMEOUT)
-            self.wait_until_not_moving()
+            self._block(distance=abs(self._shadow['position_sp']))
+        else:
+            return self._handle(distance=abs(self._shadow['position_sp']))
 
     def on_for_degrees(self, speed, degrees, brake=True, block=True):
         """
@@ -999,6 +1220,9 @@ class Motor(Device):
 
         ``speed`` can be a percentage or a :class:`ev3dev2.motor.SpeedValue`
         object, enabling use of other units.
+
+        With ``block=False``, returns a :class:`ev3dev2.motor.MoveHandle` of
+        the move.
         """
         speed_sp = self._speed_native_units(speed)
         self._set_rel_position_degrees_and_speed_sp(degrees, speed_sp)
@@ -1006,8 +1230,9 @@ class Motor(Device):
         self.run_to_rel_pos()
 
         if block:
-            self.wait_until('running', timeout=WAIT_RUNNING_TIMEOUT)
-            self.wait_until_not_moving()
+            self._block(distance=abs(self._shadow['position_sp']))
+        else:
+            return self._handle(distance=abs(self._shadow['position_sp']))
 
     def on_to_position(self, speed, position, brake=True, block=True):
         """
@@ -1015,6 +1240,9 @@ class Motor(Device):
 
         ``speed`` can be a percentage or a :class:`ev3dev2.motor.SpeedValue`
         object, enabling use of other units.
+
+        With ``block=False``, returns a :class:`ev3dev2.motor.MoveHandle` of
+        the move.
         """
         speed = self._speed_native_units(speed)
         self.speed_sp = int(round(speed))
@@ -1022,9 +1250,12 @@ class Motor(Device):
         self._set_brake(brake)
         self.run_to_abs_pos()
 
+        distance = abs(position - self.position)
+
         if block:
-            self.wait_until('running', timeout=WAIT_RUNNING_TIMEOUT)
-            self.wait_until_not_moving()
+            self._block(distance=distance)
+        else:
+            return self._handle(distance=distance)
 
     def on_for_seconds(self, speed, seconds, brake=True, block=True):
         """
@@ -1032,6 +1263,9 @@ class Motor(Device):
 
         ``speed`` can be a percentage or a :class:`ev3dev2.motor.SpeedValue`
         object, enabling use of other units.
+
+        With ``block=False``, returns a :class:`ev3dev2.motor.MoveHandle` of
+        the move.
         """
 
         if seconds < 0:
@@ -1044,8 +1278,9 @@ class Motor(Device):
         self.run_timed()
 
         if block:
-            self.wait_until('running', timeout=WAIT_RUNNING_TIMEOUT)
-            self.wait_until_not_moving()
+            self._block(seconds=seconds)
+        else:
+            return self._handle(seconds=seconds)
 
     def on(self, speed, brake=True, block=False):
         """
@@ -1070,6 +1305,14 @@ class Motor(Device):
         self._set_brake(brake)
         self.stop()
 
+    def _block(self, distance=None, seconds=None):
+        expected = self.predict_stop_time(distance, seconds)
+        self.wait_until('running', timeout=WAIT_RUNNING_TIMEOUT)
+        self.wait_until_not_moving(expected=expected)
+
+    def _handle(self, distance=None, seconds=None):
+        return MoveHandle([self], self.predict_stop_time(distance, seconds))
+
     @property
     def rotations(self):
         return float(self.position / self.count_per_rot)
@@ -1200,6 +1443,9 @@ class DcMotor(Device):
         '_stop_actions',
         '_time_sp',
     ]
+    _INT_ATTRIBUTES = ('duty_cycle', 'duty_cycle_sp', 'ramp_down_sp', 'ramp_up_sp', 'time_sp')
+    _SET_ATTRIBUTES = ('commands', 'state', 'stop_actions')
+    _SHADOWED_ATTRIBUTES = ('duty_cycle_sp', 'stop_action', 'time_sp')
 
     def __init__(self, address=None, name_pattern=SYSTEM_DEVICE_NAME_CONVENTION, name_exact=False, **kwargs):
 
@@ -1457,6 +1703,9 @@ class ServoMotor(Device):
         '_rate_sp',
         '_state',
     ]
+    _INT_ATTRIBUTES = ('max_pulse_sp', 'mid_pulse_sp', 'min_pulse_sp', 'position_sp', 'rate_sp')
+    _SET_ATTRIBUTES = ('state', )
+    _SHADOWED_ATTRIBUTES = ('position_sp', 'rate_sp')
 
     def __init__(self, address=None, name_pattern=SYSTEM_DEVICE_NAME_CONVENTION, name_exact=False, **kwargs):
 
@@ -1640,7 +1889,268 @@ class ServoMotor(Device):
         self.command = self.COMMAND_FLOAT
 
 
+class MoveHandle(object):
+    """
+    A move started by a motion command called with ``block=False``, e.g.
+    ``Motor.on_for_degrees()`` or ``MoveTank.on_for_rotations()``. The move
+    is done once all its ``motors`` have stopped (or stalled), as with
+    ``block=True``.
+
+    The handles are watched by a single background thread, which waits for
+    the ``state`` of all their motors with one poll object, so several moves
+    can overlap without a thread per motor::
+
+        arm_move = arm.on_for_degrees(20, 90, block=False)
+        drive_move = tank.on_for_rotations(50, 50, 3, block=False)
+        arm_move.add_done_callback(lambda move: print('arm in place'))
+        drive_move.wait()
+
+    A handle is only watched once :py:meth:`done`, :py:meth:`wait` or
+    :py:meth:`add_done_callback` is called, so the handles that are ignored
+    cost nothing.
+    """
+
+    def __init__(self, motors, expected=None):
+        self.motors = list(motors)
+
+        #: The predicted end of the move, see ``Motor.predict_stop_time()``
+        self.expected = expected
+
+        self._start = get_clock().now()
+        self._started = False
+        self._watched = False
+        self._done = False
+        self._cancelled = False
+        self._callbacks = []
+        self._lock = _thread.allocate_lock()
+        self._lock.acquire()
+
+    def __repr__(self):
+        return "%s(%s, %s)" % (self.__class__.__name__, ', '.join([str(motor) for motor in self.motors]),
+                               'cancelled' if self._cancelled else 'done' if self._done else 'pending')
+
+    def _check(self, clock, flags):
+        # Same as the blocking moves: wait for all the motors to be running
+        # (for up to WAIT_RUNNING_TIMEOUT), then for all of them to stop.
+        # ``flags`` are the state_flags of the motors
+        if not self._started:
+            if all([flag & Motor.STATE_FLAG_RUNNING for flag in flags]) or \
+                    clock.now() - self._start >= WAIT_RUNNING_TIMEOUT / 1000:
+                self._started = True
+            else:
+                return False
+
+        return all([_not_moving(flag) for flag in flags])
+
+    def _finish(self, cancelled=False):
+        with _move_waiter.lock:
+            if self._done:
+                return False
+
+            self._done = True
+            self._cancelled = cancelled
+            callbacks = self._callbacks
+            self._callbacks = []
+
+            if self in _move_waiter.handles:
+                _move_waiter.handles.remove(self)
+                _move_waiter._changed = True
+
+        self._lock.release()
+
+        for fn in callbacks:
+            self._call(fn)
+
+        return True
+
+    def _call(self, fn):
+        try:
+            fn(self)
+        except Exception as e:
+            log.exception(e)
+
+    def _watch(self):
+        if self._watched:
+            return
+
+        self._watched = True
+
+        if self._check(get_clock(), [motor.state_flags for motor in self.motors]):
+            self._finish()
+        else:
+            _move_waiter.add(self)
+
+    def done(self):
+        """
+        True if the move has ended, or was cancelled.
+        """
+        if not self._done:
+            self._watch()
+
+        return self._done
+
+    def cancelled(self):
+        """
+        True if the move was stopped by :py:meth:`cancel`.
+        """
+        return self._cancelled
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the move has ended. Exits early when ``timeout`` (in
+        milliseconds) is reached.
+
+        Returns ``True`` if the move has ended, and ``False`` if the timeout
+        is reached.
+        """
+        if self.done():
+            return True
+
+        if timeout is None:
+            with self._lock:
+                pass
+        else:
+            clock = get_clock()
+            deadline = clock.deadline(timeout)
+
+            while not self._done and not clock.expired(deadline):
+                clock.sleep(WAIT_FINISH_POLL / 1000)
+
+        return self._done
+
+    def add_done_callback(self, fn):
+        """
+        Calls ``fn(handle)`` when the move has ended, from the background
+        thread, or right away if it has already ended. Exceptions raised by
+        ``fn`` are logged.
+        """
+        with _move_waiter.lock:
+            if not self._done:
+                self._callbacks.append(fn)
+                fn = None
+
+        if fn is None:
+            self._watch()
+        else:
+            self._call(fn)
+
+    def cancel(self):
+        """
+        Stops the motors of the move (as their ``stop_action`` says) and ends
+        it. Returns ``False`` if the move had already ended.
+        """
+        if self._done:
+            return False
+
+        for motor in self.motors:
+            motor.stop()
+
+        return self._finish(cancelled=True)
+
+
+class _MoveWaiter(object):
+    # The background thread of the MoveHandles. It runs while there are
+    # handles to watch, and wakes up when the state of one of their motors
+    # changes. It reads the state through its own files, so it never seeks
+    # the Motor._state used by the other threads.
+
+    def __init__(self):
+        self.lock = _thread.allocate_lock()
+        self.handles = []
+        self._changed = False
+        self._running = False
+
+        # The state file of each watched motor, only used by the thread
+        self._states = {}
+
+    def add(self, handle):
+        with self.lock:
+            self.handles.append(handle)
+            self._changed = True
+
+            if not self._running:
+                self._running = True
+                _thread.start_new_thread(self._run, ())
+
+    def _state_flags(self, motor):
+        self._states[motor], flags = motor._read_state_flags(self._states.get(motor))
+        return flags
+
+    def _close_states(self):
+        for attribute in self._states.values():
+            if attribute is not None:
+                attribute.close()
+
+        self._states = {}
+
+    def _poll(self, handles):
+        poll = get_backend().poll()
+
+        for handle in handles:
+            for motor in handle.motors:
+                if self._states.get(motor) is None:
+                    self._states[motor] = motor._attribute_file_open('state')
+                poll.register(self._states[motor], select.POLLPRI)
+
+        return poll
+
+    def _run(self):
+        poll = None
+
+        while True:
+            with self.lock:
+                if not self.handles:
+                    self._close_states()
+                    self._running = False
+                    return
+
+                handles = list(self.handles)
+
+                if self._changed:
+                    # The motors were rebound, or are not all watched anymore
+                    self._changed = False
+                    self._close_states()
+                    poll = None
+
+            clock = get_clock()
+            pending = []
+
+            for handle in handles:
+                try:
+                    if handle._check(clock, [self._state_flags(motor) for motor in handle.motors]):
+                        handle._finish()
+                    else:
+                        pending.append(handle)
+                except Exception as e:
+                    # e.g. a motor was unplugged, the move cannot go on
+                    log.exception(e)
+                    handle._finish()
+
+            if not pending:
+                continue
+
+            try:
+                if poll is None:
+                    poll = self._poll(pending)
+
+                clock.poll(poll, min([_poll_timeout(clock, 100, handle.expected) for handle in pending]))
+            except Exception as e:
+                log.exception(e)
+                poll = None
+                clock.sleep(WAIT_FINISH_POLL / 1000)
+
+
+_move_waiter = _MoveWaiter()
+
+
 class MotorSet(object):
+
+    #: ``wait()`` returns once the condition holds for every motor
+    WAIT_ALL = 'all'
+
+    #: ``wait()`` returns once the condition holds for at least one motor
+    WAIT_ANY = 'any'
+
     def __init__(self, motor_specs, desc=None):
         """
         motor_specs is a dictionary such as
@@ -1745,62 +2255,188 @@ class MotorSet(object):
         """
         self.off(motors, brake)
 
-    def _is_state(self, motors, state):
+    def run_profiles(self, profiles, period=0.01, mode=ProfileExecutor.SPEED, position_gain=0.0, brake=True):
+        """
+        Make the motors follow motion profiles (see
+        :py:mod:`ev3dev2.control.profile`) and return when they are over.
+        ``profiles`` maps the ports of the motors to their profile, the other
+        arguments are those of :py:class:`ev3dev2.control.profile.ProfileExecutor`.
+
+        Returns the executor, e.g. to reuse its precomputed setpoints with
+        another ``run()``.
+        """
+        executor = ProfileExecutor([(self.motors[port], profile) for (port, profile) in profiles.items()],
+                                   period=period,
+                                   mode=mode,
+                                   position_gain=position_gain,
+                                   brake=brake)
+        executor.run()
+        return executor
+
+    def read_attrs(self, *names, motors=None):
+        """
+        Snapshot attributes ``names`` of every motor in one call. Returns a
+        tuple with one :meth:`ev3dev2.Device.read_attrs` tuple per motor, in
+        the same order as ``motors`` (``self.motors`` by default).
+
+        Example::
+
+            ((left_pos, left_speed), (right_pos, right_speed)) = tank.read_attrs('position', 'speed')
+        """
+        motors = motors if motors is not None else self.motors.values()
+        return tuple([motor.read_attrs(*names) for motor in motors])
+
+    def _is_state(self, motors, flag):
         motors = motors if motors is not None else self.motors.values()
 
         for motor in motors:
-            if state not in motor.state:
+            if not motor.state_flags & flag:
                 return False
 
         return True
 
     @property
     def is_running(self, motors=None):
-        return self._is_state(motors, LargeMotor.STATE_RUNNING)
+        return self._is_state(motors, Motor.STATE_FLAG_RUNNING)
 
     @property
     def is_ramping(self, motors=None):
-        return self._is_state(motors, LargeMotor.STATE_RAMPING)
+        return self._is_state(motors, Motor.STATE_FLAG_RAMPING)
 
     @property
     def is_holding(self, motors=None):
-        return self._is_state(motors, LargeMotor.STATE_HOLDING)
+        return self._is_state(motors, Motor.STATE_FLAG_HOLDING)
 
     @property
     def is_overloaded(self, motors=None):
-        return self._is_state(motors, LargeMotor.STATE_OVERLOADED)
+        return self._is_state(motors, Motor.STATE_FLAG_OVERLOADED)
 
     @property
     def is_stalled(self, motors=None):
-        return self._is_state(motors, LargeMotor.STATE_STALLED)
+        return self._is_state(motors, Motor.STATE_FLAG_STALLED)
 
-    def wait(self, cond, timeout=None, motors=None):
-        motors = motors if motors is not None else self.motors.values()
+    def wait(self, cond, timeout=None, motors=None, mode=WAIT_ALL, flags=False, expected=None):
+        """
+        Blocks until ``cond(motor.state)`` is ``True`` for all the ``motors``
+        (all the motors of the set by default), or for at least one of them
+        if ``mode`` is ``MotorSet.WAIT_ANY``. Exits early when ``timeout`` (in
+        milliseconds) is reached. If ``flags`` is True, ``cond`` is given
+        ``motor.state_flags`` instead of ``motor.state``. ``expected`` is the
+        time at which the condition is expected to be met, see
+        :py:meth:`Motor.wait`.
 
-        for motor in motors:
-            motor.wait(cond, timeout)
+        The ``state`` attribute of every motor is watched by a single poll
+        object, and only the motors that reported an I/O event are checked
+        again, so the wait ends as soon as the condition holds for the set.
 
-    def wait_until_not_moving(self, timeout=None, motors=None):
-        motors = motors if motors is not None else self.motors.values()
+        Returns ``True`` if the condition is met, and ``False`` if the timeout
+        is reached.
+        """
+        motors = list(motors if motors is not None else self.motors.values())
 
-        for motor in motors:
-            motor.wait_until_not_moving(timeout)
+        if mode not in (self.WAIT_ALL, self.WAIT_ANY):
+            raise ValueError("mode must be '%s' or '%s', not '%s'" % (self.WAIT_ALL, self.WAIT_ANY, mode))
 
-    def wait_until(self, s, timeout=None, motors=None):
-        motors = motors if motors is not None else self.motors.values()
+        clock = get_clock()
+        deadline = clock.deadline(timeout)
+        poll = get_backend().poll()
+        index = {}
 
-        for motor in motors:
-            motor.wait_until(s, timeout)
+        for (i, motor) in enumerate(motors):
+            if motor._state is None:
+                motor._state = motor._attribute_file_open('state')
+            poll.register(motor._state, select.POLLPRI)
 
-    def wait_while(self, s, timeout=None, motors=None):
-        motors = motors if motors is not None else self.motors.values()
+            # python reports the file descriptor, micropython and the memory
+            # backend the registered object
+            index[motor._state] = i
+            if hasattr(motor._state, 'fileno'):
+                index[motor._state.fileno()] = i
 
-        for motor in motors:
-            motor.wait_while(s, timeout)
+        # Same as in Motor.wait(), every motor is checked again every poll_tm
+        # even if poll has nothing to report
+        if timeout:
+            poll_tm = min(timeout, 100)
+        else:
+            poll_tm = 100
+
+        met = [False] * len(motors)
+        changed = range(len(motors))
+        combine = all if mode == self.WAIT_ALL else any
+
+        while True:
+            for i in changed:
+                met[i] = cond(motors[i].state_flags if flags else motors[i].state)
+
+            if combine(met):
+                return True
+
+            if clock.expired(deadline):
+                return False
+
+            events = clock.poll(poll, _poll_timeout(clock, poll_tm, expected))
+
+            if events:
+                changed = [index[fd] for (fd, event) in events]
+            else:
+                changed = range(len(motors))
 
-    def _block(self):
+    def wait_until_not_moving(self, timeout=None, motors=None, mode=WAIT_ALL, expected=None):
+        """
+        Blocks until ``running`` is not in the ``state`` of the motors or
+        ``stalled`` is. See ``wait()`` for ``motors``, ``mode`` and
+        ``expected``.
+        """
+        return self.wait(_not_moving, timeout, motors, mode, flags=True, expected=expected)
+
+    def wait_until(self, s, timeout=None, motors=None, mode=WAIT_ALL):
+        """
+        Blocks until ``s`` is in the ``state`` of the motors. See ``wait()``
+        for ``motors`` and ``mode``.
+        """
+        bit = Motor.STATE_FLAGS.get(s)
+
+        if bit is None:
+            return self.wait(lambda state: s in state, timeout, motors, mode)
+
+        return self.wait(lambda flags: (flags & bit) != 0, timeout, motors, mode, flags=True)
+
+    def wait_while(self, s, timeout=None, motors=None, mode=WAIT_ALL):
+        """
+        Blocks until ``s`` is not in the ``state`` of the motors. See
+        ``wait()`` for ``motors`` and ``mode``.
+        """
+        bit = Motor.STATE_FLAGS.get(s)
+
+        if bit is None:
+            return self.wait(lambda state: s not in state, timeout, motors, mode)
+
+        return self.wait(lambda flags: (flags & bit) == 0, timeout, motors, mode, flags=True)
+
+    def _expected_stop(self, seconds=None):
+        # The set stops when its last motor does. Without ``seconds``, the
+        # motors were started with run-to-rel-pos, so their distance is their
+        # position_sp.
+        expected = None
+
+        for motor in self.motors.values():
+            if seconds is None:
+                end = motor.predict_stop_time(distance=abs(motor._shadow.get('position_sp', 0)))
+            else:
+                end = motor.predict_stop_time(seconds=seconds)
+
+            if end is not None and (expected is None or end > expected):
+                expected = end
+
+        return expected
+
+    def _block(self, seconds=None):
+        expected = self._expected_stop(seconds)
         self.wait_until('running', timeout=WAIT_RUNNING_TIMEOUT)
-        self.wait_until_not_moving()
+        self.wait_until_not_moving(expected=expected)
+
+    def _handle(self, seconds=None):
+        return MoveHandle(self.motors.values(), self._expected_stop(seconds))
 
 
 # follow gyro angle classes
@@ -1874,9 +2510,16 @@ class MoveTank(MotorSet):
         self.left_motor = self.motors[left_motor_port]
         self.right_motor = self.motors[right_motor_port]
         self.max_speed = self.left_motor.max_speed
+        self._left_max_speed = self.max_speed
+        self._right_max_speed = self.right_motor.max_speed
         self._cs = None
         self._gyro = None
 
+        #: The :py:class:`ev3dev2.control.loop.ControlLoop` of the last
+        #: ``follow_line()``, ``follow_gyro_angle()`` or ``turn_degrees()``,
+        #: with its timing statistics
+        self.control_loop = None
+
     # color sensor used by follow_line()
     @property
     def cs(self):
@@ -1895,6 +2538,23 @@ class MoveTank(MotorSet):
     def gyro(self, gyro):
         self._gyro = gyro
 
+    def _follower_pid(self, kp, ki, kd, pid):
+        # Returns the controller of a follower and the function giving its
+        # time step. The kp/ki/kd gains of the followers have always been per
+        # pass through the loop, so they are kept that way, as is their first
+        # derivative term, computed from a last error of 0.
+        if pid is None:
+            controller = PID(kp, ki, kd)
+            controller.reset(last_error=0.0)
+            return controller, lambda: 1
+
+        pid.reset()
+        return pid, lambda: self.control_loop.last_period
+
+    def _run_control_loop(self, step, period):
+        self.control_loop = ControlLoop(step, period or 0)
+        self.control_loop.run()
+
     def _unpack_speeds_to_native_units(self, left_speed, right_speed):
         left_speed = self.left_motor._speed_native_units(left_speed, "left_speed")
         right_speed = self.right_motor._speed_native_units(right_speed, "right_speed")
@@ -1910,6 +2570,10 @@ class MoveTank(MotorSet):
         turn), the motor on the outside of the turn will rotate for the full
         ``degrees`` while the motor on the inside will have its requested
         distance calculated according to the expected turn.
+
+
+        With ``block=False``, returns a :class:`ev3dev2.motor.MoveHandle` of
+        the move.
         """
         (left_speed_native_units,
          right_speed_native_units) = self._unpack_speeds_to_native_units(left_speed, right_speed)
@@ -1943,6 +2607,8 @@ class MoveTank(MotorSet):
 
         if block:
             self._block()
+        else:
+            return self._handle()
 
     def on_for_rotations(self, left_speed, right_speed, rotations, brake=True, block=True):
         """
@@ -1953,13 +2619,21 @@ class MoveTank(MotorSet):
         turn), the motor on the outside of the turn will rotate for the full
         ``rotations`` while the motor on the inside will have its requested
         distance calculated according to the expected turn.
+
+
+        With ``block=False``, returns a :class:`ev3dev2.motor.MoveHandle` of
+        the move.
         """
-        MoveTank.on_for_degrees(self, left_speed, right_speed, rotations * 360, brake, block)
+        return MoveTank.on_for_degrees(self, left_speed, right_speed, rotations * 360, brake, block)
 
     def on_for_seconds(self, left_speed, right_speed, seconds, brake=True, block=True):
         """
         Rotate the motors at 'left_speed & right_speed' for 'seconds'. Speeds
         can be percentages or any SpeedValue implementation.
+
+
+        With ``block=False``, returns a :class:`ev3dev2.motor.MoveHandle` of
+        the move.
         """
 
         if seconds < 0:
@@ -1983,7 +2657,9 @@ class MoveTank(MotorSet):
         self.right_motor.run_timed()
 
         if block:
-            self._block()
+            self._block(seconds)
+        else:
+            return self._handle(seconds)
 
     def on(self, left_speed, right_speed):
         """
@@ -2001,6 +2677,50 @@ class MoveTank(MotorSet):
         self.left_motor.run_forever()
         self.right_motor.run_forever()
 
+    def set_speeds_native(self, left, right):
+        """
+        Run the motors forever at ``left`` and ``right`` tacho counts per
+        second. This is the fast path of :py:meth:`on` for control loops that
+        change the speeds at every iteration: the speeds are checked against
+        ``max_speed`` of each motor as plain numbers, without building
+        ``SpeedValue`` objects, and nothing is written to a motor that is
+        already running forever at the requested speed. A motor whose speed
+        changed gets its new ``speed_sp`` and ``run-forever`` again, which is
+        what makes a running motor apply it. So does a motor that is not
+        running anymore, e.g. because another program stopped it: its
+        ``state`` is read before it is left alone.
+
+        Raises :py:class:`SpeedInvalid` if a speed is above ``max_speed`` in
+        either direction; nothing is written then.
+
+        Call ``invalidate_shadow()`` on the motors if something else (e.g.
+        another program) may have changed their ``speed_sp``.
+        """
+        if left > self._left_max_speed or left < -self._left_max_speed:
+            raise SpeedInvalid("invalid native-units: {} max speed {}, {} was requested".format(
+                self.left_motor, self._left_max_speed, left))
+
+        if right > self._right_max_speed or right < -self._right_max_speed:
+            raise SpeedInvalid("invalid native-units: {} max speed {}, {} was requested".format(
+                self.right_motor, self._right_max_speed, right))
+
+        # Unrolled so that no tuple is built per call
+        motor = self.left_motor
+        shadow = motor._shadow
+
+        if shadow.get('speed_sp') != left or shadow.get('command') != Motor.COMMAND_RUN_FOREVER or \
+                not motor.state_flags & Motor.STATE_FLAG_RUNNING:
+            motor._speed_sp = motor.set_attr_int(motor._speed_sp, 'speed_sp', left)
+            motor.command = Motor.COMMAND_RUN_FOREVER
+
+        motor = self.right_motor
+        shadow = motor._shadow
+
+        if shadow.get('speed_sp') != right or shadow.get('command') != Motor.COMMAND_RUN_FOREVER or \
+                not motor.state_flags & Motor.STATE_FLAG_RUNNING:
+            motor._speed_sp = motor.set_attr_int(motor._speed_sp, 'speed_sp', right)
+            motor.command = Motor.COMMAND_RUN_FOREVER
+
     def follow_line(self,
                     kp,
                     ki,
@@ -2012,11 +2732,17 @@ class MoveTank(MotorSet):
                     off_line_count_max=20,
                     sleep_time=0.01,
                     follow_for=follow_for_forever,
+                    pid=None,
                     **kwargs):
         """
         PID line follower
 
-        ``kp``, ``ki``, and ``kd`` are the PID constants.
+        ``kp``, ``ki``, and ``kd`` are the PID constants. The integral and the
+            derivative are computed per pass through the loop.
+
+        ``pid`` is an optional :py:class:`ev3dev2.control.pid.PID` used instead
+            of ``kp``, ``ki``, and ``kd`` (pass None for these). It is updated
+            with the measured period of the loop, in seconds.
 
         ``speed`` is the desired speed of the midpoint of the robot
 
@@ -2033,8 +2759,9 @@ class MoveTank(MotorSet):
             reflected_light_intensity must be greater than ``white`` before we
             declare the line lost and raise an exception
 
-        ``sleep_time`` is how many seconds we sleep on each pass through
-            the loop.  This is to give the robot a chance to react
+        ``sleep_time`` is the period of the loop, in seconds: a pass through
+            the loop starts every ``sleep_time`` seconds, however long the
+            previous one took.  This is to give the robot a chance to react
             to the new motor settings. This should be something small such
             as 0.01 (10ms).
 
@@ -2075,27 +2802,24 @@ class MoveTank(MotorSet):
         if target_light_intensity is None:
             target_light_intensity = self._cs.reflected_light_intensity
 
-        integral = 0.0
-        last_error = 0.0
-        derivative = 0.0
         off_line_count = 0
         speed = speed_to_speedvalue(speed)
         speed_native_units = speed.to_native_units(self.left_motor)
+        controller, time_step = self._follower_pid(kp, ki, kd, pid)
+
+        def step():
+            nonlocal off_line_count
+
+            if not follow_for(self, **kwargs):
+                return False
 
-        while follow_for(self, **kwargs):
             reflected_light_intensity = self._cs.reflected_light_intensity
             error = target_light_intensity - reflected_light_intensity
-            integral = integral + error
-            derivative = error - last_error
-            last_error = error
-            turn_native_units = (kp * error) + (ki * integral) + (kd * derivative)
+            turn_native_units = controller.update(error, time_step())
 
             if not follow_left_edge:
                 turn_native_units *= -1
 
-            left_speed = SpeedNativeUnits(speed_native_units - turn_native_units)
-            right_speed = SpeedNativeUnits(speed_native_units + turn_native_units)
-
             # Have we lost the line?
             if reflected_light_intensity >= white:
                 off_line_count += 1
@@ -2106,16 +2830,15 @@ class MoveTank(MotorSet):
             else:
                 off_line_count = 0
 
-            if sleep_time:
-                time.sleep(sleep_time)
-
             try:
-                self.on(left_speed, right_speed)
+                self.set_speeds_native(int(round(speed_native_units - turn_native_units)),
+                                       int(round(speed_native_units + turn_native_units)))
             except SpeedInvalid as e:
                 log.exception(e)
                 self.stop()
                 raise LineFollowErrorTooFast("The robot is moving too fast to follow the line")
 
+        self._run_control_loop(step, sleep_time)
         self.stop()
 
     def follow_gyro_angle(self,
@@ -2126,18 +2849,25 @@ class MoveTank(MotorSet):
                           target_angle=0,
                           sleep_time=0.01,
                           follow_for=follow_for_forever,
+                          pid=None,
                           **kwargs):
         """
         PID gyro angle follower
 
-        ``kp``, ``ki``, and ``kd`` are the PID constants.
+        ``kp``, ``ki``, and ``kd`` are the PID constants. The integral and the
+            derivative are computed per pass through the loop.
+
+        ``pid`` is an optional :py:class:`ev3dev2.control.pid.PID` used instead
+            of ``kp``, ``ki``, and ``kd`` (pass None for these). It is updated
+            with the measured period of the loop, in seconds.
 
         ``speed`` is the desired speed of the midpoint of the robot
 
         ``target_angle`` is the angle we want to maintain
 
-        ``sleep_time`` is how many seconds we sleep on each pass through
-            the loop.  This is to give the robot a chance to react
+        ``sleep_time`` is the period of the loop, in seconds: a pass through
+            the loop starts every ``sleep_time`` seconds, however long the
+            previous one took.  This is to give the robot a chance to react
             to the new motor settings. This should be something small such
             as 0.01 (10ms).
 
@@ -2183,36 +2913,30 @@ class MoveTank(MotorSet):
             raise DeviceNotDefined(
                 "The 'gyro' variable must be defined with a GyroSensor. Example: tank.gyro = GyroSensor()")
 
-        integral = 0.0
-        last_error = 0.0
-        derivative = 0.0
         speed = speed_to_speedvalue(speed)
         speed_native_units = speed.to_native_units(self.left_motor)
+        controller, time_step = self._follower_pid(kp, ki, kd, pid)
+
+        def step():
+            if not follow_for(self, **kwargs):
+                return False
 
-        while follow_for(self, **kwargs):
             current_angle = self._gyro.angle
             error = current_angle - target_angle
-            integral = integral + error
-            derivative = error - last_error
-            last_error = error
-            turn_native_units = (kp * error) + (ki * integral) + (kd * derivative)
-
-            left_speed = SpeedNativeUnits(speed_native_units - turn_native_units)
-            right_speed = SpeedNativeUnits(speed_native_units + turn_native_units)
-
-            if sleep_time:
-                time.sleep(sleep_time)
+            turn_native_units = controller.update(error, time_step())
 
             try:
-                self.on(left_speed, right_speed)
+                self.set_speeds_native(int(round(speed_native_units - turn_native_units)),
+                                       int(round(speed_native_units + turn_native_units)))
             except SpeedInvalid as e:
                 log.exception(e)
                 self.stop()
                 raise FollowGyroAngleErrorTooFast("The robot is moving too fast to follow the angle")
 
+        self._run_control_loop(step, sleep_time)
         self.stop()
 
-    def turn_degrees(self, speed, target_angle, brake=True, error_margin=2, sleep_time=0.01):
+    def turn_degrees(self, speed, target_angle, brake=True, error_margin=2, sleep_time=0.01, pid=None, min_speed=None):
         """
         Use a GyroSensor to rotate in place for ``target_angle``
 
@@ -2224,8 +2948,22 @@ class MoveTank(MotorSet):
 
         ``error_margin`` is the +/- angle threshold to control how accurate the turn should be
 
-        ``sleep_time`` is how many seconds we sleep on each pass through
-            the loop.  This is to give the robot a chance to react
+        ``pid`` is an optional :py:class:`ev3dev2.control.pid.PID`. Without
+            it, the robot rotates at ``speed`` until it is within
+            ``error_margin`` of ``target_angle``. With it, the speed of the
+            wheels (in native units, limited to ``speed``) is the output of
+            the controller for the remaining angle, updated with the measured
+            period of the loop in seconds, so the robot slows down as it gets
+            close.
+
+        ``min_speed`` is the lowest speed of the wheels with a ``pid`` (a
+            percentage or any SpeedValue, a tenth of ``speed`` by default),
+            so that the robot does not stall short of ``error_margin`` when
+            the output of the controller gets small.
+
+        ``sleep_time`` is the period of the loop, in seconds: a pass through
+            the loop starts every ``sleep_time`` seconds, however long the
+            previous one took.  This is to give the robot a chance to react
             to the new motor settings. This should be something small such
             as 0.01 (10ms).
 
@@ -2263,29 +3001,43 @@ class MoveTank(MotorSet):
         speed = speed_to_speedvalue(speed)
         speed_native_units = speed.to_native_units(self.left_motor)
         target_angle = self._gyro.angle + target_angle
+        turn_speed = int(round(speed_native_units))
 
-        while True:
+        if pid is not None:
+            pid.reset()
+
+            if min_speed is None:
+                min_speed_native_units = speed_native_units / 10
+            else:
+                min_speed_native_units = speed_to_speedvalue(min_speed).to_native_units(self.left_motor)
+
+        def step():
             current_angle = self._gyro.angle
             delta = abs(target_angle - current_angle)
 
             if delta <= error_margin:
                 self.stop(brake=brake)
-                break
+                return False
+
+            if pid is not None:
+                turn = pid.update(target_angle - current_angle, self.control_loop.last_period)
+
+                if abs(turn) < min_speed_native_units:
+                    turn = min_speed_native_units if current_angle < target_angle else -min_speed_native_units
+
+                turn = int(round(max(-speed_native_units, min(speed_native_units, turn))))
 
             # we are left of our target, rotate clockwise
-            if current_angle < target_angle:
-                left_speed = SpeedNativeUnits(speed_native_units)
-                right_speed = SpeedNativeUnits(-1 * speed_native_units)
+            elif current_angle < target_angle:
+                turn = turn_speed
 
             # we are right of our target, rotate counter-clockwise
             else:
-                left_speed = SpeedNativeUnits(-1 * speed_native_units)
-                right_speed = SpeedNativeUnits(speed_native_units)
+                turn = -turn_speed
 
-            self.on(left_speed, right_speed)
+            self.set_speeds_native(turn, -turn)
 
-            if sleep_time:
-                time.sleep(sleep_time)
+        self._run_control_loop(step, sleep_time)
 
     def turn_right(self, speed, degrees, brake=True, error_margin=2, sleep_time=0.01):
         """
@@ -2326,8 +3078,8 @@ class MoveSteering(MoveTank):
         The distance each motor will travel follows the rules of :meth:`MoveTank.on_for_rotations`.
         """
         (left_speed, right_speed) = self.get_speed_steering(steering, speed)
-        MoveTank.on_for_rotations(self, SpeedNativeUnits(left_speed), SpeedNativeUnits(right_speed), rotations, brake,
-                                  block)
+        return MoveTank.on_for_rotations(self, SpeedNativeUnits(left_speed), SpeedNativeUnits(right_speed), rotations,
+                                         brake, block)
 
     def on_for_degrees(self, steering, speed, degrees, brake=True, block=True):
         """
@@ -2336,16 +3088,16 @@ class MoveSteering(MoveTank):
         The distance each motor will travel follows the rules of :meth:`MoveTank.on_for_degrees`.
         """
         (left_speed, right_speed) = self.get_speed_steering(steering, speed)
-        MoveTank.on_for_degrees(self, SpeedNativeUnits(left_speed), SpeedNativeUnits(right_speed), degrees, brake,
-                                block)
+        return MoveTank.on_for_degrees(self, SpeedNativeUnits(left_speed), SpeedNativeUnits(right_speed), degrees,
+                                       brake, block)
 
     def on_for_seconds(self, steering, speed, seconds, brake=True, block=True):
         """
         Rotate the motors according to the provided ``steering`` for ``seconds``.
         """
         (left_speed, right_speed) = self.get_speed_steering(steering, speed)
-        MoveTank.on_for_seconds(self, SpeedNativeUnits(left_speed), SpeedNativeUnits(right_speed), seconds, brake,
-                                block)
+        return MoveTank.on_for_seconds(self, SpeedNativeUnits(left_speed), SpeedNativeUnits(right_speed), seconds,
+                                       brake, block)
 
     def on(self, steering, speed):
         """
@@ -2405,7 +3157,8 @@ class MoveDifferential(MoveTank):
       for a specified distance
 
     Odometry can be use to enable driving to specific coordinates and
-    rotating to a specific angle.
+    rotating to a specific angle, or through a path of waypoints without
+    stopping at each of them.
 
     New arguments:
 
@@ -2463,6 +3216,9 @@ class MoveDifferential(MoveTank):
         # Use odometry to rotate in place to 90 degrees
         mdiff.turn_to_angle(SpeedRPM(40), 90)
 
+        # Use odometry to drive around a square without stopping at the corners
+        mdiff.follow_path(SpeedRPM(40), [(0, 300), (300, 300), (300, 0), (0, 0)])
+
         # Disable odometry
         mdiff.odometry_stop()
     """
@@ -2483,11 +3239,62 @@ class MoveDifferential(MoveTank):
 
         self.min_circle_radius_mm = self.wheel_distance_mm / 2
 
-        # odometry variables
-        self.x_pos_mm = 0.0  # robot X position in mm
-        self.y_pos_mm = 0.0  # robot Y position in mm
-        self.odometry_thread_run = False
-        self.theta = 0.0
+        #: The :py:class:`ev3dev2.odometry.Odometry` of the robot, started by
+        #: :py:meth:`odometry_start`
+        self.odometry = Odometry(self.left_motor, self.right_motor, self.wheel.circumference_mm,
+                                 self.wheel_distance_mm)
+
+    @property
+    def x_pos_mm(self):
+        """
+        The X position of the robot in mm, from :py:attr:`odometry`. Setting
+        it moves the tracked pose there.
+        """
+        return self.odometry.x_mm
+
+    @x_pos_mm.setter
+    def x_pos_mm(self, value):
+        self.odometry.set_pose(x_mm=value)
+
+    @property
+    def y_pos_mm(self):
+        """
+        The Y position of the robot in mm, from :py:attr:`odometry`. Setting
+        it moves the tracked pose there.
+        """
+        return self.odometry.y_mm
+
+    @y_pos_mm.setter
+    def y_pos_mm(self, value):
+        self.odometry.set_pose(y_mm=value)
+
+    @property
+    def theta(self):
+        """
+        The heading of the robot in radians, from :py:attr:`odometry`.
+        Setting it turns the tracked pose.
+        """
+        return self.odometry.theta
+
+    @theta.setter
+    def theta(self, value):
+        self.odometry.set_pose(theta=value)
+
+    @property
+    def odometry_thread_run(self):
+        """
+        True while the odometry runs. Setting it to False stops the odometry
+        thread (as :py:meth:`odometry_stop` does), setting it to True starts
+        it from the current pose.
+        """
+        return self.odometry.running
+
+    @odometry_thread_run.setter
+    def odometry_thread_run(self, value):
+        if value:
+            self.odometry.start()
+        else:
+            self.odometry.stop()
 
     def on_for_distance(self, speed, distance_mm, brake=True, block=True):
         """
@@ -2496,7 +3303,7 @@ class MoveDifferential(MoveTank):
         rotations = distance_mm / self.wheel.circumference_mm
         log.debug("%s: on_for_rotations distance_mm %s, rotations %s, speed %s" % (self, distance_mm, rotations, speed))
 
-        MoveTank.on_for_rotations(self, speed, speed, rotations, brake, block)
+        return MoveTank.on_for_rotations(self, speed, speed, rotations, brake, block)
 
     def _on_arc(self, speed, radius_mm, distance_mm, brake, block, arc_right):
         """
@@ -2547,19 +3354,19 @@ class MoveDifferential(MoveTank):
         log.debug("%s: outer_wheel_rotations %s, outer_wheel_degrees %s" %
                   (self, outer_wheel_rotations, outer_wheel_degrees))
 
-        MoveTank.on_for_degrees(self, left_speed, right_speed, outer_wheel_degrees, brake, block)
+        return MoveTank.on_for_degrees(self, left_speed, right_speed, outer_wheel_degrees, brake, block)
 
     def on_arc_right(self, speed, radius_mm, distance_mm, brake=True, block=True):
         """
         Drive clockwise in a circle with 'radius_mm' for 'distance_mm'
         """
-        self._on_arc(speed, radius_mm, distance_mm, brake, block, True)
+        return self._on_arc(speed, radius_mm, distance_mm, brake, block, True)
 
     def on_arc_left(self, speed, radius_mm, distance_mm, brake=True, block=True):
         """
         Drive counter-clockwise in a circle with 'radius_mm' for 'distance_mm'
         """
-        self._on_arc(speed, radius_mm, distance_mm, brake, block, False)
+        return self._on_arc(speed, radius_mm, distance_mm, brake, block, False)
 
     def turn_degrees(self, speed, degrees, brake=True, block=True, error_margin=2, use_gyro=False):
         """
@@ -2568,6 +3375,11 @@ class MoveDifferential(MoveTank):
         be used to improve the accuracy of our turn:
         - ``use_gyro``, ``brake`` and ``block`` are all True
         - A GyroSensor has been defined via ``self.gyro = GyroSensor()``
+
+        If :py:attr:`odometry` fuses a gyro (see :py:meth:`odometry_start`)
+        and ``block`` is True, the robot turns until its fused heading is
+        within ``error_margin`` degrees of the target instead, in a single
+        pass.
         """
         def final_angle(init_angle, degrees):
             result = init_angle - degrees
@@ -2583,6 +3395,10 @@ class MoveDifferential(MoveTank):
 
             return result
 
+        if block and self.odometry.gyro is not None:
+            self._turn_to_theta(speed, self.odometry.theta - math.radians(degrees), brake, error_margin)
+            return None
+
         # use the gyro to check that we turned the correct amount?
         use_gyro = bool(use_gyro and block and brake)
         if use_gyro and not self._gyro:
@@ -2607,11 +3423,11 @@ class MoveDifferential(MoveTank):
 
         # If degrees is positive rotate clockwise
         if degrees > 0:
-            MoveTank.on_for_rotations(self, speed, speed * -1, rotations, brake, block)
+            handle = MoveTank.on_for_rotations(self, speed, speed * -1, rotations, brake, block)
 
         # If degrees is negative rotate counter-clockwise
         else:
-            MoveTank.on_for_rotations(self, speed * -1, speed, rotations, brake, block)
+            handle = MoveTank.on_for_rotations(self, speed * -1, speed, rotations, brake, block)
 
         if use_gyro:
             angle_current_degrees = self._gyro.circle_angle()
@@ -2640,17 +3456,49 @@ class MoveDifferential(MoveTank):
             if abs(degrees_error) > error_margin:
                 self.turn_degrees(speed, degrees_error, brake, block, error_margin, use_gyro)
 
+        return handle
+
+    def _turn_to_theta(self, speed, theta, brake, error_margin, sleep_time=0.01):
+        # Turns in place until the heading of the odometry is within
+        # error_margin degrees of theta (radians). The odometry is updated
+        # here if its thread is not running.
+        odometry = self.odometry
+        speed_native_units = abs(speed_to_speedvalue(speed).to_native_units(self.left_motor))
+        margin = math.radians(error_margin)
+
+        def step():
+            if not odometry.running:
+                odometry.update()
+
+            error = theta - odometry.theta
+            error = math.atan2(math.sin(error), math.cos(error))
+
+            if abs(error) <= margin:
+                self.stop(brake=brake)
+                return False
+
+            # Slow down over the last 30 degrees, so as not to overshoot
+            turn = int(round(speed_native_units * max(0.1, min(1.0, abs(error) / math.radians(30)))))
+
+            # we are right of our target, rotate counter-clockwise
+            if error > 0:
+                self.set_speeds_native(-turn, turn)
+            else:
+                self.set_speeds_native(turn, -turn)
+
+        self._run_control_loop(step, sleep_time)
+
     def turn_right(self, speed, degrees, brake=True, block=True, error_margin=2, use_gyro=False):
         """
         Rotate clockwise ``degrees`` in place
         """
-        self.turn_degrees(speed, abs(degrees), brake, block, error_margin, use_gyro)
+        return self.turn_degrees(speed, abs(degrees), brake, block, error_margin, use_gyro)
 
     def turn_left(self, speed, degrees, brake=True, block=True, error_margin=2, use_gyro=False):
         """
         Rotate counter-clockwise ``degrees`` in place
         """
-        self.turn_degrees(speed, abs(degrees) * -1, brake, block, error_margin, use_gyro)
+        return self.turn_degrees(speed, abs(degrees) * -1, brake, block, error_margin, use_gyro)
 
     def turn_to_angle(self, speed, angle_target_degrees, brake=True, block=True, error_margin=2, use_gyro=False):
         """
@@ -2695,81 +3543,39 @@ class MoveDifferential(MoveTank):
     def odometry_coordinates_log(self):
         log.debug("%s: odometry angle %s at (%d, %d)" % (self, math.degrees(self.theta), self.x_pos_mm, self.y_pos_mm))
 
-    def odometry_start(self, theta_degrees_start=90.0, x_pos_start=0.0, y_pos_start=0.0, sleep_time=0.005):  # 5ms
-        """
-        Ported from:
-        http://seattlerobotics.org/encoder/200610/Article3/IMU%20Odometry,%20by%20David%20Anderson.htm
-
-        A thread is started that will run until the user calls odometry_stop()
-        which will set odometry_thread_run to False
+    def odometry_start(self,
+                       theta_degrees_start=90.0,
+                       x_pos_start=0.0,
+                       y_pos_start=0.0,
+                       sleep_time=0.005,  # 5ms
+                       use_gyro=False):
         """
-        def _odometry_monitor():
-            left_previous = 0
-            right_previous = 0
-            self.theta = math.radians(theta_degrees_start)  # robot heading
-            self.x_pos_mm = x_pos_start  # robot X position in mm
-            self.y_pos_mm = y_pos_start  # robot Y position in mm
-            TWO_PI = 2 * math.pi
-            self.odometry_thread_run = True
-
-            while self.odometry_thread_run:
-
-                # sample the left and right encoder counts as close together
-                # in time as possible
-                left_current = self.left_motor.position
-                right_current = self.right_motor.position
-
-                # determine how many ticks since our last sampling
-                left_ticks = left_current - left_previous
-                right_ticks = right_current - right_previous
-
-                # Have we moved?
-                if not left_ticks and not right_ticks:
-                    if sleep_time:
-                        time.sleep(sleep_time)
-                    continue
-
-                # update _previous for next time
-                left_previous = left_current
-                right_previous = right_current
-
-                # rotations = distance_mm/self.wheel.circumference_mm
-                left_rotations = float(left_ticks / self.left_motor.count_per_rot)
-                right_rotations = float(right_ticks / self.right_motor.count_per_rot)
-
-                # convert longs to floats and ticks to mm
-                left_mm = float(left_rotations * self.wheel.circumference_mm)
-                right_mm = float(right_rotations * self.wheel.circumference_mm)
-
-                # calculate distance we have traveled since last sampling
-                mm = (left_mm + right_mm) / 2.0
-
-                # accumulate total rotation around our center
-                self.theta += (right_mm - left_mm) / self.wheel_distance_mm
-
-                # and clip the rotation to plus or minus 360 degrees
-                self.theta -= float(int(self.theta / TWO_PI) * TWO_PI)
+        Starts tracking the position of the robot from the given starting
+        pose: a thread samples the wheel positions every ``sleep_time``
+        seconds until the user calls odometry_stop(). See
+        :py:class:`ev3dev2.odometry.Odometry`.
 
-                # now calculate and accumulate our position in mm
-                self.x_pos_mm += mm * math.cos(self.theta)
-                self.y_pos_mm += mm * math.sin(self.theta)
+        If ``use_gyro`` is True, the heading is fused with the gyro defined
+        via ``self.gyro = GyroSensor()``, and turn_degrees(), turn_to_angle()
+        and on_to_coordinates() turn to it in a single pass.
 
-                if sleep_time:
-                    time.sleep(sleep_time)
-
-        _thread.start_new_thread(_odometry_monitor, ())
+        Based on:
+        http://seattlerobotics.org/encoder/200610/Article3/IMU%20Odometry,%20by%20David%20Anderson.htm
+        """
+        if use_gyro and not self._gyro:
+            raise DeviceNotDefined(
+                "The 'gyro' variable must be defined with a GyroSensor. Example: tank.gyro = GyroSensor()")
 
-        # Block until the thread has started doing work
-        while not self.odometry_thread_run:
-            pass
+        self.odometry.stop()
+        self.odometry.gyro = self._gyro if use_gyro else None
+        self.odometry.reset(x_pos_start, y_pos_start, math.radians(theta_degrees_start))
+        self.odometry.start(sleep_time or 0)
 
     def odometry_stop(self):
         """
-        Signal the odometry thread to exit
+        Stops the odometry thread, and waits for it to end
         """
-
-        if self.odometry_thread_run:
-            self.odometry_thread_run = False
+        self.odometry.stop()
 
     def on_to_coordinates(self, speed, x_target_mm, y_target_mm, brake=True, block=True):
         """
@@ -2790,7 +3596,139 @@ class MoveDifferential(MoveTank):
 
         # drive in a straight line to the target coordinates
         distance_mm = math.sqrt(pow(self.x_pos_mm - x_target_mm, 2) + pow(self.y_pos_mm - y_target_mm, 2))
-        self.on_for_distance(speed, distance_mm, brake, block)
+        return self.on_for_distance(speed, distance_mm, brake, block)
+
+    def plan_route(self,
+                   poses,
+                   speed,
+                   acceleration_mm=400,
+                   radius_mm=None,
+                   period=0.01,
+                   position_gain=2.0,
+                   brake=True):
+        """
+        Plan a route through ``poses``, a list of ``(x_mm, y_mm, heading_degrees)``
+        poses starting with the current one, made of arcs and straight lines
+        (see :py:mod:`ev3dev2.planner`). All the wheel moves are computed
+        here; call ``run()`` on the returned :py:class:`ev3dev2.planner.RoutePlan`
+        to drive it, as many times as needed.
+
+        Each wheel speed is corrected by ``position_gain`` times the position
+        error of the wheel (in counts per second per count), so the wheels
+        catch up when they slip or lag; 0 drives the wheel profiles open loop.
+        """
+        return RoutePlan(self, poses, speed, acceleration_mm, radius_mm, period, position_gain, brake)
+
+    def follow_path(self, speed, waypoints, lookahead_mm=100, tolerance_mm=10, brake=True, sleep_time=0.01):
+        """
+        Drive through ``waypoints``, a list of ``(x_mm, y_mm)`` coordinates
+        (e.g. the points of a polyline), without stopping at any of them.
+
+        The path starts at the current position of the robot. Every
+        ``sleep_time`` seconds, a pure pursuit controller picks the point of
+        the path ``lookahead_mm`` ahead of the robot and steers along the arc
+        reaching it, at ``speed`` (measured at the middle of the axle). A
+        longer look-ahead drives more smoothly but cuts corners more. The
+        robot slows down over the last ``lookahead_mm`` and stops within
+        ``tolerance_mm`` of the last waypoint.
+
+        The position comes from :py:attr:`odometry`, which is updated here if
+        its thread is not running (see :py:meth:`odometry_start`).
+        """
+        waypoints = [(float(x), float(y)) for (x, y) in waypoints]
+
+        if not waypoints:
+            raise ValueError("{}: follow_path needs at least one waypoint".format(self))
+
+        odometry = self.odometry
+
+        if not odometry.running:
+            odometry.update()
+
+        points = [(odometry.x_mm, odometry.y_mm)] + waypoints
+
+        # The length of the path up to each point
+        lengths = [0.0]
+
+        for i in range(1, len(points)):
+            lengths.append(lengths[-1] + math.hypot(points[i][0] - points[i - 1][0], points[i][1] - points[i - 1][1]))
+
+        total_mm = lengths[-1]
+        speed_native_units = speed_to_speedvalue(speed).to_native_units(self.left_motor)
+        half_width = self.wheel_distance_mm / 2
+        limit = min(self._left_max_speed, self._right_max_speed)
+        segment = 0
+
+        def point_at(s):
+            # The point of the path s mm from its start
+            i = segment
+
+            while i < len(points) - 2 and lengths[i + 1] < s:
+                i += 1
+
+            length = lengths[i + 1] - lengths[i]
+            k = min(1.0, max(0.0, (s - lengths[i]) / length)) if length else 1.0
+            return (points[i][0] + k * (points[i + 1][0] - points[i][0]),
+                    points[i][1] + k * (points[i + 1][1] - points[i][1]))
+
+        def step():
+            nonlocal segment
+
+            if not odometry.running:
+                odometry.update()
+
+            x = odometry.x_mm
+            y = odometry.y_mm
+
+            # How far along the path the robot is: its projection on the
+            # current segment, or on the next one once it is closer to it
+            while True:
+                i = segment
+                (ax, ay) = points[i]
+                (bx, by) = points[i + 1]
+                length = lengths[i + 1] - lengths[i]
+                k = ((x - ax) * (bx - ax) + (y - ay) * (by - ay)) / (length * length) if length else 1.0
+
+                if k < 1.0 or i >= len(points) - 2:
+                    break
+
+                segment = i + 1
+
+            progress = lengths[i] + max(0.0, min(1.0, k)) * length
+            remaining = total_mm - progress
+            (gx, gy) = points[-1]
+
+            if remaining <= tolerance_mm or math.hypot(gx - x, gy - y) <= tolerance_mm:
+                self.stop(brake=brake)
+                return False
+
+            # The look-ahead point, in the frame of the robot (forward, left)
+            (tx, ty) = point_at(progress + lookahead_mm)
+            cos = math.cos(odometry.theta)
+            sin = math.sin(odometry.theta)
+            forward = (tx - x) * cos + (ty - y) * sin
+            left = (ty - y) * cos - (tx - x) * sin
+            distance = forward * forward + left * left
+
+            # Curvature of the arc through the look-ahead point, at most
+            # that of a turn around the inner wheel
+            curvature = 2 * left / distance if distance else 0.0
+            curvature = max(-1 / half_width, min(1 / half_width, curvature))
+
+            # Slow down over the last lookahead_mm, to stop in tolerance_mm
+            v = speed_native_units * max(0.2, min(1.0, remaining / lookahead_mm))
+            left_speed = v * (1 - curvature * half_width)
+            right_speed = v * (1 + curvature * half_width)
+
+            fastest = max(abs(left_speed), abs(right_speed))
+
+            if fastest > limit:
+                left_speed *= limit / fastest
+                right_speed *= limit / fastest
+
+            self.set_speeds_native(int(round(left_speed)), int(round(right_speed)))
+
+        self._run_control_loop(step, sleep_time)
 
 
 class MoveJoystick(MoveTank):
@@ -0,0 +1,350 @@
+"""
+Dead reckoning of a differential drive robot from its wheel encoders.
+
+:py:class:`Odometry` samples the positions of the two wheel motors at a
+fixed rate and integrates them into the pose of the robot: ``x_mm``, ``y_mm``
+and ``theta`` (radians, counter-clockwise). Each step moves the robot along
+the arc of a circle, the exact path of a robot turning at a constant rate,
+so the pose does not drift on curves as a straight-line step does at low
+sampling rates.
+
+The timestamped poses are kept in a ring buffer allocated up front, and
+:py:meth:`Odometry.pose_at` interpolates them, to find where the robot was
+when a sensor reading was taken::
+
+    from ev3dev2.motor import OUTPUT_A, OUTPUT_B, MoveDifferential
+    from ev3dev2.wheel import EV3Tire
+
+    mdiff = MoveDifferential(OUTPUT_A, OUTPUT_B, EV3Tire, 16 * 8)
+    mdiff.odometry_start()
+
+    t = get_clock().now()
+    distance = ultrasonic.distance_centimeters
+    (x, y, theta) = mdiff.odometry.pose_at(t)
+
+:py:class:`ev3dev2.motor.MoveDifferential` creates one as its ``odometry``
+attribute.
+
+Wheels slip, on carpet and in fast turns, and every slip is an error of the
+heading which then bends the whole path. Given a gyro sensor, the odometry
+takes the turns from the gyro instead, and only slowly pulls the heading
+toward the one of the encoders (a complementary filter), which keeps the
+drift of the gyro in check.
+"""
+
+import _thread
+import math
+from array import array
+from ev3dev2.clock import get_clock
+from ev3dev2.control.loop import ControlLoop
+
+_TWO_PI = 2 * math.pi
+
+
+def _clip(theta):
+    # The range of MoveDifferential.theta: the turns are removed, keeping the
+    # sign, so it stays between -2 pi and 2 pi
+    return theta - float(int(theta / _TWO_PI) * _TWO_PI)
+
+
+class Odometry(object):
+    """
+    Tracks the pose of a robot driven by ``left_motor`` and ``right_motor``,
+    whose wheels have a circumference of ``wheel_circumference_mm`` and are
+    ``wheel_distance_mm`` apart.
+
+    Either call :py:meth:`update` from your own loop, or :py:meth:`start` a
+    thread sampling every ``period`` seconds. The last ``capacity`` poses are
+    kept for :py:meth:`pose_at`.
+
+    If ``gyro`` (a :py:class:`ev3dev2.sensor.lego.GyroSensor`) is given, the
+    heading turns as the gyro angle does, and converges to the heading of the
+    encoders with a time constant of ``gyro_time_constant`` seconds (None to
+    follow the gyro only). The gyro is read with ``angle_and_rate``, do not
+    switch it to another mode while the odometry uses it.
+    """
+
+    def __init__(self,
+                 left_motor,
+                 right_motor,
+                 wheel_circumference_mm,
+                 wheel_distance_mm,
+                 capacity=1000,
+                 clock=None,
+                 gyro=None,
+                 gyro_time_constant=10.0):
+        self.left_motor = left_motor
+        self.right_motor = right_motor
+        self.wheel_circumference_mm = wheel_circumference_mm
+        self.wheel_distance_mm = wheel_distance_mm
+        self.capacity = capacity
+        self.clock = clock
+        self.gyro = gyro
+        self.gyro_time_constant = gyro_time_constant
+
+        #: The :py:class:`ev3dev2.control.loop.ControlLoop` of the sampling
+        #: thread, with its timing statistics
+        self.control_loop = None
+
+        #: True while the sampling thread runs
+        self.running = False
+
+        self._times = array('d', [0.0] * capacity)
+        self._xs = array('d', [0.0] * capacity)
+        self._ys = array('d', [0.0] * capacity)
+        self._thetas = array('d', [0.0] * capacity)
+        self._latencies = array('d', [0.0] * capacity)
+        self._error = None
+        self._thread_lock = _thread.allocate_lock()
+        self._started_lock = _thread.allocate_lock()
+
+        # Taken by update() while it moves the pose, so that the pose is not
+        # changed halfway by another thread
+        self._pose_lock = _thread.allocate_lock()
+        self.reset()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def reset(self, x_mm=0.0, y_mm=0.0, theta=0.0):
+        """
+        Sets the pose of the robot (``theta`` in radians) and forgets the
+        recorded poses. The next :py:meth:`update` measures the moves from
+        there.
+        """
+        with self._pose_lock:
+            self.x_mm = x_mm
+            self.y_mm = y_mm
+            self.theta = _clip(theta)
+
+            #: The total number of samples taken, including the overwritten ones
+            self.count = 0
+
+            self._theta = theta
+            self._encoder_theta = theta
+            self._gyro_angle = None
+            self._time = None
+            self._index = 0
+            self._left = None
+            self._right = None
+            self._latency_total = 0.0
+            self._latency_max = 0.0
+
+    def set_pose(self, x_mm=None, y_mm=None, theta=None):
+        """
+        Moves the pose of the robot to ``x_mm``, ``y_mm`` and ``theta``
+        (radians), leaving alone those that are None. Unlike :py:meth:`reset`
+        the recorded poses are kept, and the sampling thread can keep running:
+        the next :py:meth:`update` moves the robot from the new pose.
+        """
+        with self._pose_lock:
+            if x_mm is not None:
+                self.x_mm = x_mm
+
+            if y_mm is not None:
+                self.y_mm = y_mm
+
+            if theta is not None:
+                # The heading of the encoders turns as well, so that the gyro
+                # filter does not pull the heading back
+                self._encoder_theta += theta - self._theta
+                self._theta = theta
+                self.theta = _clip(theta)
+
+    def _mm(self, motor, ticks):
+        return ticks / motor.count_per_rot * self.wheel_circumference_mm
+
+    def update(self):
+        """
+        Samples the wheel positions once, moves the pose accordingly and
+        records it. Returns the time of the sample.
+        """
+        clock = self.clock if self.clock is not None else get_clock()
+
+        # The sample is dated halfway between the two reads
+        start = clock.now()
+        left = self.left_motor.position
+        right = self.right_motor.position
+        gyro_angle = self.gyro.angle_and_rate[0] if self.gyro is not None else None
+        read = clock.now()
+        t = (start + read) / 2
+
+        with self._pose_lock:
+            if self._left is not None:
+                left_mm = self._mm(self.left_motor, left - self._left)
+                right_mm = self._mm(self.right_motor, right - self._right)
+                distance = (left_mm + right_mm) / 2
+                turn = (right_mm - left_mm) / self.wheel_distance_mm
+                theta = self._theta
+                self._encoder_theta += turn
+
+                if gyro_angle is not None and self._gyro_angle is not None:
+                    # The gyro angle grows clockwise
+                    theta_gyro = theta - math.radians(gyro_angle - self._gyro_angle)
+
+                    if self.gyro_time_constant is None:
+                        turn = theta_gyro - theta
+                    else:
+                        dt = t - self._time
+                        k = dt / (self.gyro_time_constant + dt)
+                        turn = (1 - k) * theta_gyro + k * self._encoder_theta - theta
+
+                if abs(turn) < 1e-9:
+                    self.x_mm += distance * math.cos(theta)
+                    self.y_mm += distance * math.sin(theta)
+                else:
+                    # Along the arc of radius distance / turn
+                    radius = distance / turn
+                    self.x_mm += radius * (math.sin(theta + turn) - math.sin(theta))
+                    self.y_mm -= radius * (math.cos(theta + turn) - math.cos(theta))
+
+                self._theta = theta + turn
+                self.theta = _clip(self._theta)
+
+            self._left = left
+            self._right = right
+            self._gyro_angle = gyro_angle
+            self._time = t
+
+            i = self._index
+            self._times[i] = t
+            self._xs[i] = self.x_mm
+            self._ys[i] = self.y_mm
+            self._thetas[i] = self._theta
+
+            latency = clock.now() - start
+            self._latencies[i] = latency
+            self._latency_total += latency
+
+            if latency > self._latency_max:
+                self._latency_max = latency
+
+            self._index = (i + 1) % self.capacity
+            self.count += 1
+
+        return t
+
+    def _at(self, n):
+        # The index in the buffers of the n-th oldest recorded pose
+        if self.count <= self.capacity:
+            return n
+
+        return (self._index + n) % self.capacity
+
+    def pose_at(self, t):
+        """
+        Returns the pose ``(x_mm, y_mm, theta)`` of the robot at time ``t``
+        (of the library clock, see :py:mod:`ev3dev2.clock`), interpolated
+        between the recorded poses. After the last sample, returns the last
+        pose; before the oldest recorded one (or if there is none), None.
+        """
+        size = len(self)
+
+        if not size or t < self._times[self._at(0)]:
+            return None
+
+        last = self._at(size - 1)
+
+        if t >= self._times[last]:
+            return (self._xs[last], self._ys[last], _clip(self._thetas[last]))
+
+        low = 0
+        high = size - 1
+
+        while high - low > 1:
+            middle = (low + high) // 2
+
+            if self._times[self._at(middle)] <= t:
+                low = middle
+            else:
+                high = middle
+
+        a = self._at(low)
+        b = self._at(high)
+        k = (t - self._times[a]) / (self._times[b] - self._times[a])
+
+        return (self._xs[a] + k * (self._xs[b] - self._xs[a]), self._ys[a] + k * (self._ys[b] - self._ys[a]),
+                _clip(self._thetas[a] + k * (self._thetas[b] - self._thetas[a])))
+
+    def poses(self):
+        """
+        Returns the recorded poses as a list of ``(time, x_mm, y_mm, theta)``
+        tuples, oldest first.
+        """
+        return [(self._times[i], self._xs[i], self._ys[i], _clip(self._thetas[i]))
+                for i in [self._at(n) for n in range(len(self))]]
+
+    @property
+    def stats(self):
+        """
+        The number of ``samples`` taken, and the ``mean`` and ``max`` time (in
+        seconds) a sample took, as a dictionary. ``last`` is the time the last
+        sample took.
+        """
+        count = self.count
+
+        return {
+            'samples': count,
+            'latency': {
+                'last': self._latencies[(self._index - 1) % self.capacity] if count else None,
+                'mean': self._latency_total / count if count else None,
+                'max': self._latency_max,
+            },
+        }
+
+    def _run(self, period):
+        loop = ControlLoop(period=period, clock=self.clock)
+        self.control_loop = loop
+
+        started = False
+
+        try:
+            self.update()
+            started = True
+            self._started_lock.release()
+
+            while self.running:
+                loop.wait_next()
+                self.update()
+        except Exception as e:
+            self._error = e
+        finally:
+            if not started:
+                self._started_lock.release()
+
+            self.running = False
+            loop.close()
+            self._thread_lock.release()
+
+    def start(self, period=0.005):
+        """
+        Starts sampling every ``period`` seconds in a thread, and returns once
+        the first sample is recorded.
+        """
+        if self.running:
+            return
+
+        self.running = True
+        self._error = None
+        self._thread_lock.acquire()
+        self._started_lock.acquire()
+        _thread.start_new_thread(self._run, (period, ))
+
+        with self._started_lock:
+            pass
+
+    def stop(self):
+        """
+        Stops the sampling thread and waits for it to end. An exception
+        raised while sampling (e.g. because a motor was unplugged) stops the
+        thread too, and is raised here.
+        """
+        self.running = False
+
+        with self._thread_lock:
+            pass
+
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise error
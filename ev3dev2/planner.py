@@ -0,0 +1,296 @@
+"""
+Routes of a differential drive robot, compiled ahead of time into wheel moves.
+
+A route is a list of poses ``(x_mm, y_mm, heading_degrees)``, with the
+heading counter-clockwise from the x axis as in
+:py:meth:`ev3dev2.motor.MoveDifferential.odometry_start`. Between two poses,
+:py:func:`dubins` finds the shortest path made of arcs of a given radius and
+straight lines (a Dubins path), so the robot reaches every pose facing the
+right way without turning in place.
+
+:py:class:`RoutePlan` does all the geometry once: it joins the paths into
+one move with a single acceleration and deceleration, and samples the
+position of each wheel along it into a
+:py:class:`ev3dev2.control.profile.ProfileExecutor`. Running the plan then
+only streams the precomputed setpoints, segment after segment without
+stopping, and the same plan can be run again and again::
+
+    from ev3dev2.motor import OUTPUT_A, OUTPUT_B, MoveDifferential, SpeedRPM
+    from ev3dev2.wheel import EV3Tire
+
+    mdiff = MoveDifferential(OUTPUT_A, OUTPUT_B, EV3Tire, 16 * 8)
+    lap = mdiff.plan_route([(0, 0, 90), (400, 400, 0), (800, 0, -90), (0, 0, 90)], SpeedRPM(60))
+
+    for i in range(3):
+        lap.run()
+"""
+
+import math
+from ev3dev2.control.profile import ProfileExecutor, TrapezoidalProfile
+
+#: Segment kinds: an arc turning left (counter-clockwise), a straight line,
+#: and an arc turning right
+LEFT = 'L'
+STRAIGHT = 'S'
+RIGHT = 'R'
+
+_TWO_PI = 2 * math.pi
+
+
+def _mod(angle):
+    return angle - _TWO_PI * math.floor(angle / _TWO_PI)
+
+
+def _lsl(d, sa, sb, ca, cb, a, b):
+    p2 = 2 + d * d - 2 * math.cos(a - b) + 2 * d * (sa - sb)
+
+    if p2 < 0:
+        return None
+
+    tmp = math.atan2(cb - ca, d + sa - sb)
+    return ((LEFT, STRAIGHT, LEFT), (_mod(-a + tmp), math.sqrt(p2), _mod(b - tmp)))
+
+
+def _rsr(d, sa, sb, ca, cb, a, b):
+    p2 = 2 + d * d - 2 * math.cos(a - b) + 2 * d * (sb - sa)
+
+    if p2 < 0:
+        return None
+
+    tmp = math.atan2(ca - cb, d - sa + sb)
+    return ((RIGHT, STRAIGHT, RIGHT), (_mod(a - tmp), math.sqrt(p2), _mod(-b + tmp)))
+
+
+def _lsr(d, sa, sb, ca, cb, a, b):
+    p2 = -2 + d * d + 2 * math.cos(a - b) + 2 * d * (sa + sb)
+
+    if p2 < 0:
+        return None
+
+    p = math.sqrt(p2)
+    tmp = math.atan2(-ca - cb, d + sa + sb) - math.atan2(-2, p)
+    return ((LEFT, STRAIGHT, RIGHT), (_mod(-a + tmp), p, _mod(-b + tmp)))
+
+
+def _rsl(d, sa, sb, ca, cb, a, b):
+    p2 = -2 + d * d + 2 * math.cos(a - b) - 2 * d * (sa + sb)
+
+    if p2 < 0:
+        return None
+
+    p = math.sqrt(p2)
+    tmp = math.atan2(ca + cb, d - sa - sb) - math.atan2(2, p)
+    return ((RIGHT, STRAIGHT, LEFT), (_mod(a - tmp), p, _mod(b - tmp)))
+
+
+def _rlr(d, sa, sb, ca, cb, a, b):
+    tmp = (6 - d * d + 2 * math.cos(a - b) + 2 * d * (sa - sb)) / 8
+
+    if abs(tmp) > 1:
+        return None
+
+    p = _mod(_TWO_PI - math.acos(tmp))
+    t = _mod(a - math.atan2(ca - cb, d - sa + sb) + p / 2)
+    return ((RIGHT, LEFT, RIGHT), (t, p, _mod(a - b - t + p)))
+
+
+def _lrl(d, sa, sb, ca, cb, a, b):
+    tmp = (6 - d * d + 2 * math.cos(a - b) + 2 * d * (sb - sa)) / 8
+
+    if abs(tmp) > 1:
+        return None
+
+    p = _mod(_TWO_PI - math.acos(tmp))
+    t = _mod(-a - math.atan2(ca - cb, d + sa - sb) + p / 2)
+    return ((LEFT, RIGHT, LEFT), (t, p, _mod(b - a - t + p)))
+
+
+_WORDS = (_lsl, _rsr, _lsr, _rsl, _rlr, _lrl)
+
+
+def dubins(start, end, radius_mm):
+    """
+    Returns the shortest path from the pose ``start`` to the pose ``end``
+    (both ``(x_mm, y_mm, heading_degrees)``) made of arcs of ``radius_mm``
+    and straight lines, as a list of ``(kind, length_mm)`` segments, where
+    ``kind`` is :py:data:`LEFT`, :py:data:`STRAIGHT` or :py:data:`RIGHT` and
+    ``length_mm`` the distance covered by the middle of the axle.
+    """
+    (x0, y0, heading0) = start
+    (x1, y1, heading1) = end
+    dx = x1 - x0
+    dy = y1 - y0
+
+    # In units of radius_mm, along the line from start to end
+    d = math.hypot(dx, dy) / radius_mm
+    theta = _mod(math.atan2(dy, dx)) if d > 0 else 0.0
+    a = _mod(math.radians(heading0) - theta)
+    b = _mod(math.radians(heading1) - theta)
+    (sa, sb, ca, cb) = (math.sin(a), math.sin(b), math.cos(a), math.cos(b))
+
+    best = None
+
+    for word in _WORDS:
+        path = word(d, sa, sb, ca, cb, a, b)
+
+        if path is not None and (best is None or sum(path[1]) < sum(best[1])):
+            best = path
+
+    return [(kind, length * radius_mm) for (kind, length) in zip(*best) if length * radius_mm > 1e-6]
+
+
+def advance(pose, segments, radius_mm):
+    """
+    Returns the pose reached from ``pose`` by following ``segments`` (as
+    returned by :py:func:`dubins`) with arcs of ``radius_mm``.
+    """
+    (x, y, heading) = pose
+    theta = math.radians(heading)
+
+    for (kind, length) in segments:
+        if kind == STRAIGHT:
+            x += length * math.cos(theta)
+            y += length * math.sin(theta)
+        else:
+            turn = length / radius_mm if kind == LEFT else -length / radius_mm
+            x += radius_mm * (math.sin(theta + turn) - math.sin(theta)) * (1 if kind == LEFT else -1)
+            y -= radius_mm * (math.cos(theta + turn) - math.cos(theta)) * (1 if kind == LEFT else -1)
+            theta += turn
+
+    return (x, y, math.degrees(theta))
+
+
+def plan_segments(poses, radius_mm):
+    """
+    Returns the segments of the shortest route through ``poses``, the
+    consecutive segments of the same kind merged together.
+    """
+    segments = []
+
+    for i in range(1, len(poses)):
+        for (kind, length) in dubins(poses[i - 1], poses[i], radius_mm):
+            if segments and segments[-1][0] == kind:
+                segments[-1] = (kind, segments[-1][1] + length)
+            else:
+                segments.append((kind, length))
+
+    return segments
+
+
+class _WheelProfile(object):
+    # The move of one wheel (in degrees) along a route, from the move of the
+    # middle of the axle (in mm): on each segment the wheel covers
+    # ``factors[i]`` degrees per mm of the route.
+
+    def __init__(self, route, bounds, factors):
+        self.route = route
+        self.bounds = bounds
+        self.factors = factors
+        self.duration = route.duration
+
+        self._starts = [0.0]
+
+        for i in range(len(factors)):
+            self._starts.append(self._starts[-1] + factors[i] * (bounds[i + 1] - bounds[i]))
+
+        self.distance = self._starts[-1]
+
+    def sample(self, t):
+        if not self.factors:
+            return (0.0, 0.0)
+
+        (s, v) = self.route.sample(t)
+        i = 0
+
+        while i < len(self.factors) - 1 and self.bounds[i + 1] < s:
+            i += 1
+
+        return (self._starts[i] + self.factors[i] * (s - self.bounds[i]), self.factors[i] * v)
+
+
+class RoutePlan(object):
+    """
+    The route of ``mdiff`` (a :py:class:`ev3dev2.motor.MoveDifferential`)
+    through ``poses``, starting at the first one, with arcs of ``radius_mm``
+    (``mdiff.min_circle_radius_mm`` by default, its tightest turn).
+
+    No wheel turns faster than ``speed`` (a percentage or a
+    :py:class:`ev3dev2.motor.SpeedValue`), so the robot goes slower than
+    ``speed`` on straight lines when the route has tight turns. It speeds up
+    and slows down at ``acceleration_mm`` (mm per second squared) at the
+    ends of the route. The wheel setpoints are sampled every ``period``
+    seconds, see :py:class:`ev3dev2.control.profile.ProfileExecutor` for
+    ``position_gain`` and ``brake``. The position gain keeps the wheels on
+    their profiles when they slip or lag; 0 runs them open loop.
+    """
+
+    def __init__(self,
+                 mdiff,
+                 poses,
+                 speed,
+                 acceleration_mm=400,
+                 radius_mm=None,
+                 period=0.01,
+                 position_gain=2.0,
+                 brake=True):
+        if radius_mm is None:
+            radius_mm = mdiff.min_circle_radius_mm
+
+        if radius_mm < mdiff.min_circle_radius_mm:
+            raise ValueError("{}: radius_mm {} is less than min_circle_radius_mm {}".format(
+                mdiff, radius_mm, mdiff.min_circle_radius_mm))
+
+        self.poses = list(poses)
+        self.radius_mm = radius_mm
+
+        #: The ``(kind, length_mm)`` segments of the route
+        self.segments = plan_segments(self.poses, radius_mm)
+
+        #: The length of the route, in mm
+        self.length_mm = sum([length for (kind, length) in self.segments])
+
+        # The mm covered by each wheel per mm of the route
+        half = mdiff.wheel_distance_mm / 2
+        inner = (radius_mm - half) / radius_mm
+        outer = (radius_mm + half) / radius_mm
+        ratios = {STRAIGHT: (1.0, 1.0), LEFT: (inner, outer), RIGHT: (outer, inner)}
+        fastest = max([1.0] + [outer for (kind, length) in self.segments if kind != STRAIGHT])
+
+        circumference_mm = mdiff.wheel.circumference_mm
+        motor = mdiff.left_motor
+        speed_mm = abs(motor._speed_native_units(speed)) / motor.count_per_rot * circumference_mm
+
+        #: The move of the middle of the axle along the route
+        self.profile = TrapezoidalProfile(self.length_mm, speed_mm / fastest, acceleration_mm)
+
+        bounds = [0.0]
+
+        for (kind, length) in self.segments:
+            bounds.append(bounds[-1] + length)
+
+        profiles = []
+
+        for wheel in (0, 1):
+            factors = [ratios[kind][wheel] * 360 / circumference_mm for (kind, length) in self.segments]
+            profiles.append(_WheelProfile(self.profile, bounds, factors))
+
+        #: The :py:class:`ev3dev2.control.profile.ProfileExecutor` holding the
+        #: precomputed wheel setpoints
+        self.executor = ProfileExecutor([(mdiff.left_motor, profiles[0]), (mdiff.right_motor, profiles[1])],
+                                        period=period,
+                                        position_gain=position_gain,
+                                        brake=brake)
+
+    @property
+    def duration(self):
+        """
+        The time the route takes, in seconds.
+        """
+        return self.profile.duration
+
+    def run(self):
+        """
+        Drives the route from the current position of the robot, and returns
+        at its end.
+        """
+        self.executor.run()
@@ -72,6 +72,7 @@ class LegoPort(Device):
         '_set_device',
         '_status',
     ]
+    _SET_ATTRIBUTES = ('modes', )
 
     def __init__(self, address=None, name_pattern=SYSTEM_DEVICE_NAME_CONVENTION, name_exact=False, **kwargs):
 
@@ -46,6 +46,7 @@ class PowerSupply(Device):
         '_technology',
         '_type',
     ]
+    _INT_ATTRIBUTES = ('current_now', 'voltage_now', 'voltage_max_design', 'voltage_min_design')
 
     def __init__(self, address=None, name_pattern=SYSTEM_DEVICE_NAME_CONVENTION, name_exact=False, **kwargs):
 
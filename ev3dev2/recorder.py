@@ -0,0 +1,296 @@
+"""
+High-rate telemetry of tacho motors.
+
+:py:class:`MotorRecorder` samples ``position``, ``speed``, ``duty_cycle`` and
+``state`` of a set of motors into ring buffers allocated once, up front, so
+recording does not allocate memory or slow down as it goes: it can run for
+hours, always keeping the most recent samples. This is what to look at after
+a stall or an overload, e.g. to see how the duty cycle built up before it.
+
+Example::
+
+    from ev3dev2.motor import OUTPUT_A, OUTPUT_B, MoveTank
+    from ev3dev2.recorder import MotorRecorder
+
+    tank = MoveTank(OUTPUT_A, OUTPUT_B)
+
+    with MotorRecorder(tank, capacity=5000, period=0.002) as recorder:
+        tank.on_for_rotations(50, 50, 5)
+
+    recorder.dump_csv('drive.csv')
+"""
+
+import _thread
+import json
+import sys
+from array import array
+from ev3dev2.clock import get_clock
+from ev3dev2.control.loop import ControlLoop
+from ev3dev2.motor import Motor
+
+#: The attributes recorded for each motor
+FIELDS = ('position', 'speed', 'duty_cycle', 'state')
+
+#: The bit of each flag of ``state`` in the recorded state values, which
+#: are those of :py:attr:`ev3dev2.motor.Motor.state_flags`
+STATE_BITS = Motor.STATE_FLAGS
+
+_MAGIC = 'ev3dev2-motor-recorder'
+
+
+class MotorRecorder(object):
+    """
+    Records the telemetry of ``motors`` (a list of motors, or a
+    :py:class:`ev3dev2.motor.MotorSet`) into ring buffers holding the last
+    ``capacity`` samples.
+
+    Either call :py:meth:`sample` from your own loop, or :py:meth:`start` a
+    thread sampling every ``period`` seconds (use the recorder as a context
+    manager to start and stop it). Reading four attributes per motor takes
+    time: check ``control_loop.stats`` after :py:meth:`stop` to see whether
+    the requested rate was kept, and enable ``ev3dev2.Device.FAST_IO`` for the
+    highest rates.
+
+    The samples are stored in ``array('i')`` buffers (one per motor and
+    field), the states as their ``state_flags``, and their times (in
+    seconds, from the monotonic library clock) in an ``array('d')``.
+    """
+
+    def __init__(self, motors, capacity=10000, period=0.001, clock=None):
+        if hasattr(motors, 'motors'):
+            motors = motors.motors.values()
+
+        self.motors = list(motors)
+        self.capacity = capacity
+        self.period = period
+        self.clock = clock
+
+        #: The total number of samples taken, including the overwritten ones
+        self.count = 0
+
+        #: The :py:class:`ev3dev2.control.loop.ControlLoop` of the sampling
+        #: thread, with its timing statistics
+        self.control_loop = None
+
+        self._index = 0
+        self._times = array('d', [0.0] * capacity)
+        self._buffers = [tuple([array('i', [0] * capacity) for field in FIELDS]) for motor in self.motors]
+        self._running = False
+        self._error = None
+        self._thread_lock = _thread.allocate_lock()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def clear(self):
+        """
+        Forgets the samples recorded so far.
+        """
+        self.count = 0
+        self._index = 0
+
+    def sample(self):
+        """
+        Samples every motor once.
+        """
+        i = self._index
+        self._times[i] = (self.clock if self.clock is not None else get_clock()).now()
+
+        for (motor, buffers) in zip(self.motors, self._buffers):
+            (position, speed, duty_cycle) = motor.read_attrs('position', 'speed', 'duty_cycle')
+            buffers[0][i] = position
+            buffers[1][i] = speed
+            buffers[2][i] = duty_cycle
+            buffers[3][i] = motor.state_flags
+
+        self._index = (i + 1) % self.capacity
+        self.count += 1
+
+    def _run(self):
+        loop = ControlLoop(period=self.period, clock=self.clock)
+
+        try:
+            while self._running:
+                self.sample()
+                loop.wait_next()
+        except Exception as e:
+            self._error = e
+        finally:
+            loop.close()
+            self.control_loop = loop
+            self._thread_lock.release()
+
+    def start(self):
+        """
+        Starts sampling every ``period`` seconds in a thread.
+        """
+        if self._running:
+            return
+
+        self._running = True
+        self._error = None
+        self._thread_lock.acquire()
+        _thread.start_new_thread(self._run, ())
+
+    def stop(self):
+        """
+        Stops the sampling thread and waits for it to end. An exception
+        raised while sampling (e.g. because a motor was unplugged) stops the
+        thread too, and is raised here.
+        """
+        if not self._running:
+            return
+
+        self._running = False
+
+        with self._thread_lock:
+            pass
+
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise error
+
+    def _buffer(self, field, motor):
+        if field == 'time':
+            return self._times
+
+        if not isinstance(motor, int):
+            motor = self.motors.index(motor)
+
+        return self._buffers[motor][FIELDS.index(field)]
+
+    def views(self, field, motor=0):
+        """
+        Returns the recorded values of ``field`` (one of :py:data:`FIELDS`, or
+        ``'time'``) for ``motor`` (a motor, or its index in ``motors``) as two
+        memoryviews of the ring buffer, oldest samples first, without copying
+        them. The first one is empty until the buffer wraps around.
+        """
+        view = memoryview(self._buffer(field, motor))
+
+        if self.count <= self.capacity:
+            return (view[0:0], view[0:self.count])
+
+        return (view[self._index:], view[0:self._index])
+
+    def values(self, field, motor=0):
+        """
+        Returns a copy of the recorded values of ``field`` for ``motor``, in
+        chronological order, as an ``array``.
+        """
+        (older, newer) = self.views(field, motor)
+        values = array(self._buffer(field, motor).typecode, older)
+        values.extend(newer)
+        return values
+
+    def to_numpy(self, field, motor=0):
+        """
+        Returns the recorded values of ``field`` for ``motor`` as a NumPy
+        array, in chronological order. It shares the memory of the ring buffer
+        (so the next samples may overwrite it) until the buffer wraps around,
+        and is a copy from then on. Requires NumPy.
+        """
+        import numpy
+
+        buffer = self._buffer(field, motor)
+        (older, newer) = self.views(field, motor)
+
+        if not len(older):
+            return numpy.frombuffer(newer, dtype=buffer.typecode)
+
+        return numpy.concatenate(
+            (numpy.frombuffer(older, dtype=buffer.typecode), numpy.frombuffer(newer, dtype=buffer.typecode)))
+
+    def _header(self):
+        return {
+            'format': _MAGIC,
+            'version': 1,
+            'byteorder': sys.byteorder,
+            'samples': len(self),
+            'motors': [motor.address for motor in self.motors],
+            'fields': FIELDS,
+            'state_bits': STATE_BITS,
+        }
+
+    def dump(self, path):
+        """
+        Writes the recording to ``path`` in a compact binary format: a line of
+        JSON describing it, followed by the raw buffers in chronological
+        order (the times, then every field of every motor). Read it back with
+        :py:func:`load`.
+        """
+        with open(path, 'wb') as f:
+            f.write(json.dumps(self._header()).encode() + b'\n')
+
+            for field in ('time', ) + FIELDS:
+                for motor in range(len(self.motors) if field != 'time' else 1):
+                    for view in self.views(field, motor):
+                        f.write(view)
+
+    def dump_csv(self, path):
+        """
+        Writes the recording to ``path`` as CSV, one line per sample, with a
+        column per motor and field named e.g. ``outA.speed``. States are
+        written as combinations of :py:data:`STATE_BITS`.
+        """
+        columns = [self.values('time')]
+        names = ['time']
+
+        for (index, motor) in enumerate(self.motors):
+            for field in FIELDS:
+                columns.append(self.values(field, index))
+                names.append('%s.%s' % (motor.address, field))
+
+        with open(path, 'w') as f:
+            f.write(','.join(names) + '\n')
+
+            for i in range(len(self)):
+                f.write('%.6f' % columns[0][i])
+
+                for column in columns[1:]:
+                    f.write(',%d' % column[i])
+
+                f.write('\n')
+
+
+def load(path):
+    """
+    Reads a recording written by :py:meth:`MotorRecorder.dump`. Returns a
+    dictionary with the ``'time'`` array, and an array per motor address
+    and field, e.g. ``recording['outA']['speed']``.
+    """
+    with open(path, 'rb') as f:
+        header = json.loads(f.readline().decode())
+
+        if header.get('format') != _MAGIC:
+            raise ValueError("%s is not a motor recording" % path)
+
+        samples = header['samples']
+
+        def read(typecode):
+            values = array(typecode)
+            values.frombytes(f.read(samples * values.itemsize))
+
+            if header['byteorder'] != sys.byteorder:
+                values.byteswap()
+
+            return values
+
+        recording = {'time': read('d')}
+
+        for address in header['motors']:
+            recording[address] = {}
+
+        for field in header['fields']:
+            for address in header['motors']:
+                recording[address][field] = read('i')
+
+        return recording
@@ -70,6 +70,9 @@ class Sensor(Device):
         '_address', '_command', '_commands', '_decimals', '_driver_name', '_mode', '_modes', '_num_values', '_units',
         '_value', '_bin_data_format', '_bin_data_size', '_bin_data', '_mode_scale'
     ]
+    _INT_ATTRIBUTES = ('decimals', 'num_values', 'poll_ms', 'value0', 'value1', 'value2', 'value3', 'value4', 'value5',
+                       'value6', 'value7')
+    _SET_ATTRIBUTES = ('commands', 'modes')
 
     def __init__(self, address=None, name_pattern=SYSTEM_DEVICE_NAME_CONVENTION, name_exact=False, **kwargs):
 
@@ -25,7 +25,7 @@
 
 import sys
 import logging
-import time
+from ev3dev2.clock import get_clock
 from ev3dev2.button import ButtonBase
 from ev3dev2.sensor import Sensor
 
@@ -68,7 +68,8 @@ class TouchSensor(Sensor):
         return not self.is_pressed
 
     def _wait(self, wait_for_press, timeout_ms, sleep_ms):
-        tic = time.time()
+        clock = get_clock()
+        deadline = clock.deadline(timeout_ms)
 
         if sleep_ms:
             sleep_ms = float(sleep_ms / 1000)
@@ -80,11 +81,11 @@ class TouchSensor(Sensor):
             if self.is_pressed == wait_for_press:
                 return True
 
-            if timeout_ms is not None and time.time() >= tic + timeout_ms / 1000:
+            if clock.expired(deadline):
                 return False
 
             if sleep_ms:
-                time.sleep(sleep_ms)
+                clock.sleep(sleep_ms)
 
     def wait_for_pressed(self, timeout_ms=None, sleep_ms=10):
         """
@@ -103,11 +104,12 @@ class TouchSensor(Sensor):
         Wait for the touch sensor to be pressed down and then released.
         Both actions must happen within timeout_ms.
         """
-        start_time = time.time()
+        clock = get_clock()
+        start_time = clock.now()
 
         if self.wait_for_pressed(timeout_ms, sleep_ms):
             if timeout_ms is not None:
-                timeout_ms -= int((time.time() - start_time) * 1000)
+                timeout_ms -= int((clock.now() - start_time) * 1000)
             return self.wait_for_released(timeout_ms, sleep_ms)
 
         return False
@@ -632,7 +634,7 @@ class GyroSensor(Sensor):
         """
         current_mode = self.mode
         self._ensure_mode(self.MODE_GYRO_CAL)
-        time.sleep(2)
+        get_clock().sleep(2)
         self._ensure_mode(current_mode)
 
     def reset(self):
@@ -665,14 +667,14 @@ class GyroSensor(Sensor):
         if direction_sensitive:
             if delta > 0:
                 while (self.value(0) - start_angle) < delta:
-                    time.sleep(0.01)
+                    get_clock().sleep(0.01)
             else:
                 delta *= -1
                 while (start_angle - self.value(0)) < delta:
-                    time.sleep(0.01)
+                    get_clock().sleep(0.01)
         else:
             while abs(start_angle - self.value(0)) < delta:
-                time.sleep(0.01)
+                get_clock().sleep(0.01)
 
     def circle_angle(self):
         """
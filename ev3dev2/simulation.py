@@ -0,0 +1,689 @@
+"""
+A simulated EV3 robot, to run programs off-robot and faster than real time.
+
+:py:class:`SimulatedBackend` is a :py:class:`ev3dev2.backend.MemoryBackend`
+whose tacho motors behave like the ``tacho-motor`` driver: the commands,
+ramps, stop actions, ``position``, ``speed`` and ``state`` (including stalls)
+follow a simple DC motor model. Two motors can drive a
+:py:class:`SimulatedRobot`, a kinematic differential drive model that feeds
+the simulated gyro and color sensors.
+
+The simulation follows the library clock (see :py:mod:`ev3dev2.clock`), or
+the ``time_source`` given to the backend. With a
+:py:class:`ev3dev2.clock.SimulatedClock`, programs run as fast as the
+computer allows and always the same way::
+
+    import ev3dev2
+    from ev3dev2.clock import SimulatedClock, set_clock
+    from ev3dev2.motor import MoveDifferential, OUTPUT_A, OUTPUT_B
+    from ev3dev2.sensor import INPUT_2
+    from ev3dev2.sensor.lego import GyroSensor
+    from ev3dev2.simulation import SimulatedBackend
+    from ev3dev2.wheel import EV3Tire
+
+    set_clock(SimulatedClock())
+    sim = SimulatedBackend()
+    left = sim.add_motor(OUTPUT_A)
+    right = sim.add_motor(OUTPUT_B)
+    robot = sim.add_robot(left, right, wheel_diameter_mm=43.2, wheel_distance_mm=120)
+    sim.add_gyro_sensor(INPUT_2, robot)
+    ev3dev2.set_backend(sim)
+
+    mdiff = MoveDifferential(OUTPUT_A, OUTPUT_B, EV3Tire, 120)
+    mdiff.on_for_distance(50, 500)
+    print(robot.x_mm, robot.y_mm, robot.heading)
+
+The model is deliberately simple: there is no load on the motors other than
+``blocked`` (a stalled shaft), the wheels do not slip, and the robot does not
+tip over (so :py:class:`ev3dev2.control.GyroBalancer` runs against a robot
+standing on flat ground).
+
+This module is not available on micropython.
+"""
+
+import errno
+import math
+import _thread
+from ev3dev2.backend import MemoryBackend, MemoryDevice
+from ev3dev2.clock import get_clock
+
+#: Parameters of the motors, by driver name: ``max_speed`` and
+#: ``count_per_rot`` as reported by the driver, and the mechanical
+#: ``time_constant`` (in seconds) of the motor
+MOTOR_MODELS = {
+    'lego-ev3-l-motor': {'max_speed': 1050, 'count_per_rot': 360, 'time_constant': 0.08},
+    'lego-ev3-m-motor': {'max_speed': 1560, 'count_per_rot': 360, 'time_constant': 0.03},
+    'lego-nxt-motor': {'max_speed': 1020, 'count_per_rot': 360, 'time_constant': 0.08},
+}
+
+_MOTOR_COMMANDS = ('run-forever', 'run-to-abs-pos', 'run-to-rel-pos', 'run-timed', 'run-direct', 'stop', 'reset')
+_STOP_ACTIONS = ('coast', 'brake', 'hold')
+
+_MOTOR_DEFAULTS = {
+    'command': '',
+    'duty_cycle_sp': '0',
+    'polarity': 'normal',
+    'position_sp': '0',
+    'hold_pid/Kd': '0',
+    'hold_pid/Ki': '0',
+    'hold_pid/Kp': '20000',
+    'speed_sp': '0',
+    'ramp_up_sp': '0',
+    'ramp_down_sp': '0',
+    'speed_pid/Kd': '0',
+    'speed_pid/Ki': '60',
+    'speed_pid/Kp': '1000',
+    'stop_action': 'coast',
+    'time_sp': '0',
+}
+
+
+def _clamp(value, limit):
+    return max(-limit, min(limit, value))
+
+
+class SimulatedTachoMotor(MemoryDevice):
+    """
+    A tacho motor of a :py:class:`SimulatedBackend`, created with
+    :py:meth:`SimulatedBackend.add_motor`.
+
+    The speed of the shaft follows the applied duty cycle with a first order
+    response of ``time_constant`` seconds. The ``run-*`` commands regulate the
+    speed (ramped by ``ramp_up_sp``/``ramp_down_sp``) by adjusting the duty
+    cycle, the position commands slow down proportionally when they get close
+    to their target. Set ``blocked`` to hold the shaft still, e.g. to test
+    stall detection.
+    """
+
+    #: Gain (1/s) of the position regulation, from position error to speed
+    POSITION_GAIN = 6.0
+
+    #: Gain of the speed regulation, in percent of duty cycle per count/s of
+    #: error relative to the no-load speed
+    SPEED_GAIN = 4.0
+
+    #: A regulated motor moving slower than this fraction of its speed set
+    #: point for ``STALL_TIME`` seconds is reported as ``stalled``
+    STALL_RATIO = 0.25
+    STALL_TIME = 0.1
+
+    #: Time constants of braking and coasting, relative to ``time_constant``
+    BRAKE_FACTOR = 0.5
+    COAST_FACTOR = 4.0
+
+    def __init__(self, simulation, address, driver_name='lego-ev3-l-motor', max_speed=None, count_per_rot=None,
+                 time_constant=None):
+        model = MOTOR_MODELS.get(driver_name, MOTOR_MODELS['lego-ev3-l-motor'])
+        self.max_speed = max_speed if max_speed is not None else model['max_speed']
+        self.time_constant = time_constant if time_constant is not None else model['time_constant']
+
+        if count_per_rot is None:
+            count_per_rot = model['count_per_rot']
+
+        attributes = {
+            'address': address,
+            'driver_name': driver_name,
+            'commands': ' '.join(_MOTOR_COMMANDS),
+            'count_per_rot': str(count_per_rot),
+            'max_speed': str(self.max_speed),
+            'stop_actions': ' '.join(_STOP_ACTIONS),
+            'position': '0',
+            'speed': '0',
+            'duty_cycle': '0',
+        }
+        attributes.update(_MOTOR_DEFAULTS)
+        super(SimulatedTachoMotor, self).__init__(attributes)
+
+        self.simulation = simulation
+        self.blocked = False
+
+        # The duty cycle that drives the shaft at max_speed is below 100%, as
+        # on the real motors
+        self.no_load_speed = self.max_speed * 1.2
+
+        #: Position (in tacho counts) and speed (counts/second) of the shaft,
+        #: in the direction set by ``polarity``
+        self.position = 0.0
+        self.speed = 0.0
+        self.duty_cycle = 0.0
+
+        self._mode = 'coast'
+        self._run_speed = 0.0
+        self._ramped_speed = 0.0
+        self._target_speed = 0.0
+        self._target = 0.0
+        self._end_time = None
+        self._holding = False
+        self._stall_time = 0.0
+        self.attributes['state'] = ''
+
+    @property
+    def rotation(self):
+        """
+        The position of the shaft in tacho counts, regardless of ``polarity``.
+        """
+        if self.attributes['polarity'] == 'inversed':
+            return -self.position
+
+        return self.position
+
+    def _int(self, name):
+        return int(self.attributes[name])
+
+    def show(self, name):
+        self._check(name)
+        self.simulation.update()
+
+        if name == 'position':
+            return str(int(round(self.position)))
+        elif name == 'speed':
+            return str(int(round(self.speed)))
+        elif name == 'duty_cycle':
+            return str(int(round(self.duty_cycle)))
+
+        return self.attributes[name]
+
+    def store(self, name, value):
+        self._check(name)
+        self.simulation.update()
+
+        if name == 'command':
+            if value not in _MOTOR_COMMANDS:
+                raise OSError(errno.EINVAL, 'Invalid argument')
+
+            self.attributes['command'] = value
+            self._command(value)
+        elif name == 'position':
+            self._target += int(value) - self.position
+            self.position = float(int(value))
+        elif name == 'speed_sp' and abs(int(value)) > self.max_speed:
+            raise OSError(errno.EINVAL, 'Invalid argument')
+        elif name == 'duty_cycle_sp' and abs(int(value)) > 100:
+            raise OSError(errno.EINVAL, 'Invalid argument')
+        elif name == 'stop_action' and value not in _STOP_ACTIONS:
+            raise OSError(errno.EINVAL, 'Invalid argument')
+        elif name == 'polarity' and value not in ('normal', 'inversed'):
+            raise OSError(errno.EINVAL, 'Invalid argument')
+        elif name in ('count_per_rot', 'max_speed', 'speed', 'duty_cycle', 'state', 'driver_name', 'address',
+                      'commands', 'stop_actions'):
+            raise OSError(errno.EACCES, 'Permission denied')
+        else:
+            self.set(name, value)
+
+    def _start(self, mode, run_speed):
+        self._mode = mode
+        self._run_speed = run_speed
+        self._holding = False
+        self._stall_time = 0.0
+
+    def _command(self, command):
+        now = self.simulation.now
+
+        if command == 'run-forever':
+            self._start('speed', self._int('speed_sp'))
+        elif command == 'run-timed':
+            self._start('speed', self._int('speed_sp'))
+            self._end_time = now + self._int('time_sp') / 1000
+        elif command in ('run-to-abs-pos', 'run-to-rel-pos'):
+            if command == 'run-to-abs-pos':
+                self._target = float(self._int('position_sp'))
+            else:
+                self._target = self.position + self._int('position_sp')
+
+            self._start('position', abs(self._int('speed_sp')))
+        elif command == 'run-direct':
+            self._start('direct', 0.0)
+        elif command == 'stop':
+            self._stop()
+        elif command == 'reset':
+            self.attributes.update(_MOTOR_DEFAULTS)
+            self.position = 0.0
+            self._mode = 'coast'
+            self._holding = False
+
+        if command != 'run-timed':
+            self._end_time = None
+
+        self._update_state()
+
+    def _stop(self):
+        stop_action = self.attributes['stop_action']
+        self._end_time = None
+
+        if stop_action == 'hold':
+            if self._mode != 'position':
+                self._target = round(self.position)
+
+            self._start('position', self.max_speed)
+            self._holding = True
+        else:
+            self._mode = stop_action
+
+    def _ramp(self, target, dt):
+        ramped = self._ramped_speed
+
+        if target == ramped:
+            return ramped
+
+        if abs(target) > abs(ramped) and target * ramped >= 0:
+            ramp_ms = self._int('ramp_up_sp')
+        else:
+            ramp_ms = self._int('ramp_down_sp')
+
+        if ramp_ms <= 0:
+            return target
+
+        step = self.max_speed * dt * 1000 / ramp_ms
+
+        if abs(target - ramped) <= step:
+            return target
+
+        return ramped + step if target > ramped else ramped - step
+
+    def step(self, dt):
+        """
+        Advances the simulation of the motor by ``dt`` seconds.
+        """
+        mode = self._mode
+
+        if mode in ('speed', 'position'):
+            if mode == 'position':
+                target_speed = _clamp(self.POSITION_GAIN * (self._target - self.position), self._run_speed)
+            else:
+                target_speed = self._run_speed
+
+            self._target_speed = target_speed
+            self._ramped_speed = self._ramp(target_speed, dt)
+            duty = (self._ramped_speed + self.SPEED_GAIN * (self._ramped_speed - self.speed)) * 100 / self.no_load_speed
+            self.duty_cycle = _clamp(duty, 100)
+        elif mode == 'direct':
+            self.duty_cycle = float(self._int('duty_cycle_sp'))
+        else:
+            self.duty_cycle = 0.0
+            self._ramped_speed = 0.0
+
+        if self.blocked:
+            self.speed = 0.0
+        else:
+            if mode == 'brake':
+                time_constant, free_speed = self.time_constant * self.BRAKE_FACTOR, 0.0
+            elif mode == 'coast':
+                time_constant, free_speed = self.time_constant * self.COAST_FACTOR, 0.0
+            else:
+                time_constant, free_speed = self.time_constant, self.duty_cycle * self.no_load_speed / 100
+
+            self.speed += (free_speed - self.speed) * (1 - math.exp(-dt / time_constant))
+            self.position += self.speed * dt
+
+        if mode in ('speed', 'position') and abs(self.speed) < abs(self._ramped_speed) * self.STALL_RATIO:
+            self._stall_time += dt
+        else:
+            self._stall_time = 0.0
+
+        if self._end_time is not None and self.simulation.now >= self._end_time:
+            self._stop()
+        elif mode == 'position' and not self._holding and abs(self._target - self.position) < 1:
+            self._stop()
+
+        self._update_state()
+
+    def _update_state(self):
+        state = []
+
+        if self._mode in ('speed', 'direct') or (self._mode == 'position' and not self._holding):
+            state.append('running')
+
+            if self._mode != 'direct' and self._ramped_speed != self._target_speed:
+                state.append('ramping')
+
+        if self._holding:
+            state.append('holding')
+
+        if abs(self.duty_cycle) >= 100:
+            state.append('overloaded')
+
+        if self._stall_time >= self.STALL_TIME:
+            state.append('stalled')
+
+        self.set('state', ' '.join(state))
+
+
+class SimulatedSensor(MemoryDevice):
+    """
+    A sensor of a :py:class:`SimulatedBackend`. The values of the current
+    ``mode`` are returned by :py:meth:`values`, computed when they are read.
+    """
+
+    MODES = ()
+
+    def __init__(self, simulation, address, driver_name):
+        super(SimulatedSensor, self).__init__({
+            'address': address,
+            'driver_name': driver_name,
+            'mode': self.MODES[0],
+            'modes': ' '.join(self.MODES),
+            'decimals': '0',
+            'num_values': '1',
+            'units': '',
+            'command': '',
+            'commands': '',
+            'poll_ms': '0',
+        })
+        self.simulation = simulation
+
+        # Computed when read, see show()
+        for n in range(8):
+            self.attributes['value' + str(n)] = ''
+
+    def values(self, mode):
+        """
+        Returns the values reported in ``mode``, as a list of ints.
+        """
+        return [0]
+
+    def show(self, name):
+        if not name.startswith('value'):
+            return super(SimulatedSensor, self).show(name)
+
+        self._check(name)
+        self.simulation.update()
+        values = self.values(self.attributes['mode'])
+        n = int(name[5:])
+
+        if n >= len(values):
+            raise OSError(errno.ENOENT, 'No such file or directory')
+
+        return str(int(round(values[n])))
+
+    def store(self, name, value):
+        self._check(name)
+
+        if name == 'mode':
+            if value not in self.MODES:
+                raise OSError(errno.EINVAL, 'Invalid argument')
+
+            self.set_mode(value)
+        else:
+            self.set(name, value)
+
+    def set_mode(self, mode):
+        self.set('mode', mode)
+        self.set('num_values', len(self.values(mode)))
+
+
+class SimulatedGyroSensor(SimulatedSensor):
+    """
+    An EV3 gyro sensor mounted on a :py:class:`SimulatedRobot`. Like the real
+    one, the angle grows when the robot turns clockwise and is reset by
+    switching to ``GYRO-CAL`` mode or writing to ``direct``.
+    """
+
+    MODES = ('GYRO-ANG', 'GYRO-RATE', 'GYRO-FAS', 'GYRO-G&A', 'GYRO-CAL', 'TILT-ANG', 'TILT-RATE')
+
+    def __init__(self, simulation, address, robot):
+        super(SimulatedGyroSensor, self).__init__(simulation, address, 'lego-ev3-gyro')
+        self.attributes['direct'] = ''
+        self.robot = robot
+
+        # The angle starts at 0, whatever the heading of the robot
+        self._offset = -math.degrees(robot.theta)
+
+    def _angle(self):
+        return -math.degrees(self.robot.theta) - self._offset
+
+    def values(self, mode):
+        rate = -math.degrees(self.robot.angular_speed)
+
+        if mode == 'GYRO-G&A':
+            return [self._angle(), rate]
+        elif mode == 'GYRO-ANG':
+            return [self._angle()]
+        elif mode in ('GYRO-RATE', 'GYRO-FAS'):
+            return [rate]
+        elif mode == 'GYRO-CAL':
+            return [0, 0, 0, 0]
+
+        # The robot does not tilt
+        return [0]
+
+    def reset(self):
+        self.simulation.update()
+        self._offset = -math.degrees(self.robot.theta)
+
+    def store(self, name, value):
+        if name == 'direct':
+            self._check(name)
+            self.reset()
+        else:
+            super(SimulatedGyroSensor, self).store(name, value)
+
+    def set_mode(self, mode):
+        if mode == 'GYRO-CAL':
+            self.reset()
+
+        super(SimulatedGyroSensor, self).set_mode(mode)
+
+
+class SimulatedColorSensor(SimulatedSensor):
+    """
+    An EV3 color sensor mounted on a :py:class:`SimulatedRobot`, looking down
+    at the point ``offset_mm`` (forward, left) from the center of the robot.
+    ``surface(x_mm, y_mm)`` returns the reflected light intensity (0 to 100)
+    of the ground at a point.
+    """
+
+    MODES = ('COL-REFLECT', 'COL-AMBIENT', 'COL-COLOR', 'REF-RAW', 'RGB-RAW')
+
+    #: Intensity above which ``COL-COLOR`` reports white rather than black
+    WHITE_THRESHOLD = 50
+
+    def __init__(self, simulation, address, robot, surface, offset_mm=(0, 0), ambient=10):
+        super(SimulatedColorSensor, self).__init__(simulation, address, 'lego-ev3-color')
+        self.robot = robot
+        self.surface = surface
+        self.offset_mm = offset_mm
+        self.ambient = ambient
+
+    def reflected(self):
+        forward, left = self.offset_mm
+        x, y = self.robot.point(forward, left)
+        return max(0, min(100, self.surface(x, y)))
+
+    def values(self, mode):
+        if mode == 'COL-REFLECT':
+            return [self.reflected()]
+        elif mode == 'COL-AMBIENT':
+            return [self.ambient]
+        elif mode == 'COL-COLOR':
+            return [6 if self.reflected() > self.WHITE_THRESHOLD else 1]
+        elif mode == 'REF-RAW':
+            return [self.reflected() * 10, 0]
+
+        level = self.reflected() * 4
+        return [level, level, level]
+
+
+class SimulatedRobot(object):
+    """
+    A differential drive robot moved by two :py:class:`SimulatedTachoMotor`,
+    created with :py:meth:`SimulatedBackend.add_robot`. Turning a motor
+    forward (positive ``rotation``) moves its wheel forward.
+
+    ``x_mm``, ``y_mm`` and ``theta`` (radians, counter-clockwise) are the pose
+    of the center of the axle; ``theta`` starts at 90 degrees (facing along
+    the y axis) like :py:meth:`ev3dev2.motor.MoveDifferential.odometry_start`.
+    """
+    def __init__(self, left_motor, right_motor, wheel_diameter_mm, wheel_distance_mm, x_mm=0.0, y_mm=0.0,
+                 theta_degrees=90.0):
+        self.left_motor = left_motor
+        self.right_motor = right_motor
+        self.wheel_diameter_mm = wheel_diameter_mm
+        self.wheel_distance_mm = wheel_distance_mm
+        self.x_mm = x_mm
+        self.y_mm = y_mm
+        self.theta = math.radians(theta_degrees)
+
+        #: Turn rate (radians/second, counter-clockwise) of the last step
+        self.angular_speed = 0.0
+
+        self._left = left_motor.rotation
+        self._right = right_motor.rotation
+
+    @property
+    def heading(self):
+        """
+        ``theta``, in degrees.
+        """
+        return math.degrees(self.theta)
+
+    def point(self, forward, left):
+        """
+        Returns the (x, y) coordinates of the point ``forward`` mm ahead and
+        ``left`` mm to the left of the robot.
+        """
+        cos, sin = math.cos(self.theta), math.sin(self.theta)
+        return (self.x_mm + forward * cos - left * sin, self.y_mm + forward * sin + left * cos)
+
+    def _wheel_mm(self, motor, previous):
+        counts = motor.rotation - previous
+        return counts / motor._int('count_per_rot') * math.pi * self.wheel_diameter_mm
+
+    def step(self, dt):
+        """
+        Moves the robot according to how far the wheels turned since the last
+        step, ``dt`` seconds ago.
+        """
+        left_mm = self._wheel_mm(self.left_motor, self._left)
+        right_mm = self._wheel_mm(self.right_motor, self._right)
+        self._left = self.left_motor.rotation
+        self._right = self.right_motor.rotation
+
+        turn = (right_mm - left_mm) / self.wheel_distance_mm
+        distance = (left_mm + right_mm) / 2
+
+        # Move along the mean heading of the step
+        heading = self.theta + turn / 2
+        self.x_mm += distance * math.cos(heading)
+        self.y_mm += distance * math.sin(heading)
+        self.theta += turn
+        self.angular_speed = turn / dt
+
+
+class SimulatedBackend(MemoryBackend):
+    """
+    A :py:class:`ev3dev2.backend.MemoryBackend` with simulated devices.
+
+    The simulation advances in steps of ``step`` seconds whenever a device is
+    read or written, or while a poller waits, up to the time of the library
+    clock, or of ``time_source`` (a function returning the time in seconds)
+    if given.
+    """
+    def __init__(self, root='/sys/class', time_source=None, step=0.001):
+        super(SimulatedBackend, self).__init__(root)
+        self.step = step
+
+        if time_source is None:
+            def time_source():
+                return get_clock().now()
+
+        self.time_source = time_source
+
+        #: Simulated time (in seconds) reached so far
+        self.now = time_source()
+
+        self._motors = []
+        self._robots = []
+        self._lock = _thread.allocate_lock()
+
+    def _next_name(self, class_name, prefix):
+        return prefix + str(len([path for path in self._devices if path.startswith(self.root + '/' + class_name)]))
+
+    def add_motor(self, address, driver_name='lego-ev3-l-motor', **kwargs):
+        """
+        Adds a :py:class:`SimulatedTachoMotor` at ``address`` (e.g.
+        ``OUTPUT_A``) and returns it. ``kwargs`` override the parameters of
+        the :py:data:`MOTOR_MODELS` entry of ``driver_name``.
+        """
+        motor = SimulatedTachoMotor(self, address, driver_name, **kwargs)
+        self.add_device('tacho-motor', self._next_name('tacho-motor', 'motor'), device=motor)
+        self._motors.append(motor)
+        return motor
+
+    def add_robot(self, left_motor, right_motor, wheel_diameter_mm, wheel_distance_mm, **kwargs):
+        """
+        Adds a :py:class:`SimulatedRobot` driven by ``left_motor`` and
+        ``right_motor`` and returns it.
+        """
+        robot = SimulatedRobot(left_motor, right_motor, wheel_diameter_mm, wheel_distance_mm, **kwargs)
+        self._robots.append(robot)
+        return robot
+
+    def _add_sensor(self, sensor):
+        self.add_device('lego-sensor', self._next_name('lego-sensor', 'sensor'), device=sensor)
+        return sensor
+
+    def add_gyro_sensor(self, address, robot):
+        """
+        Adds a :py:class:`SimulatedGyroSensor` mounted on ``robot``.
+        """
+        return self._add_sensor(SimulatedGyroSensor(self, address, robot))
+
+    def add_color_sensor(self, address, robot, surface, offset_mm=(0, 0)):
+        """
+        Adds a :py:class:`SimulatedColorSensor` mounted on ``robot``.
+        """
+        return self._add_sensor(SimulatedColorSensor(self, address, robot, surface, offset_mm))
+
+    def add_touch_sensor(self, address):
+        """
+        Adds a touch sensor, pressed by setting its ``value0`` to 1.
+        """
+        attributes = {
+            'address': address,
+            'driver_name': 'lego-ev3-touch',
+            'mode': 'TOUCH',
+            'modes': 'TOUCH',
+            'decimals': '0',
+            'num_values': '1',
+            'value0': '0',
+        }
+        return self.add_device('lego-sensor', self._next_name('lego-sensor', 'sensor'), attributes)
+
+    def add_power_supply(self, volts=7.5):
+        """
+        Adds the EV3 battery, reporting ``volts``.
+        """
+        attributes = {
+            'type': 'Battery',
+            'technology': 'Li-ion',
+            'voltage_now': str(int(volts * 1000000)),
+            'current_now': '150000',
+            'voltage_max_design': '8400000',
+            'voltage_min_design': '6000000',
+        }
+        return self.add_device('power_supply', 'lego-ev3-battery', attributes)
+
+    def update(self):
+        """
+        Advances the simulation to the current time.
+        """
+        with self._lock:
+            end = self.time_source()
+
+            if end < self.now:
+                # The clock was replaced, carry on from its time
+                self.now = end
+
+            while self.now < end:
+                dt = min(self.step, end - self.now)
+                self.now += dt
+
+                for motor in self._motors:
+                    if not motor.removed:
+                        motor.step(dt)
+
+                for robot in self._robots:
+                    robot.step(dt)
+
+    def tick(self):
+        self.update()
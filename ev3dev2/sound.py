@@ -26,8 +26,8 @@
 import sys
 import os
 import re
-from time import sleep
 from ev3dev2 import is_micropython
+from ev3dev2.clock import get_clock
 
 if sys.version_info < (3, 4):
     raise SystemError('Must be using Python 3.4 or higher')
@@ -511,7 +511,7 @@ class Sound(object):
                 raise ValueError('invalid note (%s)' % base)
 
             if note == "R":
-                sleep(duration_ms / 1000 + delay)
+                get_clock().sleep(duration_ms / 1000 + delay)
             else:
                 freq = self._NOTE_FREQUENCIES[note.upper()]
                 self.beep('-f %d -l %d -D %d' % (freq, duration_ms, delay_ms))
@@ -0,0 +1,244 @@
+"""
+Statistics about the sysfs attribute I/O done by the library.
+
+When enabled, every attribute read and write is counted per device class and
+attribute name, together with the number of bytes transferred and a latency
+histogram. This shows which attributes dominate the time spent in a control
+loop. When disabled (the default) the library runs its regular, untouched
+code, so there is no cost at all.
+
+Example::
+
+    import ev3dev2.stats
+
+    with ev3dev2.stats.collect() as collector:
+        tank.follow_line(...)
+
+    print(collector.snapshot['LargeMotor']['speed_sp'])
+    collector.dump('follow_line.json')
+"""
+
+import json
+from ev3dev2 import Device, is_micropython
+
+if is_micropython():
+    import utime
+
+    def _now_us():
+        return utime.ticks_us()
+
+    def _since_us(start):
+        return utime.ticks_diff(utime.ticks_us(), start)
+else:
+    import time
+
+    def _now_us():
+        return time.perf_counter() * 1000000
+
+    def _since_us(start):
+        return time.perf_counter() * 1000000 - start
+
+
+#: Upper bounds (in microseconds, exclusive) of the latency histogram
+#: buckets. Bucket ``n`` counts the calls that took from ``2**(n-1)`` to
+#: ``2**n`` microseconds; the last one also counts everything slower.
+BUCKET_LIMITS_US = tuple(2**n for n in range(24))
+
+_COUNT, _READS, _WRITES, _BYTES, _TOTAL_US, _MAX_US, _HISTOGRAM = range(7)
+
+# (class name, attribute name) -> list of the values above
+_stats = {}
+
+# The Device methods replaced while enabled, None when disabled
+_originals = None
+
+
+def _record(device, name, nbytes, elapsed_us, write):
+    key = (device.__class__.__name__, name)
+    entry = _stats.get(key)
+
+    if entry is None:
+        entry = [0, 0, 0, 0, 0, 0, [0] * len(BUCKET_LIMITS_US)]
+        _stats[key] = entry
+
+    entry[_COUNT] += 1
+    entry[_WRITES if write else _READS] += 1
+    entry[_BYTES] += nbytes
+    entry[_TOTAL_US] += elapsed_us
+
+    if elapsed_us > entry[_MAX_US]:
+        entry[_MAX_US] = elapsed_us
+
+    bucket = 0
+    last = len(BUCKET_LIMITS_US) - 1
+    while bucket < last and elapsed_us >= BUCKET_LIMITS_US[bucket]:
+        bucket += 1
+
+    entry[_HISTOGRAM][bucket] += 1
+
+
+def _instrumented(original, write, measure):
+    def wrapper(self, attribute, name, *args):
+        start = _now_us()
+        result = original(self, attribute, name, *args)
+        _record(self, name, measure(result, args), _since_us(start), write)
+        return result
+
+    return wrapper
+
+
+def _read_size(result, args):
+    return len(result[1])
+
+
+def _value_size(result, args):
+    return len(str(result))
+
+
+def _written_size(result, args):
+    return len(args[0])
+
+
+def _written_int_size(result, args):
+    return len(str(args[0]))
+
+
+def is_enabled():
+    return _originals is not None
+
+
+def enable():
+    """
+    Starts recording. Statistics recorded so far are kept, see ``reset()``.
+    """
+    global _originals
+
+    if _originals is not None:
+        return
+
+    _originals = {
+        '_get_attribute': Device._get_attribute,
+        '_set_attribute': Device._set_attribute,
+        '_get_fast_int': Device._get_fast_int,
+        '_get_fast_string': Device._get_fast_string,
+        '_set_fast_int': Device._set_fast_int,
+        'read_attrs': Device.read_attrs,
+    }
+
+    Device._get_attribute = _instrumented(Device._get_attribute, False, _read_size)
+    Device._set_attribute = _instrumented(Device._set_attribute, True, _written_size)
+    Device._get_fast_int = _instrumented(Device._get_fast_int, False, _value_size)
+    Device._get_fast_string = _instrumented(Device._get_fast_string, False, _value_size)
+    Device._set_fast_int = _instrumented(Device._set_fast_int, True, _written_int_size)
+
+    # The batched read_attrs() does its I/O inline, read attribute by
+    # attribute instead so that every read is recorded
+    Device.read_attrs = Device._read_attrs_each
+
+
+def disable():
+    """
+    Stops recording and puts the regular Device methods back.
+    """
+    global _originals
+
+    if _originals is None:
+        return
+
+    for name, method in _originals.items():
+        setattr(Device, name, method)
+
+    _originals = None
+
+
+def reset():
+    """
+    Forgets everything recorded so far.
+    """
+    _stats.clear()
+
+
+def snapshot():
+    """
+    Returns the statistics recorded so far as nested dictionaries: device
+    class name -> attribute name -> statistics. The statistics of an
+    attribute are:
+
+    - ``count``, ``reads``, ``writes``: number of calls
+    - ``bytes``: number of bytes read and written (for the fast I/O path,
+      the length of the value)
+    - ``total_us``, ``mean_us``, ``max_us``: time spent, in microseconds
+    - ``histogram``: list of ``[upper bound in microseconds, count]`` pairs,
+      for the non-empty buckets of ``BUCKET_LIMITS_US``
+
+    The result only holds plain types, so it can be passed to ``json.dump()``.
+    """
+    result = {}
+
+    for (class_name, name), entry in list(_stats.items()):
+        result.setdefault(class_name, {})[name] = {
+            'count': entry[_COUNT],
+            'reads': entry[_READS],
+            'writes': entry[_WRITES],
+            'bytes': entry[_BYTES],
+            'total_us': entry[_TOTAL_US],
+            'mean_us': entry[_TOTAL_US] / entry[_COUNT],
+            'max_us': entry[_MAX_US],
+            'histogram': [[limit, count] for limit, count in zip(BUCKET_LIMITS_US, entry[_HISTOGRAM]) if count],
+        }
+
+    return result
+
+
+def dumps(stats=None):
+    """
+    Returns ``stats`` (the current ``snapshot()`` by default) as a JSON string.
+    """
+    if stats is None:
+        stats = snapshot()
+
+    try:
+        return json.dumps(stats, indent=2, sort_keys=True)
+    except TypeError:
+        # micropython's json has no formatting options
+        return json.dumps(stats)
+
+
+def dump(path, stats=None):
+    """
+    Writes ``stats`` (the current ``snapshot()`` by default) to the JSON file
+    ``path``.
+    """
+    with open(path, 'w') as f:
+        f.write(dumps(stats))
+
+
+class collect(object):
+    """
+    Context manager that records the I/O done in its block. The previous
+    statistics are dropped on entry unless ``reset`` is False. On exit,
+    recording is turned back off (unless it was already enabled before) and
+    the statistics are available as ``snapshot``.
+    """
+    def __init__(self, reset=True):
+        self.reset = reset
+        self.snapshot = None
+        self._was_enabled = False
+
+    def __enter__(self):
+        self._was_enabled = is_enabled()
+
+        if self.reset:
+            reset()
+
+        enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.snapshot = snapshot()
+
+        if not self._was_enabled:
+            disable()
+
+    def dump(self, path):
+        dump(path, self.snapshot)
@@ -2,19 +2,11 @@
 A StopWatch class for tracking the amount of time between events
 """
 
-from ev3dev2 import is_micropython
-
-if is_micropython():
-    import utime
-else:
-    import datetime as dt
+from ev3dev2.clock import get_clock
 
 
 def get_ticks_ms():
-    if is_micropython():
-        return utime.ticks_ms()
-    else:
-        return int(dt.datetime.timestamp(dt.datetime.now()) * 1000)
+    return get_clock().ticks_ms()
 
 
 class StopWatchAlreadyStartedException(Exception):
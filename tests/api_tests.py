@@ -1,4 +1,7 @@
 #!/usr/bin/env python3
+import json
+import math
+import select
 import unittest
 import sys
 import os.path
@@ -14,18 +17,39 @@ from populate_arena import populate_arena  # noqa: E402
 from clean_arena import clean_arena  # noqa: E402
 
 import ev3dev2  # noqa: E402
+import ev3dev2.mapping  # noqa: E402
+import ev3dev2.planner  # noqa: E402
+import ev3dev2.recorder  # noqa: E402
+import ev3dev2.stats  # noqa: E402
+from ev3dev2.clock import Clock, SimulatedClock, get_clock, set_clock  # noqa: E402
+from ev3dev2.control.gearing import Cam, ElectronicGearing  # noqa: E402
+from ev3dev2.control.loop import ControlLoop  # noqa: E402
+from ev3dev2.control.pid import PID  # noqa: E402
+from ev3dev2.control.profile import (  # noqa: E402
+    TrapezoidalProfile, SCurveProfile, ProfileExecutor, blend_moves, synchronize)
+from ev3dev2.backend import MemoryBackend, MemoryAttribute, SysfsBackend  # noqa: E402
 import ev3dev2.stopwatch  # noqa: E402
 from ev3dev2.motor import \
-    OUTPUT_A, OUTPUT_B, \
-    Motor, MediumMotor, LargeMotor, \
-    MoveTank, MoveSteering, MoveJoystick, \
+    OUTPUT_A, OUTPUT_B, OUTPUT_C, \
+    Motor, MediumMotor, LargeMotor, MotorSet, MoveHandle, list_motors, \
+    MoveTank, MoveSteering, MoveJoystick, MoveDifferential, \
     SpeedPercent, SpeedDPM, SpeedDPS, SpeedRPM, SpeedRPS, SpeedNativeUnits   # noqa: E402
 from ev3dev2.sensor.lego import InfraredSensor  # noqa: E402
 from ev3dev2.stopwatch import StopWatch, StopWatchAlreadyStartedException  # noqa: E402
+from ev3dev2.mapping import OccupancyGrid  # noqa: E402
+from ev3dev2.odometry import Odometry  # noqa: E402
+from ev3dev2.wheel import EV3Tire  # noqa: E402
 from ev3dev2.unit import (  # noqa: E402
     DistanceMillimeters, DistanceCentimeters, DistanceDecimeters, DistanceMeters, DistanceInches, DistanceFeet,
     DistanceYards, DistanceStuds)
 
+if not ev3dev2.is_micropython():
+    import asyncio
+    from ev3dev2.aio import AsyncMoveTank
+    from ev3dev2.hotplug import DeviceRegistry, DeviceEvent, SimulatedEventSource
+    from ev3dev2.sensor.lego import GyroSensor, ColorSensor
+    from ev3dev2.simulation import SimulatedBackend
+
 ev3dev2.Device.DEVICE_ROOT_PATH = os.path.join(FAKE_SYS, 'arena')
 
 _internal_set_attribute = ev3dev2.Device._set_attribute
@@ -37,7 +61,8 @@ def _set_attribute(self, attribute, name, value):
     # attributes where there isn't any persistent buffer, but in the test
     # environment they're normal files on disk which retain previous data.
     attribute = _internal_set_attribute(self, attribute, name, value)
-    attribute.write(b'\n')
+    if not isinstance(attribute, MemoryAttribute):
+        attribute.write(b'\n')
     return attribute
 
 
@@ -55,12 +80,22 @@ def _get_attribute(self, attribute, name):
 ev3dev2.Device._get_attribute = _get_attribute
 
 
-def dummy_wait(self, cond, timeout=None):
+def dummy_wait(self, cond, timeout=None, flags=False, expected=None):
     pass
 
 
+_internal_motor_wait = Motor.wait
 Motor.wait = dummy_wait
 
+_internal_motor_set_wait = MotorSet.wait
+
+
+def dummy_motor_set_wait(self, cond, timeout=None, motors=None, mode=MotorSet.WAIT_ALL, flags=False, expected=None):
+    pass
+
+
+MotorSet.wait = dummy_motor_set_wait
+
 # for StopWatch
 mock_ticks_ms = 0
 
@@ -111,6 +146,104 @@ class TestAPI(unittest.TestCase):
         with self.assertRaises(ev3dev2.DeviceNotFound):
             ev3dev2.Device('this-does-not-exist')
 
+    def test_device_index(self):
+        clean_arena()
+        populate_arena([('large_motor', 0, 'outA'), ('large_motor', 1, 'outB')])
+
+        self.assertEqual(os.path.basename(LargeMotor(OUTPUT_B)._path), 'motor1')
+
+        # Devices replaced or plugged in after the index was built are found
+        clean_arena()
+        populate_arena([('large_motor', 0, 'outB')])
+        self.assertEqual(os.path.basename(LargeMotor(OUTPUT_B)._path), 'motor0')
+
+        with self.assertRaises(ev3dev2.DeviceNotFound):
+            LargeMotor(OUTPUT_A)
+
+        populate_arena([('medium_motor', 1, 'outA')])
+        self.assertEqual(os.path.basename(MediumMotor(OUTPUT_A)._path), 'motor1')
+        self.assertEqual(sorted(m.address for m in list_motors()), ['outA', 'outB'])
+
+        # address is only read again after an explicit refresh
+        with open(os.path.join(FAKE_SYS, 'arena', 'tacho-motor', 'motor0', 'address'), 'w') as f:
+            f.write('outC\n')
+        self.assertEqual(os.path.basename(LargeMotor(OUTPUT_B)._path), 'motor0')
+
+        ev3dev2.refresh_device_index()
+        with self.assertRaises(ev3dev2.DeviceNotFound):
+            LargeMotor(OUTPUT_B)
+
+    @unittest.skipIf(ev3dev2.is_micropython(), "needs os.pipe()")
+    def test_hotplug_registry(self):
+        clean_arena()
+        populate_arena([('large_motor', 0, 'outA')])
+
+        source = SimulatedEventSource()
+        registry = DeviceRegistry(source)
+        m = registry.track(LargeMotor(OUTPUT_A))
+        events = []
+        registry.add_callback(events.append)
+
+        self.assertEqual(m.position, 0)
+
+        clean_arena()
+        source.inject('remove', 'tacho-motor', 'motor0')
+        self.assertEqual(registry.process_events(), [DeviceEvent('remove', 'tacho-motor', 'motor0', m)])
+        self.assertFalse(registry.is_connected(m))
+
+        with self.assertRaises(ev3dev2.DeviceNotFound):
+            m.position
+
+        # Unrelated devices don't rebind the motor
+        populate_arena([('medium_motor', 1, 'outA'), ('infrared_sensor', 0, 'in1')])
+        source.inject('add', 'tacho-motor', 'motor1')
+        source.inject('add', 'lego-sensor', 'sensor0')
+        source.inject('add', 'power_supply', 'lego-ev3-battery')
+        registry.process_events()
+        self.assertFalse(registry.is_connected(m))
+
+        populate_arena([('large_motor', 3, 'outA')])
+        source.inject('add', 'tacho-motor', 'motor3')
+        registry.process_events()
+        self.assertTrue(registry.is_connected(m))
+        self.assertEqual(m.position, 0)
+        self.assertEqual(os.path.basename(m._path), 'motor3')
+
+        self.assertEqual(events, [
+            DeviceEvent('remove', 'tacho-motor', 'motor0', m),
+            DeviceEvent('add', 'tacho-motor', 'motor1', None),
+            DeviceEvent('add', 'lego-sensor', 'sensor0', None),
+            DeviceEvent('add', 'tacho-motor', 'motor3', m),
+        ])
+        source.close()
+
+    @unittest.skipIf(ev3dev2.is_micropython(), "the simulation is not available on micropython")
+    def test_hotplug_wait(self):
+        sim = SimulatedBackend(ev3dev2.Device.DEVICE_ROOT_PATH)
+        sim.add_motor('outA')
+
+        ev3dev2.set_backend(sim)
+        try:
+            source = SimulatedEventSource()
+            registry = DeviceRegistry(source)
+            m = registry.track(LargeMotor(OUTPUT_A))
+            self.assertTrue(_internal_motor_wait(m, lambda state: 'running' not in state, timeout=50))
+            state = m._state
+
+            source.inject('remove', 'tacho-motor', 'motor0')
+            registry.process_events()
+            source.inject('add', 'tacho-motor', 'motor0')
+            registry.process_events()
+            self.assertTrue(registry.is_connected(m))
+
+            # wait() watches the state file of the new device
+            self.assertTrue(_internal_motor_wait(m, lambda state: 'running' not in state, timeout=50))
+            self.assertIsNot(m._state, state)
+            self.assertEqual(m._poll._handles, [m._state])
+            source.close()
+        finally:
+            ev3dev2.set_backend(SysfsBackend())
+
     def test_medium_motor(self):
         def dummy(self):
             pass
@@ -184,6 +317,1225 @@ class TestAPI(unittest.TestCase):
         m.speed_sp = 500
         self.assertEqual(m.speed_sp, 500)
 
+    def test_read_attrs(self):
+        clean_arena()
+        populate_arena([('large_motor', 0, 'outA'), ('large_motor', 1, 'outB')])
+
+        m = LargeMotor(OUTPUT_A)
+
+        self.assertEqual(m.read_attrs('position', 'speed', 'state', 'driver_name'),
+                         (0, 0, ['running'], 'lego-ev3-l-motor'))
+
+        # Reading again reuses the file handles opened above
+        self.assertEqual(m.read_attrs('position', 'state'), (0, ['running']))
+        self.assertEqual(m.position, 0)
+
+        drive = MoveTank(OUTPUT_A, OUTPUT_B)
+        self.assertEqual(drive.read_attrs('position', 'address'), ((0, 'outA'), (0, 'outB')))
+
+    def test_fast_io(self):
+        clean_arena()
+        populate_arena([('medium_motor', 0, 'outA')])
+
+        ev3dev2.Device.FAST_IO = True
+        try:
+            m = MediumMotor()
+
+            self.assertEqual(m.position, 42)
+            self.assertEqual(m.max_speed, 1560)
+            self.assertEqual(m.driver_name, 'lego-ev3-m-motor')
+            self.assertEqual(m.read_attrs('position', 'state', 'address'), (42, ['running'], 'outA'))
+
+            m.speed_sp = 780
+            self.assertEqual(m.speed_sp, 780)
+
+            # Integers are parsed from the read buffer
+            def overwrite(value):
+                with open(os.path.join(m._path, 'position'), 'w') as f:
+                    f.write(value)
+
+            overwrite('-1234\n')
+            self.assertEqual(m.position, -1234)
+            overwrite('12a\n')
+            with self.assertRaises(ValueError):
+                m.position
+        finally:
+            ev3dev2.Device.FAST_IO = False
+
+    def test_shadowed_setpoints(self):
+        clean_arena()
+        populate_arena([('large_motor', 0, 'outA')])
+
+        m = LargeMotor()
+
+        def overwrite(name, value):
+            with open(os.path.join(m._path, name), 'w') as f:
+                f.write(value + '\n')
+
+        m.speed_sp = 500
+        self.assertEqual(m.speed_sp, 500)
+
+        # Writing the same value again does not touch the device
+        overwrite('speed_sp', '0')
+        m.speed_sp = 500
+        self.assertEqual(m.speed_sp, 0)
+
+        # Unless the shadow is invalidated or the write forced
+        m.invalidate_shadow('speed_sp')
+        m.speed_sp = 500
+        self.assertEqual(m.speed_sp, 500)
+
+        overwrite('speed_sp', '0')
+        m._speed_sp = m.set_attr_int(m._speed_sp, 'speed_sp', 500, force=True)
+        self.assertEqual(m.speed_sp, 500)
+
+        # Different values are always written, stop_action is shadowed too
+        m.speed_sp = 400
+        self.assertEqual(m.speed_sp, 400)
+        m.stop_action = 'hold'
+        overwrite('stop_action', 'coast')
+        m.stop_action = 'hold'
+        self.assertEqual(m.stop_action, 'coast')
+
+        # reset puts the setpoints back to their defaults
+        m.reset()
+        overwrite('stop_action', 'coast')
+        m.stop_action = 'hold'
+        self.assertEqual(m.stop_action, 'hold')
+
+    def test_shadowed_setpoints_shared(self):
+        clean_arena()
+        populate_arena([('large_motor', 0, 'outA'), ('large_motor', 1, 'outB')])
+
+        m = LargeMotor(OUTPUT_A)
+        tank = MoveTank(OUTPUT_A, OUTPUT_B)
+
+        # A write through one object is not skipped by another one
+        m.speed_sp = 500
+        tank.left_motor.speed_sp = 300
+        m.speed_sp = 500
+        self.assertEqual(m.speed_sp, 500)
+
+        # Stopping the motor through another object makes set_speeds_native()
+        # start it again
+        tank.set_speeds_native(600, 0)
+        m.stop()
+
+        with ev3dev2.stats.collect() as collector:
+            tank.set_speeds_native(600, 0)
+
+        self.assertEqual(collector.snapshot['LargeMotor']['command']['writes'], 1)
+
+    def test_set_speeds_native(self):
+        clean_arena()
+        populate_arena([('large_motor', 0, 'outA'), ('large_motor', 1, 'outB')])
+
+        tank = MoveTank(OUTPUT_A, OUTPUT_B)
+
+        with ev3dev2.stats.collect() as collector:
+            tank.set_speeds_native(500, -500)
+            tank.set_speeds_native(500, -400)
+            tank.set_speeds_native(600, -400)
+            tank.set_speeds_native(600, -400)
+
+        self.assertEqual((tank.left_motor.speed_sp, tank.right_motor.speed_sp), (600, -400))
+
+        # Only the motors whose speed changed are written to
+        stats = collector.snapshot['LargeMotor']
+        self.assertEqual(stats['speed_sp']['writes'], 4)
+        self.assertEqual(stats['command']['writes'], 4)
+
+        # Any other command makes the next call start the motors again, even
+        # at the same speed
+        tank.stop()
+
+        with ev3dev2.stats.collect() as collector:
+            tank.set_speeds_native(600, -400)
+
+        self.assertEqual(collector.snapshot['LargeMotor']['command']['writes'], 2)
+        self.assertNotIn('speed_sp', collector.snapshot['LargeMotor'])
+
+        # The limits are checked before anything is written
+        with self.assertRaises(ValueError):
+            tank.set_speeds_native(100, -1051)
+
+        self.assertEqual(tank.left_motor.speed_sp, 600)
+
+        # A motor stopped by something else (another program) is started again
+        with open(os.path.join(FAKE_SYS, 'arena', 'tacho-motor', 'motor1', 'state'), 'w') as f:
+            f.write('\n')
+
+        with ev3dev2.stats.collect() as collector:
+            tank.set_speeds_native(600, -400)
+
+        self.assertEqual(collector.snapshot['LargeMotor']['command']['writes'], 1)
+        self.assertNotIn('speed_sp', collector.snapshot['LargeMotor'])
+
+    def test_state_flags(self):
+        clean_arena()
+        populate_arena([('large_motor', 0, 'outA'), ('large_motor', 1, 'outB')])
+
+        def set_state(port, state):
+            with open(os.path.join(FAKE_SYS, 'arena', 'tacho-motor', 'motor' + port, 'state'), 'w') as f:
+                f.write(state + '\n')
+
+        m = LargeMotor(OUTPUT_A)
+        self.assertEqual(m.state_flags, Motor.STATE_FLAG_RUNNING)
+
+        set_state('0', 'running ramping stalled')
+        self.assertEqual(m.state_flags, Motor.STATE_FLAG_RUNNING | Motor.STATE_FLAG_RAMPING | Motor.STATE_FLAG_STALLED)
+        self.assertTrue(m.is_stalled)
+        self.assertFalse(m.is_holding)
+        self.assertTrue(m.has_state_flags(Motor.STATE_FLAG_RUNNING | Motor.STATE_FLAG_STALLED))
+        self.assertFalse(m.has_state_flags(Motor.STATE_FLAG_RUNNING, Motor.STATE_FLAG_RAMPING))
+
+        # Flags out of the usual order or unknown are decoded too
+        set_state('0', 'holding running foo')
+        self.assertEqual(m.state_flags, Motor.STATE_FLAG_RUNNING | Motor.STATE_FLAG_HOLDING)
+        set_state('0', '')
+        self.assertEqual(m.state_flags, 0)
+
+        # The waits of motors and motor sets use the flags
+        set_state('1', 'running holding')
+        tank = MoveTank(OUTPUT_A, OUTPUT_B)
+        self.assertFalse(tank.is_running)
+        self.assertTrue(_internal_motor_set_wait(
+            tank, lambda flags: flags & Motor.STATE_FLAG_HOLDING, timeout=0, mode=MotorSet.WAIT_ANY, flags=True))
+        self.assertFalse(_internal_motor_set_wait(
+            tank, lambda flags: flags & Motor.STATE_FLAG_HOLDING, timeout=0, flags=True))
+
+    @unittest.skipIf(ev3dev2.is_micropython(), "asyncio is not available on micropython")
+    def test_aio_waits(self):
+        clean_arena()
+        populate_arena([('large_motor', 0, 'outA'), ('large_motor', 1, 'outB')])
+
+        def set_state(port, state):
+            with open(os.path.join(FAKE_SYS, 'arena', 'tacho-motor', 'motor' + port, 'state'), 'w') as f:
+                f.write(state + '\n')
+
+        async def scenario():
+            tank = AsyncMoveTank(MoveTank(OUTPUT_A, OUTPUT_B))
+            m = tank.left_motor
+
+            self.assertTrue(await m.wait_until('running'))
+            self.assertFalse(await m.wait_until('stalled', timeout=10))
+
+            set_state('0', 'holding')
+            set_state('1', 'holding')
+            self.assertTrue(await m.wait_while('running', timeout=10))
+            self.assertTrue(await m.wait_until_not_moving())
+
+            await tank.on_for_degrees(SpeedPercent(50), SpeedPercent(25), 90)
+            self.assertEqual(tank.left_motor.position_sp, 90)
+            self.assertEqual(tank.right_motor.position_sp, 45)
+            self.assertEqual(tank.right_motor.speed_sp, int(round(0.25 * 1050)))
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(scenario())
+        finally:
+            loop.close()
+
+    def test_motor_set_wait(self):
+        clean_arena()
+        populate_arena([('large_motor', 0, 'outA'), ('large_motor', 1, 'outB')])
+
+        def set_state(port, state):
+            with open(os.path.join(FAKE_SYS, 'arena', 'tacho-motor', 'motor' + port, 'state'), 'w') as f:
+                f.write(state + '\n')
+
+        def holding(state):
+            return 'holding' in state
+
+        tank = MoveTank(OUTPUT_A, OUTPUT_B)
+        set_state('1', 'holding')
+
+        self.assertFalse(_internal_motor_set_wait(tank, holding, timeout=10))
+        self.assertTrue(_internal_motor_set_wait(tank, holding, timeout=10, mode=MotorSet.WAIT_ANY))
+        self.assertTrue(_internal_motor_set_wait(tank, holding, timeout=10, motors=[tank.right_motor]))
+
+        set_state('0', 'holding')
+        self.assertTrue(_internal_motor_set_wait(tank, holding, timeout=10))
+
+        with self.assertRaises(ValueError):
+            _internal_motor_set_wait(tank, holding, mode='some')
+
+    def test_stats(self):
+        clean_arena()
+        populate_arena([('large_motor', 0, 'outA')])
+
+        get_attribute = ev3dev2.Device._get_attribute
+        read_attrs = ev3dev2.Device.read_attrs
+        m = LargeMotor()
+
+        with ev3dev2.stats.collect() as collector:
+            self.assertTrue(ev3dev2.stats.is_enabled())
+            m.speed_sp = 500
+            m.speed_sp
+            m.position
+            m.read_attrs('position', 'state')
+
+        self.assertFalse(ev3dev2.stats.is_enabled())
+        self.assertIs(ev3dev2.Device._get_attribute, get_attribute)
+        self.assertIs(ev3dev2.Device.read_attrs, read_attrs)
+
+        stats = collector.snapshot['LargeMotor']
+        self.assertEqual(sorted(stats.keys()), ['position', 'speed_sp', 'state'])
+        self.assertEqual((stats['speed_sp']['reads'], stats['speed_sp']['writes']), (1, 1))
+        self.assertEqual(stats['speed_sp']['bytes'], 6)
+        self.assertEqual(stats['position']['count'], 2)
+        self.assertEqual(sum(count for limit, count in stats['position']['histogram']), 2)
+        self.assertEqual(json.loads(ev3dev2.stats.dumps(collector.snapshot)), collector.snapshot)
+
+        # Nothing is recorded once disabled
+        m.position
+        self.assertEqual(ev3dev2.stats.snapshot()['LargeMotor']['position']['count'], 2)
+
+    @unittest.skipIf(ev3dev2.is_micropython(), "the simulation is not available on micropython")
+    def test_motor_recorder(self):
+        clock = set_clock(SimulatedClock())
+        sim = SimulatedBackend(ev3dev2.Device.DEVICE_ROOT_PATH)
+        sim.add_motor('outA')
+        sim.add_motor('outB')
+
+        ev3dev2.set_backend(sim)
+        try:
+            tank = MoveTank(OUTPUT_A, OUTPUT_B)
+            recorder = ev3dev2.recorder.MotorRecorder(tank, capacity=100)
+            tank.on(SpeedNativeUnits(500), SpeedNativeUnits(-500))
+
+            for i in range(150):
+                recorder.sample()
+                clock.sleep(0.01)
+
+            # Only the last 100 samples are kept, in chronological order
+            self.assertEqual((len(recorder), recorder.count), (100, 150))
+            (older, newer) = recorder.views('time')
+            self.assertEqual((len(older), len(newer)), (50, 50))
+            times = recorder.values('time')
+            self.assertAlmostEqual(times[0], 0.5)
+            self.assertAlmostEqual(times[-1], 1.49)
+            self.assertEqual(list(recorder.values('state', tank.right_motor)), [1] * 100)
+            self.assertEqual(recorder.values('speed', 1)[-1], -500)
+
+            positions = recorder.values('position')
+            self.assertEqual(list(positions), sorted(positions))
+
+            path = os.path.join(FAKE_SYS, 'recording.bin')
+            try:
+                recorder.dump(path)
+                recording = ev3dev2.recorder.load(path)
+                self.assertEqual(recording['time'], times)
+                self.assertEqual(recording['outA']['position'], positions)
+
+                recorder.dump_csv(path)
+                with open(path) as f:
+                    lines = f.read().splitlines()
+                self.assertEqual(len(lines), 101)
+                self.assertEqual(lines[0].split(',')[:3], ['time', 'outA.position', 'outA.speed'])
+                self.assertEqual(lines[-1].split(',')[-3:], ['-500', str(recorder.values('duty_cycle', 1)[-1]), '1'])
+            finally:
+                os.remove(path)
+
+        finally:
+            ev3dev2.set_backend(SysfsBackend())
+            set_clock(Clock())
+
+        # Sampling in a thread
+        clean_arena()
+        populate_arena([('large_motor', 0, 'outA')])
+
+        with ev3dev2.recorder.MotorRecorder([LargeMotor()], period=0.002) as recorder:
+            get_clock().sleep(0.05)
+
+        self.assertGreater(len(recorder), 5)
+        self.assertEqual(recorder.control_loop.stats['iterations'], len(recorder))
+        self.assertEqual(recorder.values('state')[-1], ev3dev2.recorder.STATE_BITS['running'])
+
+    def test_memory_backend(self):
+        backend = MemoryBackend(ev3dev2.Device.DEVICE_ROOT_PATH)
+        attributes = {
+            'address': 'outA',
+            'driver_name': 'lego-ev3-l-motor',
+            'command': 'stop',
+            'commands': 'run-forever run-to-abs-pos run-to-rel-pos run-timed run-direct stop reset',
+            'count_per_rot': '360',
+            'max_speed': '1050',
+            'position': '0',
+            'speed_sp': '0',
+            'state': '',
+        }
+        motor0 = backend.add_device('tacho-motor', 'motor0', attributes)
+        backend.add_device('tacho-motor', 'motor1', dict(attributes, address='outB'))
+
+        ev3dev2.set_backend(backend)
+        try:
+            m = LargeMotor(OUTPUT_A)
+            self.assertEqual(sorted(m.address for m in list_motors()), ['outA', 'outB'])
+
+            # Writes replace the value, reads return it with a newline
+            m.speed_sp = 1000
+            m.speed_sp = 10
+            self.assertEqual(motor0.attributes['speed_sp'], '10')
+            self.assertEqual(m.speed_sp, 10)
+            m._speed_sp.seek(0)
+            self.assertEqual(m._speed_sp.read(), b'10\n')
+
+            with self.assertRaises(ValueError):
+                m.speed_sp = ''
+
+            # Changes of state are reported as POLLPRI until state is read again
+            self.assertEqual(m.state, [])
+            poll = ev3dev2.get_backend().poll()
+            poll.register(m._state)
+            self.assertEqual(poll.poll(0), [])
+
+            motor0.set('state', 'running')
+            self.assertEqual(poll.poll(0), [(m._state, select.POLLPRI)])
+            self.assertEqual(m.state, ['running'])
+            self.assertEqual(poll.poll(0), [])
+
+            tank = MoveTank(OUTPUT_A, OUTPUT_B)
+            self.assertFalse(_internal_motor_set_wait(tank, lambda state: not state, timeout=10))
+            self.assertTrue(_internal_motor_set_wait(tank, lambda state: not state, mode=MotorSet.WAIT_ANY))
+
+            backend.remove_device('tacho-motor', 'motor0')
+            with self.assertRaises(ev3dev2.DeviceNotFound):
+                m.position
+            with self.assertRaises(ev3dev2.DeviceNotFound):
+                LargeMotor(OUTPUT_A)
+        finally:
+            ev3dev2.set_backend(SysfsBackend())
+
+    @unittest.skipIf(ev3dev2.is_micropython(), "the simulation is not available on micropython")
+    def test_simulation(self):
+        now = [0.0]
+        sim = SimulatedBackend(ev3dev2.Device.DEVICE_ROOT_PATH, time_source=lambda: now[0])
+        left = sim.add_motor('outA')
+        right = sim.add_motor('outB')
+        robot = sim.add_robot(left, right, wheel_diameter_mm=56, wheel_distance_mm=120)
+        sim.add_gyro_sensor('in2', robot)
+        sim.add_color_sensor('in3', robot, lambda x, y: 80 if x > 20 else 10, offset_mm=(50, 0))
+
+        ev3dev2.set_backend(sim)
+        try:
+            m = LargeMotor(OUTPUT_A)
+            m.run_to_rel_pos(position_sp=360, speed_sp=500, stop_action='hold')
+            now[0] = 0.2
+            self.assertEqual(m.state, ['running'])
+            self.assertEqual(m.speed, 500)
+            now[0] = 2
+            self.assertEqual(m.state, ['holding'])
+            self.assertAlmostEqual(m.position, 360, delta=1)
+
+            m.run_timed(time_sp=500, speed_sp=-300, stop_action='brake')
+            now[0] = 2.4
+            self.assertEqual(m.state, ['running'])
+            now[0] = 3
+            self.assertEqual(m.state, [])
+            self.assertEqual(m.speed, 0)
+
+            m.ramp_up_sp = 1000
+            m.run_forever(speed_sp=1050)
+            now[0] = 3.5
+            self.assertEqual(m.state, ['running', 'ramping'])
+            self.assertAlmostEqual(m.speed, 525, delta=50)
+
+            left.blocked = True
+            now[0] = 4
+            self.assertIn('stalled', m.state)
+            left.blocked = False
+            m.reset()
+            self.assertEqual(m.position, 0)
+
+            with self.assertRaises(ValueError):
+                m.speed_sp = 2000
+
+            # Spin clockwise in place, the gyro angle grows
+            tank = MoveTank(OUTPUT_A, OUTPUT_B)
+            gyro = GyroSensor('in2')
+            tank.on(SpeedNativeUnits(200), SpeedNativeUnits(-200))
+            now[0] = 5
+            tank.off()
+            now[0] = 6
+            self.assertGreater(gyro.angle, 45)
+            self.assertAlmostEqual(gyro.angle, 90 - robot.heading, delta=1)
+
+            # Face the x axis, the color sensor sees the bright half of the floor
+            robot.theta = 0
+            self.assertEqual(ColorSensor('in3').reflected_light_intensity, 80)
+        finally:
+            ev3dev2.set_backend(SysfsBackend())
+
+    @unittest.skipIf(ev3dev2.is_micropython(), "the simulation is not available on micropython")
+    def test_simulated_clock(self):
+        clock = SimulatedClock()
+        clock.sleep(1.5)
+        self.assertEqual(clock.now(), 1.5)
+        self.assertEqual(clock.ticks_ms(), 1500)
+        self.assertFalse(clock.expired(clock.deadline(None)))
+        self.assertTrue(clock.expired(clock.deadline(0)))
+
+        set_clock(clock)
+        sim = SimulatedBackend(ev3dev2.Device.DEVICE_ROOT_PATH)
+        left = sim.add_motor('outA')
+        right = sim.add_motor('outB')
+        robot = sim.add_robot(left, right, wheel_diameter_mm=56, wheel_distance_mm=120)
+
+        ev3dev2.set_backend(sim)
+        try:
+            # A minute long run only takes as long as computing it
+            tank = MoveTank(OUTPUT_A, OUTPUT_B)
+            tank.on_for_seconds(SpeedNativeUnits(360), SpeedNativeUnits(360), 60, block=False)
+            self.assertTrue(_internal_motor_set_wait(tank, lambda state: 'running' not in state))
+            self.assertAlmostEqual(clock.now(), 61.5, delta=0.1)
+            self.assertAlmostEqual(robot.y_mm, 60 * math.pi * 56, delta=100)
+
+            # Timeouts follow the clock too
+            tank.on(SpeedNativeUnits(360), SpeedNativeUnits(360))
+            self.assertFalse(_internal_motor_set_wait(tank, lambda state: 'running' not in state, timeout=2000))
+            self.assertAlmostEqual(clock.now(), 63.5, delta=0.2)
+        finally:
+            ev3dev2.set_backend(SysfsBackend())
+            set_clock(Clock())
+
+        self.assertIsNot(get_clock(), clock)
+
+    def test_control_loop(self):
+        clock = SimulatedClock()
+
+        def run(overrun):
+            starts = []
+            durations = [0.002, 0.025, 0.002, 0.002, 0.002]
+
+            def step():
+                starts.append(clock.now())
+                clock.sleep(durations[len(starts) - 1])
+
+            loop = ControlLoop(step, 0.01, overrun, clock=clock)
+            loop.run(iterations=len(durations))
+            return [round(start - starts[0], 6) for start in starts], loop.stats
+
+        # Missed deadlines are dropped, the loop keeps its phase
+        starts, stats = run(ControlLoop.SKIP)
+        self.assertEqual(starts, [0, 0.01, 0.04, 0.05, 0.06])
+        self.assertEqual((stats['iterations'], stats['overruns'], stats['skipped']), (4, 1, 2))
+        self.assertAlmostEqual(stats['period']['max'], 0.03)
+        self.assertAlmostEqual(stats['period']['mean'], 0.015)
+        self.assertAlmostEqual(stats['jitter']['max'], 0.02)
+        self.assertAlmostEqual(stats['jitter']['min'], 0)
+
+        # Late steps are made up for
+        starts, stats = run(ControlLoop.CATCH_UP)
+        self.assertEqual(starts, [0, 0.01, 0.035, 0.037, 0.04])
+        self.assertEqual((stats['overruns'], stats['skipped']), (2, 0))
+
+        with self.assertRaises(ValueError):
+            ControlLoop(None, 0.01, 'later')
+
+    def test_pid(self):
+        pid = PID(kp=2, ki=1, kd=0.5, kf=1)
+        self.assertEqual(pid.update(1, 0.1), 2 + 0.1)
+        self.assertAlmostEqual(pid.update(2, 0.1), 4 + 0.3 + 0.5 * 10)
+        self.assertAlmostEqual(pid.update(2, 0.1, feed_forward=3), 4 + 0.5 + 3)
+
+        pid.reset()
+        self.assertEqual((pid.integral, pid.derivative), (0, 0))
+
+        # Given the error before the first update, the first derivative is
+        # computed from it
+        pid.reset(last_error=0)
+        self.assertAlmostEqual(pid.update(1, 0.1), 2 + 0.1 + 0.5 * 10)
+
+        # The integral does not wind up while the output is saturated
+        pid = PID(kp=1, ki=1, output_min=-5, output_max=5)
+        for i in range(100):
+            self.assertEqual(pid.update(10, 0.1), 5)
+        self.assertAlmostEqual(pid.integral, 0)
+        self.assertEqual(pid.update(-1, 0.1), -1.1)
+
+        pid = PID(kp=0, ki=1, integral_limit=2)
+        for i in range(100):
+            pid.update(10, 0.1)
+        self.assertEqual(pid.output, 2)
+
+        # The derivative is low-pass filtered
+        pid = PID(kp=0, kd=1, derivative_filter=0.1)
+        pid.update(0, 0.1)
+        self.assertAlmostEqual(pid.update(1, 0.1), 5)
+        self.assertAlmostEqual(pid.update(1, 0.1), 2.5)
+
+    def test_motion_profiles(self):
+        # Accelerate for 0.5s, cruise for 1.5s, slow down for 0.5s
+        profile = TrapezoidalProfile(720, max_velocity=360, acceleration=720)
+        self.assertAlmostEqual(profile.duration, 2.5)
+        self.assertEqual(profile.sample(0.25), (22.5, 180))
+        self.assertEqual(profile.sample(1.25), (360, 360))
+        self.assertEqual(profile.sample(3), (720, 0))
+
+        # Too short to reach max_velocity
+        profile = TrapezoidalProfile(-90, max_velocity=360, acceleration=720)
+        self.assertAlmostEqual(profile.duration, 2 * math.sqrt(90 / 720))
+        self.assertAlmostEqual(profile.sample(profile.duration / 2)[0], -45)
+
+        with self.assertRaises(ValueError):
+            TrapezoidalProfile(10, max_velocity=360, acceleration=720, start_velocity=360)
+
+        # The jerk limit makes the move smoother but longer
+        profile = SCurveProfile(720, max_velocity=360, acceleration=720, jerk=1440)
+        self.assertAlmostEqual(profile.duration, 3)
+        self.assertAlmostEqual(profile.sample(0.5)[1], 1440 * 0.5 * 0.5 / 2)
+        self.assertAlmostEqual(profile.sample(1.5)[0], 360)
+        speeds = [profile.sample(i / 100)[1] for i in range(301)]
+        self.assertLessEqual(max(speeds), 360 + 1e-9)
+        self.assertLess(max([abs(b - a) for (a, b) in zip(speeds, speeds[1:])]), 720 / 100)
+
+        # Moves in the same direction blend, a reversal stops
+        blended = blend_moves([90, 270, -100], max_velocity=600, acceleration=2000, jerk=20000)
+        separate = [SCurveProfile(d, 600, 2000, 20000) for d in (90, 270, -100)]
+        self.assertAlmostEqual(blended.distance, 260)
+        self.assertLess(blended.duration, sum([profile.duration for profile in separate]))
+        self.assertGreater(blended.sample(separate[0].duration)[1], 0)
+        self.assertAlmostEqual(blended.sample(blended.duration - 1e-9)[0], 260)
+
+        (a, b) = synchronize(blended, TrapezoidalProfile(100, 300, 1000))
+        self.assertEqual(a.duration, b.duration)
+        self.assertAlmostEqual(b.sample(b.duration / 2)[0], 50)
+
+    @unittest.skipIf(ev3dev2.is_micropython(), "the simulation is not available on micropython")
+    def test_run_profiles_simulated(self):
+        set_clock(SimulatedClock())
+        sim = SimulatedBackend(ev3dev2.Device.DEVICE_ROOT_PATH)
+        sim.add_motor('outA')
+        sim.add_motor('outB')
+
+        ev3dev2.set_backend(sim)
+        try:
+            tank = MoveTank(OUTPUT_A, OUTPUT_B)
+            arm = blend_moves([180, 360], max_velocity=600, acceleration=2000, jerk=20000)
+            base = SCurveProfile(-360, max_velocity=600, acceleration=2000, jerk=20000)
+            executor = tank.run_profiles({OUTPUT_A: arm, OUTPUT_B: base})
+
+            self.assertAlmostEqual(tank.left_motor.position, 540, delta=3)
+            self.assertAlmostEqual(tank.right_motor.position, -360, delta=3)
+            self.assertEqual(executor.control_loop.stats['iterations'], executor.samples)
+
+            # Let the motor controller follow the positions
+            executor = tank.run_profiles({OUTPUT_A: base}, mode=ProfileExecutor.POSITION)
+            get_clock().sleep(0.5)
+            self.assertAlmostEqual(tank.left_motor.position, 180, delta=3)
+        finally:
+            ev3dev2.set_backend(SysfsBackend())
+            set_clock(Clock())
+
+    @unittest.skipIf(ev3dev2.is_micropython(), "the simulation is not available on micropython")
+    def test_profile_position_gain_simulated(self):
+        set_clock(SimulatedClock())
+        sim = SimulatedBackend(ev3dev2.Device.DEVICE_ROOT_PATH)
+        sim.add_motor('outA')
+
+        ev3dev2.set_backend(sim)
+        try:
+            m = LargeMotor(OUTPUT_A)
+
+            # At constant velocity, the position correction leaves no bias
+            cruise = TrapezoidalProfile(720, 360, 1000, start_velocity=360, end_velocity=360)
+            ProfileExecutor([(m, cruise)], period=0.02, position_gain=5).run()
+            self.assertAlmostEqual(m.position, 720, delta=2)
+        finally:
+            ev3dev2.set_backend(SysfsBackend())
+            set_clock(Clock())
+
+    def test_cam(self):
+        cam = Cam([(0, 0), (90, 0), (180, 90), (360, 0)])
+        self.assertEqual(cam.position(-10), 0)
+        self.assertEqual(cam.position(135), 45)
+        self.assertEqual(cam.position(270), 45)
+        self.assertEqual(cam.position(400), 0)
+        self.assertEqual(cam.slope(135), 1)
+        self.assertEqual(cam.slope(270), -0.5)
+        self.assertEqual(cam.slope(400), 0)
+
+        # Cyclic cams repeat, and carry on from the end of the previous cycle
+        cam = Cam([(0, 0), (180, 90), (360, 90)], cyclic=True)
+        self.assertEqual(cam.position(360 + 90), 135)
+        self.assertEqual(cam.position(-270), -45)
+        self.assertEqual(cam.slope(720 + 10), 0.5)
+
+        with self.assertRaises(ValueError):
+            Cam([(0, 0), (0, 10)])
+
+    @unittest.skipIf(ev3dev2.is_micropython(), "the simulation is not available on micropython")
+    def test_electronic_gearing_simulated(self):
+        set_clock(SimulatedClock())
+        sim = SimulatedBackend(ev3dev2.Device.DEVICE_ROOT_PATH)
+        sim.add_motor('outA')
+        sim.add_motor('outB')
+        sim.add_motor('outC', driver_name='lego-ev3-m-motor')
+
+        ev3dev2.set_backend(sim)
+        try:
+            master = LargeMotor(OUTPUT_A)
+            belt = LargeMotor(OUTPUT_B)
+            lift = MediumMotor(OUTPUT_C)
+            cam = Cam([(0, 0), (180, 90), (360, 0)], cyclic=True)
+            gearing = ElectronicGearing(master, [(belt, -0.5), (lift, cam)])
+
+            master.on(SpeedNativeUnits(360))
+            gearing.run(seconds=2.25)
+            master.stop()
+
+            self.assertAlmostEqual(master.position, 810, delta=10)
+            self.assertAlmostEqual(belt.position, -master.position / 2, delta=5)
+            self.assertAlmostEqual(lift.position, cam.position(master.position), delta=5)
+            self.assertNotIn('running', belt.state)
+
+            stats = gearing.stats
+            self.assertEqual(stats['samples'], gearing.control_loop.stats['iterations'])
+            self.assertLess(stats[OUTPUT_B]['max'], 10)
+            self.assertLess(stats[OUTPUT_C]['rms'], stats[OUTPUT_C]['max'])
+        finally:
+            ev3dev2.set_backend(SysfsBackend())
+            set_clock(Clock())
+
+    @unittest.skipIf(ev3dev2.is_micropython(), "the simulation is not available on micropython")
+    def test_electronic_gearing_error(self):
+        class BrokenCam(Cam):
+            def position(self, master):
+                raise RuntimeError("broken cam")
+
+        sim = SimulatedBackend(ev3dev2.Device.DEVICE_ROOT_PATH)
+        sim.add_motor('outA')
+        sim.add_motor('outB')
+
+        ev3dev2.set_backend(sim)
+        try:
+            master = LargeMotor(OUTPUT_A)
+            slave = LargeMotor(OUTPUT_B)
+            gearing = ElectronicGearing(master, [(slave, BrokenCam([(0, 0), (360, 360)]))])
+
+            slave.on(SpeedNativeUnits(200))
+
+            # The thread dies at its first step, stopping the slave
+            gearing.start()
+
+            with gearing._thread_lock:
+                pass
+
+            self.assertNotIn('running', slave.state)
+
+            with self.assertRaises(RuntimeError):
+                gearing.stop()
+
+            # The error is only raised once
+            gearing.stop()
+
+            # And the same from a context manager
+            with self.assertRaises(RuntimeError):
+                with gearing:
+                    with gearing._thread_lock:
+                        pass
+        finally:
+            ev3dev2.set_backend(SysfsBackend())
+
+    @unittest.skipIf(ev3dev2.is_micropython(), "the simulation is not available on micropython")
+    def test_electronic_gearing_stop_run(self):
+        import threading
+        import time
+
+        sim = SimulatedBackend(ev3dev2.Device.DEVICE_ROOT_PATH)
+        sim.add_motor('outA')
+        sim.add_motor('outB')
+
+        ev3dev2.set_backend(sim)
+        try:
+            master = LargeMotor(OUTPUT_A)
+            slave = LargeMotor(OUTPUT_B)
+            gearing = ElectronicGearing(master, [(slave, 1)])
+
+            # run() without a duration only ends when another thread stops it
+            runner = threading.Thread(target=gearing.run)
+            runner.daemon = True
+            runner.start()
+            time.sleep(0.1)
+
+            gearing.stop()
+            runner.join(5)
+
+            self.assertFalse(runner.is_alive())
+            self.assertNotIn('running', slave.state)
+        finally:
+            ev3dev2.set_backend(SysfsBackend())
+
+    @unittest.skipIf(ev3dev2.is_micropython(), "the simulation is not available on micropython")
+    def test_predicted_waits(self):
+        class RecordingClock(SimulatedClock):
+            def poll(self, poller, timeout_ms):
+                self.timeouts.append(timeout_ms)
+                return SimulatedClock.poll(self, poller, timeout_ms)
+
+        clock = set_clock(RecordingClock())
+        sim = SimulatedBackend(ev3dev2.Device.DEVICE_ROOT_PATH)
+        sim.add_motor('outA')
+        sim.add_motor('outB')
+
+        ev3dev2.set_backend(sim)
+        Motor.wait = _internal_motor_wait
+        MotorSet.wait = _internal_motor_set_wait
+        try:
+            m = LargeMotor(OUTPUT_A)
+
+            # Ramps from 0 to max_speed in 1s: 0.5s and 131.25 counts to reach
+            # 525 counts/s, 1s at full speed, 0.5s and 131.25 counts to stop
+            m.ramp_up_sp = 1000
+            m.ramp_down_sp = 1000
+            m.speed_sp = 525
+            self.assertAlmostEqual(m.predict_stop_time(distance=787.5) - clock.now(), 2)
+            self.assertAlmostEqual(m.predict_stop_time(distance=125) - clock.now(), 2 * math.sqrt(125 / 1050))
+            self.assertAlmostEqual(m.predict_stop_time(seconds=1) - clock.now(), 1.5)
+
+            # The state is checked every 100ms, then every 5ms from shortly
+            # before the predicted end
+            m.ramp_up_sp = 0
+            m.ramp_down_sp = 0
+            clock.timeouts = []
+            start = clock.now()
+            m.on_for_degrees(SpeedNativeUnits(1000), 3000)
+            self.assertGreater(clock.now() - start, 3)
+            self.assertNotIn('running', m.state)
+            self.assertAlmostEqual(m.position, 3000, delta=2)
+            self.assertEqual(clock.timeouts[1:4], [100, 100, 100])
+            self.assertEqual(clock.timeouts[-1], ev3dev2.motor.WAIT_FINISH_POLL)
+
+            # Motor sets wait for their slowest motor
+            tank = MoveTank(OUTPUT_A, OUTPUT_B)
+            tank.on_for_degrees(SpeedNativeUnits(1000), SpeedNativeUnits(500), 720)
+            self.assertFalse(tank.is_running)
+            self.assertAlmostEqual(tank.right_motor.position, 360, delta=2)
+        finally:
+            Motor.wait = dummy_wait
+            MotorSet.wait = dummy_motor_set_wait
+            ev3dev2.set_backend(SysfsBackend())
+            set_clock(Clock())
+
+    @unittest.skipIf(ev3dev2.is_micropython(), "the simulation is not available on micropython")
+    def test_move_handles(self):
+        clock = set_clock(SimulatedClock())
+        sim = SimulatedBackend(ev3dev2.Device.DEVICE_ROOT_PATH)
+        sim.add_motor('outA')
+        sim.add_motor('outB')
+        sim.add_motor('outC', driver_name='lego-ev3-m-motor')
+
+        ev3dev2.set_backend(sim)
+        try:
+            tank = MoveTank(OUTPUT_A, OUTPUT_B)
+            arm = MediumMotor(OUTPUT_C)
+            done = []
+
+            # Overlapping moves, watched by the same thread
+            drive_move = tank.on_for_degrees(SpeedNativeUnits(500), SpeedNativeUnits(500), 720, block=False)
+            arm_move = arm.on_for_degrees(SpeedNativeUnits(1000), 90, block=False)
+            self.assertIsInstance(drive_move, MoveHandle)
+            self.assertEqual(drive_move.motors, [tank.left_motor, tank.right_motor])
+            self.assertFalse(arm_move.done())
+            arm_move.add_done_callback(done.append)
+
+            start = clock.now()
+            self.assertTrue(drive_move.wait())
+            self.assertGreater(clock.now() - start, 1)
+            self.assertTrue(drive_move.done())
+            self.assertFalse(drive_move.cancelled())
+            self.assertFalse(tank.is_running)
+            self.assertAlmostEqual(tank.right_motor.position, 720, delta=2)
+
+            # The arm ended first, its callback already ran
+            self.assertTrue(arm_move.done())
+            self.assertEqual(done, [arm_move])
+            self.assertAlmostEqual(arm.position, 90, delta=2)
+
+            # Callbacks added later are called at once
+            drive_move.add_done_callback(done.append)
+            self.assertEqual(done, [arm_move, drive_move])
+
+            # Timeouts and cancellation
+            move = arm.on_for_seconds(SpeedNativeUnits(500), 10, block=False)
+            start = clock.now()
+            self.assertFalse(move.wait(timeout=500))
+            self.assertAlmostEqual(clock.now() - start, 0.5, delta=0.1)
+
+            # The thread reads the state through its own file
+            arm.state_flags
+            for i in range(1000):
+                if arm in ev3dev2.motor._move_waiter._states:
+                    break
+                Clock().sleep(0.001)
+            self.assertIn(arm, ev3dev2.motor._move_waiter._states)
+            self.assertIsNot(ev3dev2.motor._move_waiter._states[arm], arm._state)
+
+            self.assertTrue(move.cancel())
+            self.assertTrue(move.done())
+            self.assertTrue(move.cancelled())
+            self.assertFalse(move.cancel())
+            self.assertNotIn('running', arm.state)
+
+            # The background thread ends with the last move
+            for i in range(1000):
+                if not ev3dev2.motor._move_waiter._running:
+                    break
+                Clock().sleep(0.001)
+            self.assertFalse(ev3dev2.motor._move_waiter._running)
+            self.assertEqual(ev3dev2.motor._move_waiter._states, {})
+        finally:
+            ev3dev2.set_backend(SysfsBackend())
+            set_clock(Clock())
+
+    @unittest.skipIf(ev3dev2.is_micropython(), "the simulation is not available on micropython")
+    def test_odometry_simulated(self):
+        clock = set_clock(SimulatedClock())
+        sim = SimulatedBackend(ev3dev2.Device.DEVICE_ROOT_PATH)
+        left = sim.add_motor('outA')
+        right = sim.add_motor('outB')
+        robot = sim.add_robot(left, right, wheel_diameter_mm=43.2, wheel_distance_mm=120)
+
+        ev3dev2.set_backend(sim)
+        try:
+            mdiff = MoveDifferential(OUTPUT_A, OUTPUT_B, EV3Tire, 120)
+            odometry = mdiff.odometry
+            odometry.reset(theta=math.radians(90))
+            odometry.update()
+
+            # Half a turn along an arc, sampled every 50ms: straight steps
+            # would cut the corners
+            mdiff.on(SpeedNativeUnits(400), SpeedNativeUnits(200))
+            for i in range(40):
+                clock.sleep(0.05)
+                odometry.update()
+            mdiff.off()
+
+            self.assertAlmostEqual(mdiff.x_pos_mm, robot.x_mm, delta=0.5)
+            self.assertAlmostEqual(mdiff.y_pos_mm, robot.y_mm, delta=0.5)
+            self.assertAlmostEqual(mdiff.theta, robot.theta, delta=0.01)
+
+            # Poses in between samples are interpolated
+            self.assertEqual(len(odometry), 41)
+            poses = odometry.poses()
+            (t, x, y, theta) = poses[10]
+            self.assertAlmostEqual(t, 0.5)
+            (x_mid, y_mid, theta_mid) = odometry.pose_at(t + 0.025)
+            self.assertAlmostEqual(x_mid, (x + poses[11][1]) / 2)
+            self.assertAlmostEqual(theta_mid, (theta + poses[11][3]) / 2)
+            self.assertEqual(odometry.pose_at(10), poses[-1][1:])
+            self.assertIsNone(odometry.pose_at(-1))
+            self.assertEqual(odometry.stats['samples'], 41)
+
+            # Only the last poses are kept
+            recent = Odometry(mdiff.left_motor, mdiff.right_motor, 136, 120, capacity=10)
+            times = [recent.update()]
+            for i in range(24):
+                clock.sleep(0.01)
+                times.append(recent.update())
+            self.assertEqual([pose[0] for pose in recent.poses()], times[-10:])
+            self.assertIsNone(recent.pose_at(times[-11]))
+
+            # The thread has sampled once when odometry_start() returns
+            mdiff.odometry_start(theta_degrees_start=0, x_pos_start=100)
+            self.assertTrue(mdiff.odometry_thread_run)
+            self.assertAlmostEqual(mdiff.x_pos_mm, 100, delta=5)
+            self.assertAlmostEqual(mdiff.theta, 0, delta=0.1)
+            mdiff.odometry_stop()
+            self.assertFalse(mdiff.odometry_thread_run)
+
+            # The pose can still be set as attributes, which keeps the
+            # recorded poses
+            poses = odometry.poses()
+            mdiff.x_pos_mm = 10
+            mdiff.y_pos_mm = 20
+            mdiff.theta = math.radians(45)
+            self.assertEqual((odometry.x_mm, odometry.y_mm), (10, 20))
+            self.assertAlmostEqual(odometry.theta, math.radians(45))
+            self.assertEqual(odometry.poses(), poses)
+            self.assertEqual(odometry.pose_at(poses[0][0]), poses[0][1:])
+
+            # The next sample moves on from the new pose
+            odometry.update()
+            self.assertEqual(len(odometry), len(poses) + 1)
+            self.assertEqual(odometry.poses()[-1][1:], (10, 20, odometry.theta))
+
+            mdiff.odometry_thread_run = True
+            self.assertTrue(odometry.running)
+            mdiff.odometry_thread_run = False
+            self.assertFalse(odometry.running)
+            self.assertAlmostEqual(mdiff.x_pos_mm, 10, delta=1)
+        finally:
+            ev3dev2.set_backend(SysfsBackend())
+            set_clock(Clock())
+
+    @unittest.skipIf(ev3dev2.is_micropython(), "the simulation is not available on micropython")
+    def test_gyro_odometry_simulated(self):
+        clock = set_clock(SimulatedClock())
+        sim = SimulatedBackend(ev3dev2.Device.DEVICE_ROOT_PATH)
+        left = sim.add_motor('outA')
+        right = sim.add_motor('outB')
+        robot = sim.add_robot(left, right, wheel_diameter_mm=43.2, wheel_distance_mm=120)
+        sim.add_gyro_sensor('in2', robot)
+
+        ev3dev2.set_backend(sim)
+        try:
+            # The wheels are 120mm apart, not 100mm: the encoders overestimate
+            # the turns by 20%, as when the wheels slip
+            mdiff = MoveDifferential(OUTPUT_A, OUTPUT_B, EV3Tire, 100)
+            gyro = GyroSensor('in2')
+            fused = Odometry(mdiff.left_motor, mdiff.right_motor, mdiff.wheel.circumference_mm, 100, gyro=gyro)
+            encoders = Odometry(mdiff.left_motor, mdiff.right_motor, mdiff.wheel.circumference_mm, 100)
+            fused.reset(theta=robot.theta)
+            encoders.reset(theta=robot.theta)
+
+            mdiff.on(SpeedNativeUnits(-300), SpeedNativeUnits(300))
+            for i in range(100):
+                fused.update()
+                encoders.update()
+                clock.sleep(0.01)
+            mdiff.off()
+            fused.update()
+            encoders.update()
+
+            turn = robot.theta - math.radians(90)
+            self.assertGreater(turn, math.radians(90))
+            self.assertAlmostEqual(encoders.theta - math.radians(90), turn * 1.2, delta=math.radians(2))
+            self.assertAlmostEqual(fused.theta, robot.theta, delta=math.radians(3))
+
+            # Turning to a fused heading takes a single pass
+            mdiff.odometry.gyro = gyro
+            mdiff.odometry.reset(theta=robot.theta)
+            start = robot.heading
+            mdiff.turn_degrees(SpeedNativeUnits(400), 120, error_margin=1)
+            self.assertAlmostEqual(robot.heading, start - 120, delta=3)
+            self.assertLess(mdiff.control_loop.stats['iterations'], 300)
+
+            with self.assertRaises(ev3dev2.DeviceNotDefined):
+                MoveDifferential(OUTPUT_A, OUTPUT_B, EV3Tire, 100).odometry_start(use_gyro=True)
+        finally:
+            ev3dev2.set_backend(SysfsBackend())
+            set_clock(Clock())
+
+    @unittest.skipIf(ev3dev2.is_micropython(), "the simulation is not available on micropython")
+    def test_follow_path_simulated(self):
+        clock = set_clock(SimulatedClock())
+        sim = SimulatedBackend(ev3dev2.Device.DEVICE_ROOT_PATH)
+        left = sim.add_motor('outA')
+        right = sim.add_motor('outB')
+        robot = sim.add_robot(left, right, wheel_diameter_mm=43.2, wheel_distance_mm=120)
+
+        ev3dev2.set_backend(sim)
+        try:
+            mdiff = MoveDifferential(OUTPUT_A, OUTPUT_B, EV3Tire, 120)
+            mdiff.odometry.reset(theta=math.radians(90))
+
+            with self.assertRaises(ValueError):
+                mdiff.follow_path(SpeedNativeUnits(500), [])
+
+            self.assertFalse(mdiff.is_running)
+
+            # 900mm around three sides of a square, at about 190mm/s
+            mdiff.follow_path(SpeedNativeUnits(500), [(0, 300), (300, 300), (300, 0)], tolerance_mm=5)
+
+            self.assertAlmostEqual(robot.x_mm, 300, delta=10)
+            self.assertAlmostEqual(robot.y_mm, 0, delta=10)
+            self.assertFalse(mdiff.is_running)
+
+            # The robot did not stop at the corners, and cut them a little
+            self.assertLess(clock.now(), 5.5)
+            self.assertLess(min([math.hypot(x - 300, y - 300) for (t, x, y, theta) in mdiff.odometry.poses()]), 50)
+            self.assertLess(max([abs(x) for (t, x, y, theta) in mdiff.odometry.poses() if y < 200 and x < 150]), 5)
+        finally:
+            ev3dev2.set_backend(SysfsBackend())
+            set_clock(Clock())
+
+    def test_dubins(self):
+        # Reaching the same pose further ahead takes a straight line
+        self.assertEqual(ev3dev2.planner.dubins((0, 0, 90), (0, 500, 90), 100), [('S', 500)])
+
+        # Every path ends at its end pose
+        for (start, end) in (((0, 0, 90), (300, 300, 0)), ((0, 0, 0), (-100, 50, 180)), ((10, 20, 45), (0, 0, -30))):
+            (x, y, heading) = ev3dev2.planner.advance(start, ev3dev2.planner.dubins(start, end, 80), 80)
+            self.assertAlmostEqual(x, end[0])
+            self.assertAlmostEqual(y, end[1])
+            self.assertAlmostEqual(math.cos(math.radians(heading - end[2])), 1)
+
+        # Consecutive segments of the same kind are merged
+        segments = ev3dev2.planner.plan_segments([(0, 0, 90), (0, 200, 90), (0, 400, 90)], 60)
+        self.assertEqual(segments, [('S', 400)])
+
+    @unittest.skipIf(ev3dev2.is_micropython(), "the simulation is not available on micropython")
+    def test_route_plan_simulated(self):
+        set_clock(SimulatedClock())
+        sim = SimulatedBackend(ev3dev2.Device.DEVICE_ROOT_PATH)
+        left = sim.add_motor('outA')
+        right = sim.add_motor('outB')
+        robot = sim.add_robot(left, right, wheel_diameter_mm=43.2, wheel_distance_mm=120)
+
+        ev3dev2.set_backend(sim)
+        try:
+            mdiff = MoveDifferential(OUTPUT_A, OUTPUT_B, EV3Tire, 120)
+
+            with self.assertRaises(ValueError):
+                mdiff.plan_route([(0, 0, 90), (300, 300, 0)], 50, radius_mm=50)
+
+            # A lap, driven twice from the same plan
+            lap = mdiff.plan_route([(0, 0, 90), (300, 300, 0), (600, 0, -90), (0, 0, 90)], SpeedNativeUnits(600),
+                                   radius_mm=100)
+            self.assertEqual([kind for (kind, length) in lap.segments][:2], ['R', 'S'])
+            self.assertEqual(lap.executor.position_gain, 2.0)
+            self.assertEqual(mdiff.plan_route(lap.poses, 50, position_gain=0).executor.position_gain, 0)
+
+            for i in range(2):
+                start = get_clock().now()
+                lap.run()
+                self.assertAlmostEqual(get_clock().now() - start, lap.duration, delta=0.1)
+                self.assertAlmostEqual(robot.x_mm, 0, delta=15)
+                self.assertAlmostEqual(robot.y_mm, 0, delta=15)
+                self.assertAlmostEqual(robot.heading % 360, 90, delta=5)
+        finally:
+            ev3dev2.set_backend(SysfsBackend())
+            set_clock(Clock())
+
+    def test_occupancy_grid(self):
+        grids = [OccupancyGrid(1000, 1000, 50, origin=(-500, -500), use_numpy=False)]
+
+        if ev3dev2.mapping.numpy is not None:
+            grids.append(OccupancyGrid(1000, 1000, 50, origin=(-500, -500)))
+
+        for grid in grids:
+            self.assertEqual(grid.nbytes, 400)
+            self.assertEqual(grid.plan((0, 0), (400, 0)), [(400, 0)])
+
+            # A wall 200mm ahead, from y=-300 to y=300, and nothing beyond
+            for angle in range(-60, 61, 2):
+                distance_mm = 200 / math.cos(math.radians(angle))
+
+                if abs(distance_mm * math.sin(math.radians(angle))) > 300:
+                    distance_mm = 2550
+
+                for i in range(3):
+                    grid.update((0, 0, math.radians(angle)), distance_mm)
+
+            self.assertGreater(grid.probability(210, 0), 0.95)
+            self.assertLess(grid.probability(100, 0), 0.05)
+            self.assertEqual(grid.probability(-300, -300), 0.5)
+
+            # Around the wall
+            waypoints = grid.plan((0, 0), (400, 0), clearance_mm=50)
+            self.assertEqual(waypoints[-1], (400, 0))
+            self.assertGreater(max([abs(y) for (x, y) in waypoints]), 300)
+
+            # Walled in
+            self.assertIsNone(grid.plan((0, 0), (400, 0), clearance_mm=400))
+
+            with self.assertRaises(ValueError):
+                grid.plan((0, 0), (600, 0))
+
+        if len(grids) == 2:
+            self.assertEqual(list(grids[0].log_odds), list(grids[1].log_odds.flatten()))
+
+    @unittest.skipIf(ev3dev2.is_micropython(), "the simulation is not available on micropython")
+    def test_mapping_simulated(self):
+        clock = set_clock(SimulatedClock())
+        sim = SimulatedBackend(ev3dev2.Device.DEVICE_ROOT_PATH)
+        left = sim.add_motor('outA')
+        right = sim.add_motor('outB')
+        robot = sim.add_robot(left, right, wheel_diameter_mm=43.2, wheel_distance_mm=120)
+
+        ev3dev2.set_backend(sim)
+        try:
+            mdiff = MoveDifferential(OUTPUT_A, OUTPUT_B, EV3Tire, 120)
+            mdiff.odometry.reset(theta=math.radians(90))
+            grid = OccupancyGrid(1000, 1000, 50, origin=(-500, -500), use_numpy=False)
+
+            # Looking right, then ahead, at a wall 200mm away
+            before = clock.now()
+            clock.sleep(0.1)
+            mdiff.odometry.update()
+            mdiff.turn_right(SpeedNativeUnits(300), 90)
+            mdiff.odometry.update()
+            mdiff.turn_left(SpeedNativeUnits(300), 90)
+            mdiff.odometry.update()
+
+            samples = [(before, 100), (clock.now(), 200)]
+            self.assertEqual(grid.update_from(mdiff.odometry, samples), 1)
+            self.assertGreater(grid.probability(0, 210), 0.5)
+
+            waypoints = grid.plan((mdiff.x_pos_mm, mdiff.y_pos_mm), (0, 400), clearance_mm=50)
+            mdiff.follow_path(SpeedNativeUnits(500), waypoints, lookahead_mm=60, tolerance_mm=5)
+
+            self.assertAlmostEqual(robot.x_mm, 0, delta=10)
+            self.assertAlmostEqual(robot.y_mm, 400, delta=10)
+            self.assertGreater(max([abs(x) for (t, x, y, theta) in mdiff.odometry.poses()]), 50)
+        finally:
+            ev3dev2.set_backend(SysfsBackend())
+            set_clock(Clock())
+
+    @unittest.skipIf(ev3dev2.is_micropython(), "the simulation is not available on micropython")
+    def test_turn_degrees_pid_simulated(self):
+        clock = set_clock(SimulatedClock())
+        sim = SimulatedBackend(ev3dev2.Device.DEVICE_ROOT_PATH)
+        left = sim.add_motor('outA')
+        right = sim.add_motor('outB')
+        robot = sim.add_robot(left, right, wheel_diameter_mm=56, wheel_distance_mm=120)
+        sim.add_gyro_sensor('in2', robot)
+
+        ev3dev2.set_backend(sim)
+        try:
+            tank = MoveTank(OUTPUT_A, OUTPUT_B)
+            tank.gyro = GyroSensor('in2')
+            tank.turn_degrees(SpeedNativeUnits(500), 90, error_margin=1, pid=PID(kp=20, ki=5))
+            self.assertAlmostEqual(tank.gyro.angle, 90, delta=2)
+            self.assertAlmostEqual(robot.heading, 0, delta=2)
+
+            # Close to the target, the output of a weak controller is below
+            # the minimum speed, which keeps the robot turning
+            start = clock.now()
+            tank.turn_degrees(SpeedNativeUnits(500), -90, error_margin=1, pid=PID(kp=0.5),
+                              min_speed=SpeedNativeUnits(100))
+            self.assertAlmostEqual(tank.gyro.angle, 0, delta=2)
+            self.assertLess(clock.now() - start, 10)
+        finally:
+            ev3dev2.set_backend(SysfsBackend())
+            set_clock(Clock())
+
+    @unittest.skipIf(ev3dev2.is_micropython(), "the simulation is not available on micropython")
+    def test_follow_line_simulated(self):
+        clock = set_clock(SimulatedClock())
+        sim = SimulatedBackend(ev3dev2.Device.DEVICE_ROOT_PATH)
+        left = sim.add_motor('outA')
+        right = sim.add_motor('outB')
+        robot = sim.add_robot(left, right, wheel_diameter_mm=56, wheel_distance_mm=120, x_mm=-20)
+
+        # The edge of the line is along the y axis, darker on the right
+        sim.add_color_sensor('in3', robot, lambda x, y: 45 - x, offset_mm=(50, 0))
+
+        ev3dev2.set_backend(sim)
+        try:
+            tank = MoveTank(OUTPUT_A, OUTPUT_B)
+            tank.cs = ColorSensor('in3')
+            tank.follow_line(kp=3, ki=0, kd=0, speed=SpeedNativeUnits(300), target_light_intensity=45, white=100,
+                             follow_for=lambda tank: clock.now() < 10)
+
+            self.assertAlmostEqual(robot.point(50, 0)[0], 0, delta=2)
+            self.assertGreater(robot.y_mm, 1000)
+
+            stats = tank.control_loop.stats
+            self.assertAlmostEqual(stats['iterations'], 1000, delta=1)
+            self.assertEqual(stats['overruns'], 0)
+            self.assertAlmostEqual(stats['period']['p99'], 0.01)
+
+            # The first derivative term of the followers is the first error,
+            # as it was before they used a PID
+            controller, time_step = tank._follower_pid(0, 0, 1, None)
+            self.assertEqual(controller.update(5, time_step()), 5)
+        finally:
+            ev3dev2.set_backend(SysfsBackend())
+            set_clock(Clock())
+
     def test_motor_on_for_degrees(self):
         clean_arena()
         populate_arena([('large_motor', 0, 'outA')])